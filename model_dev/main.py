@@ -1,20 +1,59 @@
+import os
+from functools import lru_cache
 import pandas as pd #type: ignore
 from utils.feature_extractions.graph_feature_extractor import GraphFeatureExtractor
+from utils.feature_extractions.feature_cache import FeatureCache, graph_fingerprint
+from utils.feature_extractions.graph_engine import CSRGraph
+from utils.feature_extractions.node_feature_pipeline import build_node_features
+from utils.feature_extractions.node_embeddings import NodeEmbedder
+from utils.feature_extractions.feature_engineering import FeatureEngineeringTransformer
 from utils.trainings.isolation_forest_trainer import (
     train_isolation_forest
 )
+from utils.trainings.model_registry import ModelRegistry
 from utils.evaluations.isolation_forest_evaluator import (
     evaluate_isolation_forest
 )
 
 graph_extractor = GraphFeatureExtractor()
-df = graph_extractor.extract_node_features()
+feature_cache = FeatureCache()
+fingerprint = graph_fingerprint(graph_extractor.mg_client)
+
+@lru_cache(maxsize=None)
+def account_graph() -> CSRGraph:
+    # Edge list pulled from Memgraph once per run, and only when a stage misses the cache
+    return CSRGraph.from_memgraph(graph_extractor.mg_client)
+
+df, _ = feature_cache.get_or_compute(
+    "node_features",
+    fingerprint,
+    # The cycle index is kept with the cached features of this snapshot
+    lambda: build_node_features(
+        graph_extractor,
+        account_graph(),
+        cycle_index_path=feature_cache.artifact_path("node_features", fingerprint, "cycle_index.npz")
+    )
+)
 
 # Step 1: Preprocess the data and engineer features
-processed_df, metadata = graph_extractor.apply_feature_engineering(df)
+# LOW_MEMORY_FEATURES=true keeps float32 / categorical frames and reports peak memory
+low_memory = os.getenv("LOW_MEMORY_FEATURES", "false").lower() == "true"
+processed_df, metadata = feature_cache.get_or_compute(
+    "engineered_features_low_memory" if low_memory else "engineered_features",
+    fingerprint,
+    lambda: graph_extractor.apply_feature_engineering(df, low_memory=low_memory, report_memory=low_memory)
+)
 print(processed_df)
 print(metadata)
 
+# Structural embeddings as extra model inputs, cached per graph snapshot and embedding settings
+embedder = NodeEmbedder(method="spectral", dim=32)
+embeddings, _ = feature_cache.get_or_compute(
+    "node_embeddings",
+    {**fingerprint, **embedder.settings},
+    lambda: embedder.embed(account_graph())
+)
+
 # Option 2: Get results and trained models (for later prediction on new data)
 result_df, summary, isolation_forst_model = train_isolation_forest(
     processed_df, 
@@ -23,12 +62,36 @@ result_df, summary, isolation_forst_model = train_isolation_forest(
     n_estimators=200,
     apply_pca=True,
     pca_components=0.9,
-    return_model=True        # Return trained models
+    return_model=True,       # Return trained models
+    extra_features=embeddings,
+    low_memory=low_memory
 )
 
 # View the summary
 print(summary)
 
+# Persist the bundle so scoring jobs can load it instead of retraining
+model_registry = ModelRegistry()
+model_version = model_registry.save(
+    isolation_forst_model,
+    metadata,
+    fingerprint=fingerprint,
+    metrics=summary,
+    training_df=processed_df
+)
+model_registry.prune(keep=5)
+
+# Optional graph model: adds graphsage_score next to anomaly_score (needs torch-geometric with pyg-lib or torch-sparse)
+if os.getenv("TRAIN_GRAPHSAGE", "false").lower() == "true":
+    from utils.trainings.graphsage_trainer import train_graphsage
+    result_df, graphsage_summary = train_graphsage(
+        result_df,
+        metadata,
+        account_graph(),
+        num_workers=2
+    )
+    print(graphsage_summary)
+
 # Get top 20 most anomalous accounts
 top_anomalies = result_df.sort_values('anomaly_probability', ascending=False).head(20)
 print(top_anomalies[['account_id', 'anomaly_probability', 'anomaly_percentile']])
@@ -48,24 +111,35 @@ except Exception as e:
 print(feature_importance_alt)
 
 def predict_anomalies(new_df, metadata, models):
-    processed_new_df, _ = graph_extractor.apply_feature_engineering(new_df)
-    features = metadata['features_for_model']
+    # Frozen training-time feature engineering, independent of the rest of the batch
+    feature_transformer = FeatureEngineeringTransformer.from_dict(metadata['feature_engineering'])
+    processed_new_df = feature_transformer.transform(new_df)
+    if models.get('extra_features'):
+        # The embedding table stored with the model version, not whatever this process computed
+        processed_new_df = processed_new_df.merge(models['extra_feature_table'], on='account_id', how='left')
+        processed_new_df[models['extra_features']] = processed_new_df[models['extra_features']].fillna(0)
+    features = models.get('features', metadata['features_for_model'])
     X = models['scaler'].transform(processed_new_df[features])
     
     if 'pca' in models:
         X = models['pca'].transform(X)
     
-    raw_predictions = models['isolation_forest'].predict(X)
-    decision_scores = models['isolation_forest'].decision_function(X)
-    processed_new_df['anomaly_flag'] = raw_predictions == -1
+    # One pass over the flattened trees instead of predict + decision_function
+    anomaly_flags, decision_scores, _ = models['scorer'].score(X, n_jobs=-1)
+    processed_new_df['anomaly_flag'] = anomaly_flags
     processed_new_df['anomaly_score'] = decision_scores
+    # Calibrated on the training scores, independent of the rest of this batch
+    processed_new_df['anomaly_probability'] = models['calibrator'].probability(decision_scores)
+    processed_new_df['anomaly_percentile'] = models['calibrator'].percentile(decision_scores)
     
     return processed_new_df
 
+# Score with the registered bundle, as a separate scoring job would (scorer arrays memory-mapped)
+registered_models, registered_metadata, _ = model_registry.load(model_version)
 new_result = predict_anomalies(
     df,
-    metadata,
-    isolation_forst_model
+    registered_metadata,
+    registered_models
 )
 
 print("Ground Truth: ", df["is_anomalies_account"].value_counts()) 
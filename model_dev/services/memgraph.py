@@ -33,4 +33,20 @@ class MemgraphClient:
             return list(self.connection.execute_and_fetch(query, params or {}))
         except Exception as e:
             print(f"❌ Query Execution Failed: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def execute_write(self, query, params=None):
+        """
+        Execute a write query and let failures propagate so callers can retry.
+        """
+        if not self.connection:
+            raise ConnectionError("No Active Memgraph Connection.")
+        self.connection.execute(query, params or {})
+
+    def stream_query(self, query, params=None):
+        """
+        Yield result rows one by one instead of materializing the whole result list.
+        """
+        if not self.connection:
+            raise ConnectionError("No Active Memgraph Connection.")
+        yield from self.connection.execute_and_fetch(query, params or {})
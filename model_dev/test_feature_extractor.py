@@ -1,5 +1,8 @@
 import pandas as pd #type: ignore
 from utils.feature_extractions.graph_feature_extractor import GraphFeatureExtractor
+from utils.feature_extractions.feature_cache import FeatureCache, graph_fingerprint
+from utils.feature_extractions.graph_engine import CSRGraph
+from utils.feature_extractions.node_feature_pipeline import build_node_features
 from utils.trainings.isolation_forest_trainer import (
     train_isolation_forest
 )
@@ -8,10 +11,26 @@ from utils.evaluations.isolation_forest_evaluator import (
 )
 
 graph_extractor = GraphFeatureExtractor()
-df = graph_extractor.extract_node_features()
+feature_cache = FeatureCache()
+fingerprint = graph_fingerprint(graph_extractor.mg_client)
+
+df, _ = feature_cache.get_or_compute(
+    "node_features",
+    fingerprint,
+    # The cycle index is kept with the cached features of this snapshot
+    lambda: build_node_features(
+        graph_extractor,
+        CSRGraph.from_memgraph(graph_extractor.mg_client),
+        cycle_index_path=feature_cache.artifact_path("node_features", fingerprint, "cycle_index.npz")
+    )
+)
 
 # Step 1: Preprocess the data and engineer features
-processed_df, metadata = graph_extractor.apply_feature_engineering(df)
+processed_df, metadata = feature_cache.get_or_compute(
+    "engineered_features",
+    fingerprint,
+    lambda: graph_extractor.apply_feature_engineering(df)
+)
 print(processed_df)
 print(metadata)
 
@@ -0,0 +1,385 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Dict, Optional
+import json
+import logging
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+import pyarrow.feather as feather #type: ignore
+
+from utils.feature_extractions.local_feature_engine import (
+    load_transactions,
+    derive_node_features,
+    SMALL_TXN_USD,
+    HIGH_TXN_USD
+)
+
+TRANSACTION_RETURN = '''
+    RETURN
+        a.account_id AS account_id,
+        a.bank AS from_bank,
+        r.account_id AS receiver_account_id,
+        r.bank AS to_bank,
+        t.timestamp AS timestamp,
+        t.usd_amount AS usd_amount,
+        t.payment_format AS payment_format,
+        t.is_laundering AS is_laundering,
+        t.load_id AS load_id
+'''
+
+# First run: the whole history, no predicate to evaluate per transaction
+ALL_TRANSACTIONS_QUERY = '''
+    MATCH (a:Account)-[:FROM]->(t:Transaction)-[:TO]->(r:Account)
+''' + TRANSACTION_RETURN
+
+# Later runs: transactions of loads after the last one consumed, a range on the
+# :Transaction(load_id) index stamped by data_pipeline/migration_csv.sql
+NEW_TRANSACTIONS_QUERY = '''
+    MATCH (t:Transaction)
+    WHERE t.load_id > $load_id
+    MATCH (a:Account)-[:FROM]->(t)-[:TO]->(r:Account)
+''' + TRANSACTION_RETURN
+
+# Columns identifying a transaction row of a file, for the rows sharing the watermark timestamp
+ROW_COLUMNS = ["account_id", "receiver_account_id", "from_bank", "to_bank", "timestamp", "usd_amount", "payment_format", "is_laundering"]
+
+# Per-account running aggregates, all mergeable (sum / count / min / max / bitmask)
+AGGREGATE_COLUMNS = {
+    "total_trxns": np.int64,
+    "amount_count": np.int64,
+    "total_usd_amount": np.float64,
+    "total_fraud_usd_amount": np.float64,
+    "max_usd_amount": np.float64,
+    "min_usd_amount": np.float64,
+    "total_small_txns": np.int64,
+    "total_high_txns": np.int64,
+    "total_cash_txns": np.int64,
+    "payment_format_mask": np.int64,
+    "total_active_days": np.int64,
+    "total_receivers": np.int64,
+    "total_fraud_trxns": np.int64
+}
+
+_PAIR_SHIFT = np.int64(32)
+
+# Value of a column for an account that has not sent anything yet
+AGGREGATE_INITIAL = {
+    "max_usd_amount": np.nan,
+    "min_usd_amount": np.nan
+}
+
+# Active-day keys hold the day since the epoch shifted to be non-negative
+_DAY_OFFSET = np.int64(2 ** 31)
+
+
+class SortedKeyRuns:
+    """
+    Append-only set of int64 keys kept as a few sorted runs.
+
+    A batch is checked against every run by binary search and its new keys become a
+    new run; the last two runs are merged while the older one is at most twice the
+    size of the newer. Run sizes therefore grow geometrically, there are O(log n) of
+    them and every key is merged O(log n) times, so adding a batch costs time in the
+    batch size (amortized) instead of rewriting the whole key set.
+    """
+
+    def __init__(self, keys: Optional[np.ndarray] = None):
+        self.runs = [] if keys is None or not len(keys) else [np.unique(np.asarray(keys, dtype=np.int64))]
+
+    def add(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Insert keys and return those that were not in the set yet (sorted, unique).
+        """
+        keys = np.unique(np.asarray(keys, dtype=np.int64))
+        fresh = np.ones(len(keys), dtype=bool)
+        for run in self.runs:
+            position = np.searchsorted(run, keys)
+            known = position < len(run)
+            known[known] = run[position[known]] == keys[known]
+            fresh &= ~known
+        new_keys = keys[fresh]
+        if len(new_keys):
+            self.runs.append(new_keys)
+            while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+                newer = self.runs.pop()
+                # Two sorted runs back to back, which the stable sort (timsort) merges in linear time
+                self.runs[-1] = np.sort(np.concatenate([self.runs[-1], newer]), kind="stable")
+        return new_keys
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def to_array(self) -> np.ndarray:
+        if not self.runs:
+            return np.zeros(0, dtype=np.int64)
+        return self.runs[0] if len(self.runs) == 1 else np.sort(np.concatenate(self.runs), kind="stable")
+
+
+class AccountAggregateStore:
+    """
+    Incrementally maintained per-account aggregates behind ``extract_node_features``.
+
+    Keeps running sums, counts, min/max, a payment-format bitmask, and the
+    sender/active-day and sender/receiver keys behind the distinct counts, so
+    transactions can be folded in in any order. ``update`` costs time proportional to
+    the new data: account columns are arrays with spare capacity (doubled when full),
+    account codes come from a dict looked up with the batch's distinct ids, and the
+    keys are ``SortedKeyRuns``. ``accounts``, ``save`` and ``to_features`` read the
+    whole history.
+
+    What was already consumed is tracked by a watermark:
+
+    - rows with a ``load_id`` (Memgraph, stamped per load by the loader) use the last
+      load consumed, so late transactions of a later load are picked up whatever
+      their timestamp
+    - rows without one (files) use the newest timestamp consumed plus the rows seen at
+      exactly that timestamp, so a re-read file adds the rows sharing the watermark's
+      minute that were not consumed yet; rows older than the watermark are taken as
+      consumed, late arrivals in files need a load id
+    """
+
+    def __init__(self):
+        self._size = 0
+        self._account_ids = np.empty(0, dtype=object)
+        self._banks = np.empty(0, dtype=object)
+        self._values = {col: np.empty(0, dtype=dtype) for col, dtype in AGGREGATE_COLUMNS.items()}
+        self._codes = {}
+        self.receiver_keys = SortedKeyRuns()
+        self.fraud_receiver_keys = SortedKeyRuns()
+        self.active_day_keys = SortedKeyRuns()
+        self.payment_formats = []
+        self.watermark = None
+        self.load_watermark = None
+        self._watermark_rows = np.zeros(0, dtype=np.uint64)
+
+    @property
+    def accounts(self) -> pd.DataFrame:
+        """
+        One row per known account (in first-seen order) with its running aggregates.
+        """
+        df = pd.DataFrame({"account_id": self._account_ids[:self._size], "bank": self._banks[:self._size]})
+        for col in AGGREGATE_COLUMNS:
+            df[col] = self._values[col][:self._size]
+        return df
+
+    def _reserve(self, size: int):
+        capacity = len(self._account_ids)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+
+        def grown(array):
+            result = np.empty(capacity, dtype=array.dtype)
+            result[:self._size] = array[:self._size]
+            return result
+
+        self._account_ids = grown(self._account_ids)
+        self._banks = grown(self._banks)
+        self._values = {col: grown(values) for col, values in self._values.items()}
+
+    def _append_accounts(self, account_ids: np.ndarray, banks: np.ndarray):
+        start, end = self._size, self._size + len(account_ids)
+        self._reserve(end)
+        self._account_ids[start:end] = account_ids
+        self._banks[start:end] = banks
+        for col, values in self._values.items():
+            values[start:end] = AGGREGATE_INITIAL.get(col, 0)
+        self._codes.update(zip(account_ids, range(start, end)))
+        self._size = end
+
+    def _register_accounts(self, account_ids: np.ndarray, banks: np.ndarray) -> np.ndarray:
+        # Integer code per account, appending unseen accounts in first-seen order
+        batch_codes, distinct = pd.factorize(account_ids)
+        codes = np.fromiter((self._codes.get(account_id, -1) for account_id in distinct), dtype=np.int64, count=len(distinct))
+        unseen = np.flatnonzero(codes == -1)
+        if len(unseen):
+            # factorize numbers values in order of first appearance, so unseen is in first-seen order
+            _, first_row = np.unique(batch_codes, return_index=True)
+            codes[unseen] = np.arange(self._size, self._size + len(unseen))
+            self._append_accounts(distinct[unseen], np.asarray(banks)[first_row[unseen]])
+        return codes[batch_codes]
+
+    def _format_bits(self, payment_format: pd.Series) -> np.ndarray:
+        for value in payment_format.dropna().unique():
+            if value not in self.payment_formats:
+                if len(self.payment_formats) >= 63:
+                    raise ValueError("More than 63 payment formats, the bitmask cannot hold them")
+                self.payment_formats.append(value)
+        positions = pd.Index(self.payment_formats).get_indexer(payment_format)
+        return np.where(positions >= 0, np.left_shift(np.int64(1), np.maximum(positions, 0).astype(np.int64)), 0)
+
+    def _unconsumed(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        if self.load_watermark is not None and "load_id" in transactions.columns:
+            return transactions[transactions["load_id"].to_numpy(dtype=np.float64) > self.load_watermark]
+        if self.watermark is None:
+            return transactions
+        timestamps = transactions["timestamp"]
+        keep = (timestamps > self.watermark).to_numpy()
+        tied = (timestamps == self.watermark).to_numpy()
+        if tied.any():
+            # Of the rows identical to k rows already consumed at the watermark, skip the first k
+            hashes = pd.util.hash_pandas_object(transactions.loc[tied, ROW_COLUMNS], index=False).to_numpy()
+            seen = np.searchsorted(self._watermark_rows, hashes, side="right") - np.searchsorted(self._watermark_rows, hashes, side="left")
+            occurrence = pd.Series(hashes).groupby(hashes).cumcount().to_numpy()
+            keep[np.flatnonzero(tied)[occurrence >= seen]] = True
+        return transactions[keep]
+
+    def _advance_watermark(self, transactions: pd.DataFrame):
+        if "load_id" in transactions.columns:
+            newest_load = np.nanmax(transactions["load_id"].to_numpy(dtype=np.float64), initial=0.0)
+            self.load_watermark = int(max(newest_load, self.load_watermark or 0))
+        newest = transactions["timestamp"].max()
+        at_newest = transactions.loc[transactions["timestamp"] == newest, ROW_COLUMNS]
+        hashes = pd.util.hash_pandas_object(at_newest, index=False).to_numpy()
+        if self.watermark is not None and newest < self.watermark:
+            return
+        if self.watermark is not None and newest == self.watermark:
+            hashes = np.concatenate([self._watermark_rows, hashes])
+        self.watermark = newest
+        self._watermark_rows = np.sort(hashes)
+
+    def update(self, transactions: pd.DataFrame) -> Dict[str, Any]:
+        """
+        Fold the transactions not consumed yet into the running aggregates.
+
+        Parameters:
+        -----------
+        transactions : pandas.DataFrame
+            Columns as returned by ``load_transactions``, optionally with the ``load_id``
+            of the load that wrote each transaction
+
+        Returns:
+        --------
+        dict
+            Number of transactions consumed, accounts touched and the new watermarks
+        """
+        transactions = self._unconsumed(transactions)
+        if transactions.empty:
+            return {"transactions": 0, "accounts": 0, "watermark": str(self.watermark), "load_watermark": self.load_watermark}
+
+        # Register senders before receivers of the same row, like MERGE in the load script
+        both_ids = np.column_stack([transactions["account_id"], transactions["receiver_account_id"]]).ravel()
+        both_banks = np.column_stack([transactions["from_bank"], transactions["to_bank"]]).ravel()
+        codes = self._register_accounts(both_ids, both_banks)
+        senders, receivers = codes[0::2], codes[1::2]
+
+        touched, local = np.unique(senders, return_inverse=True)
+        m = len(touched)
+        amount = transactions["usd_amount"].to_numpy(dtype=np.float64)
+        has_amount = ~np.isnan(amount)
+        amount_or_zero = np.where(has_amount, amount, 0.0)
+        laundering = transactions["is_laundering"].to_numpy() == 1
+        acc = self._values
+
+        def add(col, values):
+            acc[col][touched] += values.astype(AGGREGATE_COLUMNS[col])
+
+        add("total_trxns", np.bincount(local, minlength=m))
+        add("amount_count", np.bincount(local, has_amount, m))
+        add("total_usd_amount", np.bincount(local, amount_or_zero, m))
+        add("total_fraud_usd_amount", np.bincount(local, np.where(laundering, amount_or_zero, 0.0), m))
+        add("total_small_txns", np.bincount(local, has_amount & (amount < SMALL_TXN_USD), m))
+        add("total_high_txns", np.bincount(local, has_amount & (amount > HIGH_TXN_USD), m))
+        add("total_cash_txns", np.bincount(local, transactions["payment_format"].to_numpy() == "Cash", m))
+
+        batch_max = np.full(m, -np.inf)
+        batch_min = np.full(m, np.inf)
+        np.maximum.at(batch_max, local[has_amount], amount[has_amount])
+        np.minimum.at(batch_min, local[has_amount], amount[has_amount])
+        acc["max_usd_amount"][touched] = np.fmax(acc["max_usd_amount"][touched], np.where(np.isinf(batch_max), np.nan, batch_max))
+        acc["min_usd_amount"][touched] = np.fmin(acc["min_usd_amount"][touched], np.where(np.isinf(batch_min), np.nan, batch_min))
+
+        mask = np.zeros(m, dtype=np.int64)
+        np.bitwise_or.at(mask, local, self._format_bits(transactions["payment_format"]))
+        acc["payment_format_mask"][touched] |= mask
+
+        # Distinct active days and receivers: count the sender/day and sender/receiver keys
+        # not seen in earlier batches, whatever order the transactions come in
+        days = transactions["timestamp"].to_numpy().astype("datetime64[D]").astype(np.int64)
+        new_days = self.active_day_keys.add((senders << _PAIR_SHIFT) | (days + _DAY_OFFSET))
+        add("total_active_days", np.bincount(np.searchsorted(touched, new_days >> _PAIR_SHIFT), minlength=m))
+        new_pairs = self.receiver_keys.add((senders << _PAIR_SHIFT) | receivers)
+        new_fraud_pairs = self.fraud_receiver_keys.add((senders[laundering] << _PAIR_SHIFT) | receivers[laundering])
+        add("total_receivers", np.bincount(np.searchsorted(touched, new_pairs >> _PAIR_SHIFT), minlength=m))
+        add("total_fraud_trxns", np.bincount(np.searchsorted(touched, new_fraud_pairs >> _PAIR_SHIFT), minlength=m))
+
+        self._advance_watermark(transactions)
+        stats = {"transactions": len(transactions), "accounts": m, "watermark": str(self.watermark), "load_watermark": self.load_watermark}
+        logging.info(f"Aggregate store updated: {stats}")
+        return stats
+
+    def update_from_file(self, path: str) -> Dict[str, Any]:
+        return self.update(load_transactions(path))
+
+    def update_from_memgraph(self, mg_client) -> Dict[str, Any]:
+        """
+        Pull the transactions of loads not consumed yet from Memgraph (everything on the first run).
+        """
+        if self.load_watermark is None:
+            rows = mg_client.stream_query(ALL_TRANSACTIONS_QUERY)
+        else:
+            rows = mg_client.stream_query(NEW_TRANSACTIONS_QUERY, {"load_id": self.load_watermark})
+        transactions = pd.DataFrame.from_records(rows)
+        if transactions.empty:
+            return {"transactions": 0, "accounts": 0, "watermark": str(self.watermark), "load_watermark": self.load_watermark}
+        transactions["timestamp"] = pd.to_datetime(transactions["timestamp"])
+        return self.update(transactions)
+
+    def aggregates(self) -> pd.DataFrame:
+        """
+        Base aggregates of every sending account, in the layout ``derive_node_features`` expects.
+        """
+        df = self.accounts[self.accounts["total_trxns"] > 0].reset_index(drop=True)
+        masks = df["payment_format_mask"].to_numpy()
+        df["unique_payment_formats"] = sum(
+            ((masks >> bit) & 1) for bit in range(len(self.payment_formats))
+        ) if self.payment_formats else 0
+        return df.drop(columns=["payment_format_mask"])
+
+    def to_features(self, node_scores: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Same columns as ``extract_node_features``, derived from the running aggregates.
+        """
+        return derive_node_features(self.aggregates(), node_scores)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        feather.write_feather(self.accounts, os.path.join(path, "accounts.feather"))
+        np.save(os.path.join(path, "receiver_keys.npy"), self.receiver_keys.to_array())
+        np.save(os.path.join(path, "fraud_receiver_keys.npy"), self.fraud_receiver_keys.to_array())
+        np.save(os.path.join(path, "active_day_keys.npy"), self.active_day_keys.to_array())
+        np.save(os.path.join(path, "watermark_rows.npy"), self._watermark_rows)
+        with open(os.path.join(path, "state.json"), "w") as f:
+            json.dump({
+                "watermark": None if self.watermark is None else self.watermark.isoformat(),
+                "load_watermark": self.load_watermark,
+                "payment_formats": self.payment_formats
+            }, f)
+
+    @classmethod
+    def load(cls, path: str) -> "AccountAggregateStore":
+        """
+        Restore a saved store, or an empty one when nothing was saved at ``path`` yet.
+        """
+        store = cls()
+        if not os.path.exists(os.path.join(path, "state.json")):
+            return store
+        if not os.path.exists(os.path.join(path, "active_day_keys.npy")):
+            raise ValueError(f"The store at {path} predates the active-day keys, rebuild it from the full history")
+        accounts = feather.read_feather(os.path.join(path, "accounts.feather"))
+        store._append_accounts(accounts["account_id"].to_numpy(dtype=object), accounts["bank"].to_numpy(dtype=object))
+        for col, dtype in AGGREGATE_COLUMNS.items():
+            store._values[col][:store._size] = accounts[col].to_numpy(dtype=dtype)
+        store.receiver_keys = SortedKeyRuns(np.load(os.path.join(path, "receiver_keys.npy")))
+        store.fraud_receiver_keys = SortedKeyRuns(np.load(os.path.join(path, "fraud_receiver_keys.npy")))
+        store.active_day_keys = SortedKeyRuns(np.load(os.path.join(path, "active_day_keys.npy")))
+        store._watermark_rows = np.load(os.path.join(path, "watermark_rows.npy"))
+        with open(os.path.join(path, "state.json")) as f:
+            state = json.load(f)
+        store.watermark = None if state["watermark"] is None else pd.Timestamp(state["watermark"])
+        store.load_watermark = state.get("load_watermark")
+        store.payment_formats = state["payment_formats"]
+        return store
@@ -0,0 +1,105 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Iterable, List
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+
+
+class CovarianceAccumulator:
+    """
+    Pairwise-complete covariance of a fixed set of columns, accumulated chunk by chunk.
+
+    Like ``DataFrame.corr`` every column pair only uses the rows where both values are
+    finite (NaN and inf count as missing), so for each pair (i, j) the accumulator
+    keeps the row count, the mean and the sum of squared deviations of column i over
+    those rows, and the co-moment of i and j: four F x F matrices, whatever the
+    number of rows. Chunks are folded in with the parallel-variance (Chan et al.)
+    merge, so accumulators built on different chunks or workers can be merged too.
+    """
+
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        f = len(self.columns)
+        self.count = np.zeros((f, f))
+        # mean[i, j] / m2[i, j]: mean and squared deviations of column i over rows where i and j are finite
+        self.mean = np.zeros((f, f))
+        self.m2 = np.zeros((f, f))
+        self.comoment = np.zeros((f, f))
+
+    @classmethod
+    def _from_chunk(cls, columns: List[str], values: np.ndarray) -> "CovarianceAccumulator":
+        chunk = cls(columns)
+        present = np.isfinite(values)
+        weights = present.astype(np.float64)
+        # Center by the column means first so the sums below stay well conditioned
+        column_count = weights.sum(axis=0)
+        column_mean = np.divide(np.where(present, values, 0.0).sum(axis=0), column_count, out=np.zeros(len(columns)), where=column_count > 0)
+        centered = np.where(present, values - column_mean, 0.0)
+
+        count = weights.T @ weights
+        sums = centered.T @ weights
+        squares = (centered ** 2).T @ weights
+        products = centered.T @ centered
+        shifted_mean = np.divide(sums, count, out=np.zeros_like(sums), where=count > 0)
+        chunk.count = count
+        chunk.mean = shifted_mean + column_mean[:, None]
+        chunk.m2 = np.maximum(squares - count * shifted_mean ** 2, 0.0)
+        chunk.comoment = products - count * shifted_mean * shifted_mean.T
+        return chunk
+
+    def update(self, chunk) -> "CovarianceAccumulator":
+        """
+        Fold in a chunk of rows, a DataFrame holding ``columns`` or an (rows, F) array.
+        """
+        if isinstance(chunk, pd.DataFrame):
+            chunk = chunk[self.columns].to_numpy(dtype=np.float64)
+        return self.merge(self._from_chunk(self.columns, np.asarray(chunk, dtype=np.float64)))
+
+    def merge(self, other: "CovarianceAccumulator") -> "CovarianceAccumulator":
+        """
+        Combine with an accumulator over other rows of the same columns (in place).
+        """
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge covariance accumulators over different columns")
+        total = self.count + other.count
+        weight = np.divide(other.count, total, out=np.zeros_like(total), where=total > 0)
+        delta = other.mean - self.mean
+        cross = np.divide(self.count * other.count, total, out=np.zeros_like(total), where=total > 0)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * cross
+        self.comoment = self.comoment + other.comoment + delta * delta.T * cross
+        self.mean = self.mean + delta * weight
+        self.count = total
+        return self
+
+    def correlation(self) -> pd.DataFrame:
+        """
+        Pearson correlation matrix, NaN where a pair has no rows or no variance.
+        """
+        divisor = np.sqrt(self.m2 * self.m2.T)
+        corr = np.divide(self.comoment, divisor, out=np.full_like(divisor, np.nan), where=divisor > 0)
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def correlated_columns(self, threshold: float = 0.95) -> List[str]:
+        """
+        Columns to drop: every column with an absolute correlation above ``threshold``
+        to any earlier column (the ``to_drop`` rule of ``apply_feature_engineering``).
+        """
+        corr = np.abs(self.correlation().to_numpy())
+        upper = np.triu(np.nan_to_num(corr, nan=0.0) > threshold, k=1)
+        return [column for column, drop in zip(self.columns, upper.any(axis=0)) if drop]
+
+
+def accumulate_frames(columns: List[str], frames: Iterable[pd.DataFrame]) -> CovarianceAccumulator:
+    accumulator = CovarianceAccumulator(columns)
+    for frame in frames:
+        accumulator.update(frame)
+    return accumulator
+
+
+def iter_row_blocks(df: pd.DataFrame, columns: List[str], block_rows: int = 16384):
+    # (rows, F) float64 blocks of a frame, so no full-size float64 copy is ever held
+    for start in range(0, len(df), block_rows):
+        yield df.iloc[start:start + block_rows][columns].to_numpy(dtype=np.float64)
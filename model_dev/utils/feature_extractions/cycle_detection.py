@@ -0,0 +1,299 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import logging
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+
+from utils.feature_extractions.graph_engine import CSRGraph, _to_shared_memory
+
+CYCLE_COLUMNS = ["cycle_count", "cycle_usd_amount"]
+
+DEFAULT_MAX_LENGTH = 4
+DEFAULT_WINDOW_HOURS = 168
+
+
+class CycleIndex:
+    """
+    Compact store of detected cycles, one padded row per cycle.
+
+    ``accounts[c, h]`` sends leg ``h`` of cycle ``c`` at ``timestamps[c, h]`` for
+    ``amounts[c, h]`` USD to ``accounts[c, (h + 1) % lengths[c]]``; rows are padded
+    with "" / NaT / NaN beyond ``lengths[c]``. ``lookup`` uses an account -> cycle
+    index (member accounts sorted, with their cycle ids) built on the first call.
+    """
+
+    def __init__(self, accounts: np.ndarray, timestamps: np.ndarray, amounts: np.ndarray, lengths: np.ndarray):
+        self.accounts = np.asarray(accounts, dtype=str)
+        self.timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self._member_accounts = None
+        self._member_cycles = None
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def _legs(self, cycles: np.ndarray) -> pd.DataFrame:
+        width = self.accounts.shape[1] if self.accounts.ndim == 2 else 0
+        hops = np.tile(np.arange(width), len(cycles))
+        cycle_ids = np.repeat(cycles, width)
+        lengths = self.lengths[cycle_ids]
+        valid = hops < lengths
+        cycle_ids, hops, lengths = cycle_ids[valid], hops[valid], lengths[valid]
+        return pd.DataFrame({
+            "cycle_id": cycle_ids,
+            "hop": hops,
+            "account_id": self.accounts[cycle_ids, hops],
+            "receiver_account_id": self.accounts[cycle_ids, (hops + 1) % lengths],
+            "timestamp": self.timestamps[cycle_ids, hops],
+            "usd_amount": self.amounts[cycle_ids, hops]
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        One row per cycle leg: cycle_id, hop, account_id, receiver_account_id, timestamp, usd_amount.
+        """
+        return self._legs(np.arange(len(self)))
+
+    def _build_account_index(self):
+        width = self.accounts.shape[1] if self.accounts.ndim == 2 else 0
+        hops = np.tile(np.arange(width), len(self))
+        cycle_ids = np.repeat(np.arange(len(self)), width)
+        valid = hops < self.lengths[cycle_ids]
+        accounts = self.accounts[cycle_ids[valid], hops[valid]]
+        cycle_ids = cycle_ids[valid]
+        order = np.lexsort((cycle_ids, accounts))
+        accounts, cycle_ids = accounts[order], cycle_ids[order]
+        # An account can come back within one cycle, keep each (account, cycle) once
+        first = np.ones(len(accounts), dtype=bool)
+        first[1:] = (accounts[1:] != accounts[:-1]) | (cycle_ids[1:] != cycle_ids[:-1])
+        self._member_accounts, self._member_cycles = accounts[first], cycle_ids[first]
+
+    def lookup(self, account_id) -> pd.DataFrame:
+        """
+        Legs of every cycle the account takes part in.
+        """
+        if self._member_accounts is None:
+            self._build_account_index()
+        account_id = str(account_id)
+        start = np.searchsorted(self._member_accounts, account_id, side="left")
+        end = np.searchsorted(self._member_accounts, account_id, side="right")
+        return self._legs(self._member_cycles[start:end])
+
+    def account_features(self) -> pd.DataFrame:
+        """
+        Per account: number of cycles it takes part in and the USD it sends inside them.
+        """
+        legs = self.to_frame()
+        if legs.empty:
+            return pd.DataFrame({"account_id": pd.Series(dtype=object), "cycle_count": pd.Series(dtype=np.int64), "cycle_usd_amount": pd.Series(dtype=np.float64)})
+        features = legs.groupby("account_id").agg(
+            cycle_count=("cycle_id", "nunique"),
+            cycle_usd_amount=("usd_amount", "sum")
+        ).reset_index()
+        features["cycle_count"] = features["cycle_count"].astype(np.int64)
+        return features
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, accounts=self.accounts, timestamps=self.timestamps, amounts=self.amounts, lengths=self.lengths)
+
+    @classmethod
+    def load(cls, path: str) -> "CycleIndex":
+        with np.load(path) as index:
+            return cls(index["accounts"], index["timestamps"], index["amounts"], index["lengths"])
+
+
+def _sorted_out_edges(graph: CSRGraph) -> Dict[str, np.ndarray]:
+    # Transactions sorted by (sender, time) with a composite key for range lookups
+    seconds = graph.edge_timestamps.astype("datetime64[s]").astype(np.int64)
+    seconds = seconds - seconds.min() if len(seconds) else seconds
+    order = np.lexsort((seconds, graph.edge_src))
+    span = np.int64(seconds.max() + 1 if len(seconds) else 1)
+    src = graph.edge_src[order].astype(np.int64)
+    return {
+        "edge_ids": order.astype(np.int64),
+        "src": src,
+        "dst": graph.edge_dst[order].astype(np.int64),
+        "seconds": seconds[order],
+        "amounts": np.asarray(graph.edge_amounts[order] if graph.edge_amounts is not None else np.full(len(order), np.nan)),
+        "keys": src * span + seconds[order],
+        "span": np.array([span])
+    }
+
+
+def find_cycles(
+        edges: Dict[str, np.ndarray],
+        start_positions: np.ndarray,
+        max_length: int,
+        window_seconds: int,
+        amount_decay: Optional[float],
+        amount_tolerance: float
+    ) -> np.ndarray:
+    """
+    Time-respecting simple cycles whose earliest transaction is one of ``start_positions``.
+
+    Paths are grown breadth-first for all start transactions at once. From the last
+    account of a path only transactions strictly later than the previous leg and at
+    most ``window_seconds`` after the first leg are followed, which is one
+    searchsorted range per path. With ``amount_decay`` a leg must carry between
+    ``amount_decay`` and ``1 + amount_tolerance`` times the previous leg's amount.
+
+    Returns:
+    --------
+    numpy.ndarray
+        (cycles, max_length) positions into the sorted edge arrays, -1 padded
+    """
+    src, dst, seconds, amounts, keys = edges["src"], edges["dst"], edges["seconds"], edges["amounts"], edges["keys"]
+    span = edges["span"][0]
+    start_positions = start_positions[src[start_positions] != dst[start_positions]]
+    legs = np.full((len(start_positions), max_length), -1, dtype=np.int64)
+    legs[:, 0] = start_positions
+    visited = np.full((len(start_positions), max_length), -1, dtype=np.int64)
+    visited[:, 0] = src[start_positions]
+    cycles = []
+
+    for depth in range(1, max_length):
+        if not len(legs):
+            break
+        previous = legs[:, depth - 1]
+        node = dst[previous]
+        lo = np.searchsorted(keys, node * span + seconds[previous], side="right")
+        hi = np.searchsorted(keys, node * span + np.minimum(seconds[legs[:, 0]] + window_seconds, span - 1), side="right")
+        counts = np.maximum(hi - lo, 0)
+        parents = np.repeat(np.arange(len(legs)), counts)
+        positions = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        if amount_decay is not None:
+            ratio = amounts[positions] / amounts[previous[parents]]
+            unknown = np.isnan(ratio)
+            keep = unknown | ((ratio >= amount_decay) & (ratio <= 1.0 + amount_tolerance))
+            parents, positions = parents[keep], positions[keep]
+
+        heads = dst[positions]
+        closing = heads == visited[parents, 0]
+        closed = legs[parents[closing]]
+        closed[:, depth] = positions[closing]
+        cycles.append(closed)
+
+        # Simple cycles only: never revisit an account already on the path
+        open_paths = ~closing & ~(visited[parents, :depth] == heads[:, None]).any(axis=1)
+        parents, positions = parents[open_paths], positions[open_paths]
+        legs = legs[parents]
+        legs[:, depth] = positions
+        visited = visited[parents]
+        visited[:, depth] = dst[positions]
+    if not cycles:
+        return np.zeros((0, max_length), dtype=np.int64)
+    return np.concatenate(cycles)
+
+
+_WORKER_EDGES = {}
+
+
+def _attach_shared_edges(specs):
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, block_name, _, _ in specs}
+    _WORKER_EDGES["blocks"] = blocks
+    for name, _, shape, dtype in specs:
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+        array.flags.writeable = False
+        _WORKER_EDGES[name] = array
+
+
+def _find_partition_cycles(args) -> np.ndarray:
+    start_positions, settings = args
+    return find_cycles(_WORKER_EDGES, start_positions, **settings)
+
+
+def detect_cycles(
+        graph: CSRGraph,
+        max_length: int = DEFAULT_MAX_LENGTH,
+        window_hours: float = DEFAULT_WINDOW_HOURS,
+        amount_decay: Optional[float] = 0.5,
+        amount_tolerance: float = 0.1,
+        n_jobs: Optional[int] = None,
+        partition_size: int = 10000
+    ) -> CycleIndex:
+    """
+    Find round-trips: time-respecting simple cycles of 2 to ``max_length`` transactions.
+
+    Parameters:
+    -----------
+    graph : CSRGraph
+        Account graph with per-transaction timestamps and amounts
+    max_length : int
+        Maximum number of transactions in a cycle
+    window_hours : float
+        Maximum time between the first and the last transaction of a cycle
+    amount_decay : float, optional
+        Minimum ratio between consecutive leg amounts (None disables amount pruning)
+    amount_tolerance : float
+        Allowed growth of a leg amount over the previous leg
+    n_jobs : int, optional
+        Worker processes over source-account partitions, -1 uses every core, None runs in-process
+    partition_size : int
+        Source accounts per partition
+
+    Returns:
+    --------
+    CycleIndex
+        Every cycle once, anchored at its earliest transaction
+    """
+    if graph.edge_timestamps is None:
+        raise ValueError("Cycle detection needs transaction timestamps on the graph")
+    print(f"✅ Detecting cycles up to length {max_length} within {window_hours} hours")
+    edges = _sorted_out_edges(graph)
+    settings = {
+        "max_length": max_length,
+        "window_seconds": int(window_hours * 3600),
+        "amount_decay": amount_decay,
+        "amount_tolerance": amount_tolerance
+    }
+    # Partition the start transactions by source account; edges are sorted by source
+    node_starts = np.searchsorted(edges["src"], np.arange(0, graph.num_nodes + partition_size, partition_size))
+    partitions = [
+        np.arange(lo, hi) for lo, hi in zip(node_starts[:-1], node_starts[1:]) if hi > lo
+    ]
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if not n_jobs or n_jobs <= 1 or len(partitions) < 2:
+        found = [find_cycles(edges, positions, **settings) for positions in partitions]
+    else:
+        names = [name for name in edges]
+        blocks = [_to_shared_memory(edges[name]) for name in names]
+        try:
+            specs = [(name, block.name, edges[name].shape, edges[name].dtype.str) for name, block in zip(names, blocks)]
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_attach_shared_edges, initargs=(specs,)) as executor:
+                found = list(executor.map(_find_partition_cycles, [(positions, settings) for positions in partitions]))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    positions = np.concatenate(found) if found else np.zeros((0, max_length), dtype=np.int64)
+    padded = positions < 0
+    safe = np.where(padded, 0, positions)
+    edge_ids = edges["edge_ids"][safe]
+    accounts = np.where(padded, "", graph.account_ids[graph.edge_src[edge_ids]].astype(str))
+    timestamps = np.where(padded, np.datetime64("NaT"), graph.edge_timestamps[edge_ids])
+    amounts = np.where(padded, np.nan, edges["amounts"][safe])
+    index = CycleIndex(accounts, timestamps, amounts, (~padded).sum(axis=1))
+    logging.info(f"Found {len(index)} cycles over {len(partitions)} source partitions")
+    return index
+
+
+def add_cycle_features(df: pd.DataFrame, index: CycleIndex) -> pd.DataFrame:
+    """
+    Join the per-account cycle columns onto an ``extract_node_features`` frame (0 without cycles).
+    """
+    joined = df.merge(index.account_features(), on="account_id", how="left")
+    joined[CYCLE_COLUMNS] = joined[CYCLE_COLUMNS].fillna(0)
+    joined["cycle_count"] = joined["cycle_count"].astype(np.int64)
+    return joined
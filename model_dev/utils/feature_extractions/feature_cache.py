@@ -0,0 +1,270 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Callable, Dict, Optional, Tuple
+import glob
+import hashlib
+import json
+import logging
+import time
+import pandas as pd #type: ignore
+import pyarrow as pa #type: ignore
+import pyarrow.feather as feather #type: ignore
+
+# Bump whenever the extraction query or the feature engineering changes so old entries stop matching
+FEATURE_CODE_VERSION = "7"
+
+# Maintained by the loader (data_pipeline/migration_csv.sql): load_version is bumped
+# before every load writes anything, the counts and latest timestamp are set after it
+GRAPH_STATE_QUERY = '''
+    MATCH (s:GraphState {name: "transactions"})
+    RETURN
+        s.accounts AS accounts,
+        s.transactions AS transactions,
+        s.max_timestamp AS max_timestamp,
+        s.load_version AS load_version,
+        s.scores_version AS scores_version,
+        s.pagerank_backend AS pagerank_backend,
+        s.centrality_settings AS centrality_settings,
+        s.clustering_settings AS clustering_settings
+'''
+
+# Set by every stage writing derived account properties (centrality, communities): the
+# counter moves on every write, the settings say what produced the stored values
+GRAPH_SCORES_UPDATE_QUERY = '''
+    MERGE (s:GraphState {name: "transactions"})
+    SET s += $properties, s.scores_version = coalesce(s.scores_version, 0) + 1
+'''
+
+SCORE_SETTINGS_PROPERTIES = ["pagerank_backend", "centrality_settings", "clustering_settings"]
+
+# Fallback without a GraphState node: two label scans (every transaction has exactly one
+# FROM and one TO edge, so an edge count adds nothing but a scan of all relationships)
+GRAPH_FINGERPRINT_QUERY = '''
+    MATCH (a:Account)
+    WITH count(a) AS accounts, collect(DISTINCT a.pagerank_backend) AS pagerank_backends
+    MATCH (t:Transaction)
+    RETURN accounts, count(t) AS transactions, max(t.timestamp) AS max_timestamp, pagerank_backends
+'''
+
+
+def record_graph_scores(mg_client, **properties):
+    """
+    Note on the GraphState node that account properties were rewritten, and how.
+
+    Bumps ``scores_version`` and sets the given ``SCORE_SETTINGS_PROPERTIES``; dict
+    values (e.g. the betweenness settings) are stored as sorted JSON.
+    """
+    unknown = set(properties) - set(SCORE_SETTINGS_PROPERTIES)
+    if unknown:
+        raise ValueError(f"Unknown score settings: {sorted(unknown)}")
+    properties = {
+        name: json.dumps(value, sort_keys=True, default=str) if isinstance(value, dict) else value
+        for name, value in properties.items()
+    }
+    mg_client.execute_write(GRAPH_SCORES_UPDATE_QUERY, {"properties": properties})
+
+
+def graph_fingerprint(mg_client) -> Dict[str, Any]:
+    """
+    Cheap summary of the graph snapshot: account / transaction counts, the latest
+    transaction timestamp and the load counter, read from the GraphState node the
+    loader maintains. A graph loaded before the loader kept that node is fingerprinted
+    by counting the labels instead.
+    Also covers how the derived account properties were made: the PageRank backend
+    (whose scores differ between backends), the centrality and clustering settings and
+    ``scores_version``, bumped by every write of those properties (see
+    ``record_graph_scores``). Re-scoring with another k / seed or re-clustering an
+    unchanged graph therefore stops cached features of the old values from matching.
+    """
+    state = mg_client.execute_query(GRAPH_STATE_QUERY)
+    state = state[0] if state else {}
+    row = state
+    if state.get("load_version") is None:
+        logging.warning("No GraphState load counter, fingerprinting the graph by scanning it (reload with data_pipeline/migration_csv.sql)")
+        rows = mg_client.execute_query(GRAPH_FINGERPRINT_QUERY)
+        if not rows:
+            raise RuntimeError("Cannot fingerprint the graph")
+        row = rows[0]
+    fingerprint = {
+        "accounts": row["accounts"],
+        "transactions": row["transactions"],
+        "max_timestamp": str(row["max_timestamp"])
+    }
+    if row.get("load_version") is not None:
+        fingerprint["load_version"] = row["load_version"]
+    if "pagerank_backends" in row and state.get("pagerank_backend") is None:
+        fingerprint["pagerank_backend"] = ",".join(sorted(str(backend) for backend in row["pagerank_backends"])) or None
+    else:
+        fingerprint["pagerank_backend"] = state.get("pagerank_backend")
+    fingerprint["scores_version"] = state.get("scores_version")
+    for name in ("centrality_settings", "clustering_settings"):
+        fingerprint[name] = state.get(name)
+    return fingerprint
+
+
+class FeatureCache:
+    """
+    On-disk cache of feature frames keyed by graph fingerprint and feature code version.
+
+    Frames are stored as uncompressed Arrow IPC (Feather v2) files, which keep dtypes
+    and can be memory-mapped; an optional metadata dict is stored next to each frame
+    as JSON, plus any side files written to ``artifact_path`` (e.g. an index built
+    while computing the frame). Entries are evicted with their side files by total
+    size (least recently used first) and by age.
+    """
+
+    def __init__(
+            self,
+            cache_dir: str = "./feature_cache",
+            max_bytes: Optional[int] = 10 * 1024 ** 3,
+            max_age_days: Optional[float] = 30,
+            code_version: str = FEATURE_CODE_VERSION
+        ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.code_version = code_version
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name: str, fingerprint: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {"name": name, "fingerprint": fingerprint, "code_version": self.code_version},
+            sort_keys=True,
+            default=str
+        )
+        return f"{name}-{hashlib.sha256(payload.encode()).hexdigest()[:16]}"
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.feather", f"{base}.json"
+
+    def artifact_path(self, name: str, fingerprint: Dict[str, Any], suffix: str) -> str:
+        """
+        Path of a side file of the ``name`` entry for this fingerprint, e.g. "cycle_index.npz".
+        """
+        data_path, _ = self._paths(self.key(name, fingerprint))
+        return f"{data_path[:-len('.feather')]}.{suffix}"
+
+    def _artifacts(self, data_path: str):
+        base = data_path[:-len(".feather")]
+        return [path for path in glob.glob(f"{glob.escape(base)}.*") if path not in (data_path, f"{base}.json")]
+
+    def load_table(self, name: str, fingerprint: Dict[str, Any]) -> Optional[pa.Table]:
+        """
+        Memory-mapped Arrow table of a cached frame, or None on a miss.
+        """
+        data_path, meta_path = self._paths(self.key(name, fingerprint))
+        if not os.path.exists(data_path) or not os.path.exists(meta_path):
+            return None
+        # The access time drives the least-recently-used eviction
+        os.utime(meta_path)
+        return feather.read_table(data_path, memory_map=True)
+
+    def load(self, name: str, fingerprint: Dict[str, Any]) -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, Any]]]:
+        """
+        Returns:
+        --------
+        tuple
+            (DataFrame, metadata) of the cached entry, (None, None) on a miss
+        """
+        table = self.load_table(name, fingerprint)
+        if table is None:
+            return None, None
+        _, meta_path = self._paths(self.key(name, fingerprint))
+        with open(meta_path) as f:
+            entry = json.load(f)
+        print(f"✅ Loaded {name} from the feature cache")
+        return table.to_pandas(), entry.get("metadata")
+
+    def save(self, name: str, fingerprint: Dict[str, Any], df: pd.DataFrame, metadata: Optional[Dict[str, Any]] = None):
+        key = self.key(name, fingerprint)
+        data_path, meta_path = self._paths(key)
+        tmp_path = f"{data_path}.tmp"
+        feather.write_feather(df.reset_index(drop=True), tmp_path, compression="uncompressed")
+        os.replace(tmp_path, data_path)
+        with open(meta_path, "w") as f:
+            json.dump({
+                "name": name,
+                "fingerprint": fingerprint,
+                "code_version": self.code_version,
+                "created_at": time.time(),
+                "metadata": metadata
+            }, f, default=str)
+        logging.info(f"Cached {name} as {key}")
+        self.evict()
+
+    def get_or_compute(
+            self,
+            name: str,
+            fingerprint: Dict[str, Any],
+            compute: Callable[[], Any]
+        ) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+        """
+        Load a cached entry or compute and store it.
+
+        Parameters:
+        -----------
+        name : str
+            Logical name of the frame, e.g. "node_features"
+        fingerprint : dict
+            Graph fingerprint the frame was computed from
+        compute : callable
+            Returns a DataFrame or a (DataFrame, metadata dict) tuple
+
+        Returns:
+        --------
+        tuple
+            (DataFrame, metadata or None)
+        """
+        df, metadata = self.load(name, fingerprint)
+        if df is not None:
+            return df, metadata
+        result = compute()
+        df, metadata = result if isinstance(result, tuple) else (result, None)
+        if df is not None:
+            self.save(name, fingerprint, df, metadata)
+        return df, metadata
+
+    def evict(self):
+        """
+        Drop entries older than ``max_age_days``, then least recently used entries above ``max_bytes``.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.cache_dir, file_name)
+            data_path = meta_path[:-len(".json")] + ".feather"
+            try:
+                with open(meta_path) as f:
+                    created_at = json.load(f).get("created_at", 0)
+                size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+                size += sum(os.path.getsize(path) for path in self._artifacts(data_path))
+                entries.append((os.path.getmtime(meta_path), created_at, size, data_path, meta_path))
+            except (OSError, ValueError):
+                continue
+
+        now = time.time()
+        kept = []
+        for accessed_at, created_at, size, data_path, meta_path in sorted(entries):
+            if self.max_age_days is not None and now - created_at > self.max_age_days * 86400:
+                self._remove(data_path, meta_path)
+            else:
+                kept.append((size, data_path, meta_path))
+
+        if self.max_bytes is not None:
+            total = sum(size for size, _, _ in kept)
+            for size, data_path, meta_path in kept:
+                if total <= self.max_bytes:
+                    break
+                self._remove(data_path, meta_path)
+                total -= size
+
+    def _remove(self, data_path: str, meta_path: str):
+        for path in [data_path, meta_path] + self._artifacts(data_path):
+            if os.path.exists(path):
+                os.remove(path)
+        logging.info(f"Evicted {os.path.basename(data_path)} from the feature cache")
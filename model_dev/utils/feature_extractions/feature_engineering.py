@@ -0,0 +1,351 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import tracemalloc
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+
+from utils.feature_extractions.correlation_pruning import (
+    CovarianceAccumulator,
+    accumulate_frames,
+    iter_row_blocks
+)
+
+ENGINEERED_FEATURES = [
+    "txn_size_variability",
+    "amount_count_ratio",
+    "small_high_ratio",
+    "network_anomaly_score",
+    "position_activity_disparity",
+    "variance_txns_per_day",
+    "temporal_density",
+    "fraud_to_normal_ratio",
+    "combined_network_centrality",
+    "risk_score"
+]
+
+# Raw columns the engineered features are computed from (besides the amount columns)
+ENGINEERING_INPUTS = [
+    "max_usd_amount",
+    "min_usd_amount",
+    "total_usd_amount",
+    "total_trxns",
+    "total_small_txns",
+    "total_high_txns",
+    "pagerank",
+    "ratio_fraud_receiver",
+    "total_active_days",
+    "total_fraud_trxns",
+    "betweenness",
+    "ratio_fraud_usd_amount",
+    "ratio_cash_trxns"
+]
+
+# Columns computed from is_laundering, i.e. from the label itself: the raw fraud aggregates
+# (and their _log columns), the engineered features built on them, and the risk_<name>
+# scores propagated from laundering seed sets
+LABEL_DERIVED_FEATURES = [
+    "is_anomalies_account",
+    "total_fraud_trxns",
+    "total_fraud_usd_amount",
+    "ratio_fraud_receiver",
+    "ratio_fraud_usd_amount",
+    "network_anomaly_score",
+    "fraud_to_normal_ratio",
+    "risk_score"
+]
+
+CORRELATION_THRESHOLD = 0.95
+
+
+def is_propagated_risk(col: str) -> bool:
+    """
+    Whether ``col`` is a ``risk_<name>`` score of risk_propagation, spread from seed accounts
+    picked by the label (the engineered ``risk_score`` is not one of them).
+    """
+    return col.startswith("risk_") and col != "risk_score"
+
+
+def label_free_features(features: List[str], label_column: str = "is_anomalies_account") -> List[str]:
+    """
+    ``features`` without the label and every column derived from it, for supervised models.
+    """
+    derived = set(LABEL_DERIVED_FEATURES) | {label_column}
+    derived |= {f"{col}_log" for col in derived}
+    return [col for col in features if col not in derived and not col.startswith("risk_")]
+
+
+def traced_peak_memory(func: Callable, *args, **kwargs) -> Tuple[Any, int]:
+    """
+    Run ``func`` and return its result with the peak bytes allocated meanwhile (tracemalloc,
+    which also sees NumPy buffers).
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+    return result, peak
+
+
+def frame_megabytes(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+class FeatureEngineeringTransformer:
+    """
+    Feature engineering of ``apply_feature_engineering`` split into fit and transform.
+
+    ``fit`` freezes everything that depends on the training frame: the log-transformed
+    amount columns, the ``total_trxns`` maximum used by ``position_activity_disparity``,
+    the highly correlated columns to drop and ``features_for_model``. ``transform`` is
+    then a fixed element-wise computation per account, so a scoring batch gets the same
+    features whatever else is in it.
+
+    With ``low_memory`` numeric columns are held as float32, string columns other than
+    account_id as categoricals, and the derived columns are written into one
+    preallocated float32 block instead of being added to the frame one by one.
+    """
+
+    def __init__(self, low_memory: bool = False):
+        self.low_memory = low_memory
+        self.input_columns: List[str] = []
+        self.numeric_columns: List[str] = []
+        self.amount_columns: List[str] = []
+        self.categorical_columns: List[str] = []
+        self.total_trxns_max: Optional[float] = None
+        self.metadata: Dict[str, Any] = {}
+
+    @property
+    def _numeric_dtypes(self) -> List[str]:
+        return ['float64', 'int64', 'float32'] if self.low_memory else ['float64', 'int64']
+
+    @property
+    def _dtype(self):
+        return np.float32 if self.low_memory else np.float64
+
+    @property
+    def features_for_model(self) -> List[str]:
+        return self.metadata.get("features_for_model", [])
+
+    @property
+    def engineered_columns(self) -> List[str]:
+        return [f"{col}_log" for col in self.amount_columns] + ENGINEERED_FEATURES
+
+    def _engineer(self, cols: Dict[str, np.ndarray]) -> Iterator[Tuple[str, np.ndarray]]:
+        # (name, values) of the new columns in ``engineered_columns`` order, one at a time
+        # so callers can write each into its final place; run under np.errstate(divide/invalid="ignore")
+        for col in self.amount_columns:
+            yield f"{col}_log", np.log1p(cols[col], dtype=self._dtype)
+
+        # Transaction pattern features
+        yield "txn_size_variability", cols["max_usd_amount"] / (cols["min_usd_amount"] + 1)
+        yield "amount_count_ratio", cols["total_usd_amount"] / (cols["total_trxns"] + 1)
+        yield "small_high_ratio", (cols["total_small_txns"] + 1) / (cols["total_high_txns"] + 1)
+
+        # Network pattern features
+        yield "network_anomaly_score", cols["pagerank"] * cols["ratio_fraud_receiver"]
+        yield "position_activity_disparity", np.abs(cols["pagerank"] - (cols["total_trxns"] / self.total_trxns_max))
+
+        # Temporal pattern features
+        yield "variance_txns_per_day", cols["total_trxns"] / (cols["total_active_days"] ** 2)
+        yield "temporal_density", cols["total_trxns"] / (cols["total_active_days"] + 1)
+
+        # Fraud-specific ratios
+        yield "fraud_to_normal_ratio", cols["total_fraud_trxns"] / (cols["total_trxns"] - cols["total_fraud_trxns"] + 1)
+
+        # Combined metric features
+        combined_network_centrality = cols["pagerank"] * cols["betweenness"]
+        yield "combined_network_centrality", combined_network_centrality
+        yield "risk_score", cols["ratio_fraud_usd_amount"] * cols["ratio_cash_trxns"] * combined_network_centrality
+
+    def fit(self, df: pd.DataFrame) -> "FeatureEngineeringTransformer":
+        self.fit_transform(df)
+        return self
+
+    def _fit_columns(self, df: pd.DataFrame):
+        self.input_columns = df.columns.tolist()
+        self.categorical_columns = [
+            col for col in df.select_dtypes(include=['object']).columns if col != 'account_id'
+        ] if self.low_memory else []
+        self.numeric_columns = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+        self.amount_columns = [col for col in self.numeric_columns if 'amount' in col.lower() or 'usd' in col.lower()]
+
+    def _fit_metadata(self, processed_df: pd.DataFrame, accumulator: CovarianceAccumulator):
+        non_numeric_cols = [col for col in self.input_columns if col not in self.numeric_columns]
+        numeric_cols = accumulator.columns
+        to_drop = accumulator.correlated_columns(CORRELATION_THRESHOLD)
+
+        id_cols = [col for col in non_numeric_cols if 'id' in col.lower() or col == 'account_id' or col == 'bank']
+        # Community labels are numeric but categorical, never feed them to the model as magnitudes
+        id_cols += [col for col in numeric_cols if col.endswith('community_id')]
+        # Propagated risk is seeded from is_anomalies_account, a model input only when passed
+        # explicitly (e.g. as extra_features scored against seeds the model is not evaluated on)
+        seeded_cols = [col for col in numeric_cols if is_propagated_risk(col)]
+        features_for_model = [
+            col for col in numeric_cols if col not in id_cols and col not in to_drop and col not in seeded_cols
+        ]
+
+        self.metadata = {
+            'original_features': list(self.input_columns),
+            'added_features': [col for col in processed_df.columns if col not in self.input_columns],
+            'highly_correlated_features': to_drop,
+            'features_for_model': features_for_model,
+            'id_columns': id_cols,
+            'label_seeded_features': seeded_cols,
+            'numeric_columns': list(numeric_cols),
+            'non_numeric_columns': non_numeric_cols
+        }
+
+    def fit_transform(self, df: pd.DataFrame):
+        """
+        Fit on a training frame and return its engineered features.
+
+        Returns:
+        --------
+        pandas.DataFrame
+            Processed DataFrame with additional engineered features
+        dict
+            Dictionary of preprocessing metadata (feature lists, correlation info)
+        """
+        self._fit_columns(df)
+        self.total_trxns_max = float(df['total_trxns'].max())
+
+        processed_df = self.transform(df)
+
+        # Correlations from a covariance accumulator fed in row blocks, same result as DataFrame.corr
+        numeric_cols = processed_df.select_dtypes(include=self._numeric_dtypes).columns.tolist()
+        accumulator = accumulate_frames(numeric_cols, iter_row_blocks(processed_df, numeric_cols))
+        self._fit_metadata(processed_df, accumulator)
+        return processed_df, self.metadata
+
+    def fit_chunks(self, make_chunks: Callable[[], Iterable[pd.DataFrame]]) -> "FeatureEngineeringTransformer":
+        """
+        Fit over a frame that only exists as a stream of chunks, e.g. ``iter_node_features``.
+
+        Parameters:
+        -----------
+        make_chunks : callable
+            Returns a fresh iterable of feature chunks; it is called twice, once for the
+            ``total_trxns`` maximum and once to accumulate the correlations
+
+        Returns:
+        --------
+        FeatureEngineeringTransformer
+            Fitted transformer, metadata in ``self.metadata``
+        """
+        total_trxns_max = None
+        for chunk in make_chunks():
+            if total_trxns_max is None:
+                self._fit_columns(chunk)
+            chunk_max = chunk['total_trxns'].max()
+            total_trxns_max = chunk_max if total_trxns_max is None else max(total_trxns_max, chunk_max)
+        if total_trxns_max is None:
+            raise ValueError("No chunks to fit on")
+        self.total_trxns_max = float(total_trxns_max)
+
+        accumulator = None
+        for chunk in make_chunks():
+            processed = self.transform(chunk)
+            if accumulator is None:
+                first_processed = processed.iloc[:0]
+                accumulator = CovarianceAccumulator(processed.select_dtypes(include=self._numeric_dtypes).columns.tolist())
+            accumulator.update(processed)
+        self._fit_metadata(first_processed, accumulator)
+        return self
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Engineered features of any batch with the frozen constants, vectorized over rows.
+        """
+        if self.total_trxns_max is None:
+            raise RuntimeError("FeatureEngineeringTransformer must be fitted before transform")
+        needed = set(self.amount_columns) | set(ENGINEERING_INPUTS)
+        names = self.engineered_columns
+        if self.low_memory:
+            df = self._downcast(df)
+            # One preallocated float32 block, each derived column written straight into it
+            block = np.empty((len(df), len(names)), dtype=np.float32, order='F')
+            with np.errstate(divide="ignore", invalid="ignore"):
+                for position, (_, values) in enumerate(self._engineer({col: df[col].to_numpy() for col in needed})):
+                    block[:, position] = values
+            engineered = pd.DataFrame(block, columns=names, index=df.index, copy=False)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                engineered = pd.DataFrame(dict(self._engineer({col: df[col].to_numpy() for col in needed})), index=df.index)
+        stale = [col for col in names if col in df.columns]
+        if stale:
+            df = df.drop(columns=stale)
+        return pd.concat([df, engineered], axis=1, copy=not self.low_memory)
+
+    def _downcast(self, df: pd.DataFrame) -> pd.DataFrame:
+        # float32 numerics and categorical strings, built column by column without a full copy
+        columns = {}
+        for col in df.columns:
+            series = df[col]
+            if series.dtype in (np.float64, np.int64):
+                series = series.astype(np.float32)
+            elif col in self.categorical_columns and series.dtype == object:
+                series = series.astype('category')
+            columns[col] = series
+        return pd.concat(columns, axis=1, copy=False)
+
+    def transform_array(self, values: np.ndarray) -> np.ndarray:
+        """
+        Model input matrix straight from raw numeric values, without pandas.
+
+        Parameters:
+        -----------
+        values : numpy.ndarray
+            (rows, len(numeric_columns)) or a single row, columns in ``numeric_columns`` order
+
+        Returns:
+        --------
+        numpy.ndarray
+            (rows, len(features_for_model))
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=self._dtype))
+        cols = dict(zip(self.numeric_columns, values.T))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cols.update(self._engineer(cols))
+        return np.array([cols[col] for col in self.features_for_model]).T
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'low_memory': self.low_memory,
+            'categorical_columns': self.categorical_columns,
+            'input_columns': self.input_columns,
+            'numeric_columns': self.numeric_columns,
+            'amount_columns': self.amount_columns,
+            'total_trxns_max': self.total_trxns_max,
+            'metadata': self.metadata
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> "FeatureEngineeringTransformer":
+        transformer = cls(low_memory=state.get('low_memory', False))
+        transformer.categorical_columns = list(state.get('categorical_columns', []))
+        transformer.input_columns = list(state['input_columns'])
+        transformer.numeric_columns = list(state['numeric_columns'])
+        transformer.amount_columns = list(state['amount_columns'])
+        transformer.total_trxns_max = state['total_trxns_max']
+        transformer.metadata = dict(state['metadata'])
+        return transformer
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "FeatureEngineeringTransformer":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,550 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import logging
+import math
+import numpy as np #type: ignore
+import pandas as pd #type: ignore
+import scipy.sparse as sp #type: ignore
+
+EDGE_LIST_QUERY = '''
+    MATCH (a:Account)-[:FROM]->(t:Transaction)-[:TO]->(r:Account)
+    RETURN
+        id(a) AS src,
+        id(r) AS dst,
+        a.account_id AS src_account_id,
+        r.account_id AS dst_account_id,
+        t.timestamp AS timestamp,
+        t.usd_amount AS usd_amount
+'''
+
+class CSRGraph:
+    """
+    In-process account graph stored as a compressed sparse row adjacency.
+
+    Nodes are Memgraph accounts re-indexed to 0..N-1, ``node_ids[i]`` holds the
+    internal Memgraph id of index ``i``. Each Account->Transaction->Account path
+    becomes one directed account->account edge; parallel transactions are summed
+    into the edge weight, while the per-transaction edge arrays are kept in
+    ``edge_src`` / ``edge_dst`` / ``edge_timestamps`` / ``edge_amounts``.
+    ``account_ids[i]`` is the ``account_id`` property of index ``i`` (the node id
+    itself when the graph is built from account ids directly).
+    """
+
+    def __init__(
+            self,
+            node_ids: np.ndarray,
+            src: np.ndarray,
+            dst: np.ndarray,
+            timestamps: Optional[np.ndarray] = None,
+            amounts: Optional[np.ndarray] = None,
+            account_ids: Optional[np.ndarray] = None
+        ):
+        self.node_ids = np.asarray(node_ids)
+        self.account_ids = self.node_ids if account_ids is None else np.asarray(account_ids)
+        self.edge_src = np.asarray(src)
+        self.edge_dst = np.asarray(dst)
+        self.edge_timestamps = None if timestamps is None else np.asarray(timestamps, dtype="datetime64[us]")
+        self.edge_amounts = None if amounts is None else np.asarray(amounts, dtype=np.float64)
+        n = len(self.node_ids)
+        adjacency = sp.csr_matrix(
+            (np.ones(len(src), dtype=np.float64), (src, dst)),
+            shape=(n, n)
+        )
+        adjacency.sum_duplicates()
+        self.adjacency = adjacency
+        self.last_pagerank_iterations = 0
+        self.last_pagerank_updated_nodes = 0
+        self.last_pagerank_residual = None
+        self.last_betweenness_settings = {}
+
+    @classmethod
+    def from_edges(
+            cls,
+            src_ids,
+            dst_ids,
+            timestamps=None,
+            amounts=None,
+            src_account_ids=None,
+            dst_account_ids=None
+        ) -> "CSRGraph":
+        """
+        Build the graph from parallel arrays of source / destination node ids
+        (and optionally the transaction timestamps, USD amounts and account ids).
+        """
+        src_ids = np.asarray(src_ids)
+        dst_ids = np.asarray(dst_ids)
+        node_ids, first, codes = np.unique(np.concatenate([src_ids, dst_ids]), return_index=True, return_inverse=True)
+        account_ids = None
+        if src_account_ids is not None:
+            account_ids = np.concatenate([np.asarray(src_account_ids), np.asarray(dst_account_ids)])[first]
+        return cls(node_ids, codes[:len(src_ids)], codes[len(src_ids):], timestamps, amounts, account_ids)
+
+    @classmethod
+    def from_transactions(cls, transactions) -> "CSRGraph":
+        """
+        Build the account graph from a transaction frame as returned by ``load_transactions``,
+        with account ids as node ids.
+        """
+        return cls.from_edges(
+            transactions["account_id"].to_numpy(),
+            transactions["receiver_account_id"].to_numpy(),
+            transactions["timestamp"].to_numpy(),
+            transactions["usd_amount"].to_numpy(dtype=np.float64)
+        )
+
+    @classmethod
+    def from_memgraph(cls, mg_client) -> "CSRGraph":
+        """
+        Pull the Account->Transaction->Account edge list from Memgraph once.
+        """
+        print("✅ Loading the transaction edge list from Memgraph")
+        rows = mg_client.execute_query(EDGE_LIST_QUERY)
+        src = np.fromiter((row["src"] for row in rows), dtype=np.int64, count=len(rows))
+        dst = np.fromiter((row["dst"] for row in rows), dtype=np.int64, count=len(rows))
+        timestamps = np.array([row["timestamp"] for row in rows], dtype="datetime64[us]")
+        amounts = np.array([row["usd_amount"] for row in rows], dtype=np.float64)
+        graph = cls.from_edges(
+            src,
+            dst,
+            timestamps,
+            amounts,
+            src_account_ids=np.array([row["src_account_id"] for row in rows], dtype=object),
+            dst_account_ids=np.array([row["dst_account_id"] for row in rows], dtype=object)
+        )
+        logging.info(f"Loaded CSR graph with {graph.num_nodes} nodes and {graph.num_edges} edges")
+        return graph
+
+    @property
+    def num_nodes(self) -> int:
+        return self.adjacency.shape[0]
+
+    @property
+    def num_edges(self) -> int:
+        return self.adjacency.nnz
+
+    def edge_frame(self):
+        """
+        Per-transaction edges as a frame with the ``load_transactions`` account / timestamp / amount columns.
+        """
+        return pd.DataFrame({
+            "account_id": self.account_ids[self.edge_src],
+            "receiver_account_id": self.account_ids[self.edge_dst],
+            "timestamp": self.edge_timestamps,
+            "usd_amount": self.edge_amounts
+        })
+
+    def to_node_dict(self, values: np.ndarray) -> Dict[int, float]:
+        """
+        Map a per-index score vector back to ``{node_id: score}``.
+        """
+        return dict(zip(self.node_ids.tolist(), np.asarray(values, dtype=float).tolist()))
+
+    def pagerank(
+            self,
+            alpha: float = 0.85,
+            max_iter: int = 100,
+            tol: float = 1e-6,
+            personalization: Optional[np.ndarray] = None
+        ) -> np.ndarray:
+        """
+        PageRank by vectorized power iteration (NetworkX conventions).
+
+        Runs on the collapsed account -> account graph (parallel transactions weighting
+        the edge), so the scores sum to 1 over the accounts. This is not what the
+        Memgraph backend's ``nxalg.pagerank`` computes: it ranks the full graph, in which
+        every Transaction is a node between its two accounts that takes its own teleport
+        share, so accounts get less than the whole mass, a damped two-hop walk between
+        them and extra rank for receiving many transactions. Scores from the two backends
+        are neither equal nor on one scale and must not be mixed.
+
+        Parameters:
+        -----------
+        alpha : float
+            Damping factor
+        max_iter : int
+            Maximum number of power iterations
+        tol : float
+            Convergence tolerance, iteration stops once the L1 change is below N * tol
+        personalization : numpy.ndarray, optional
+            Teleport distribution over node indices, uniform when omitted
+
+        Returns:
+        --------
+        numpy.ndarray
+            PageRank score per node index, summing to 1
+        """
+        n = self.num_nodes
+        if n == 0:
+            return np.zeros(0)
+        transition_t, dangling = self._transition()
+        teleport = self._teleport(personalization)
+
+        x = np.full(n, 1.0 / n)
+        for iteration in range(1, max_iter + 1):
+            x_last = x
+            x = alpha * (transition_t @ x_last) + (alpha * x_last[dangling].sum() + 1 - alpha) * teleport
+            if np.abs(x - x_last).sum() < n * tol:
+                break
+        else:
+            logging.warning(f"PageRank did not converge within {max_iter} iterations")
+        self.last_pagerank_iterations = iteration
+        return x
+
+    def pagerank_incremental(
+            self,
+            initial_scores: np.ndarray,
+            alpha: float = 0.85,
+            max_iter: int = 200,
+            tol: float = 1e-6
+        ) -> np.ndarray:
+        """
+        Warm-started PageRank by residual pushing from a previous solution.
+
+        With a uniform teleport and dangling mass spread uniformly, PageRank is the
+        normalized solution of the linear system y = alpha * P^T y + (1 - alpha) * 1,
+        whose right-hand side does not depend on the number of nodes. The previous
+        scores are rescaled into that system and its residual is computed exactly on
+        the whole current graph (one sparse product), so new nodes, a new node count and
+        a changed dangling mass show up as residual everywhere they matter, not only
+        around changed edges. Nodes whose residual exceeds ``tol / N`` (in units of the
+        normalized scores) then push it to their out-neighbours until none is left; when
+        more than a quarter of the nodes are active a sweep pushes all of them at once,
+        i.e. a warm-started power iteration.
+
+        Parameters:
+        -----------
+        initial_scores : numpy.ndarray
+            Previous PageRank per node index, new nodes set to any non-negative guess
+        alpha : float
+            Damping factor
+        max_iter : int
+            Maximum number of push sweeps
+        tol : float
+            Residual per node, relative to the average score 1 / N, below which a node stops pushing
+
+        Returns:
+        --------
+        numpy.ndarray
+            PageRank score per node index, summing to 1; the remaining L1 residual is in
+            ``last_pagerank_residual`` (the L1 error is at most that over 1 - alpha)
+        """
+        n = self.num_nodes
+        if n == 0:
+            return np.zeros(0)
+        transition_t, dangling = self._transition()
+        x = np.asarray(initial_scores, dtype=np.float64)
+        x = x / x.sum() if x.sum() > 0 else np.full(n, 1.0 / n)
+        # Total of the linear-system solution whose normalization has dangling share x[dangling].sum()
+        scale = (1 - alpha) * n / (1 - alpha + alpha * x[dangling].sum())
+        y = x * scale
+        residual = (1 - alpha) + alpha * (transition_t @ y) - y
+        threshold = tol * scale / n
+
+        row_stochastic = transition_t.T.tocsr()
+        touched = np.zeros(n, dtype=bool)
+        iteration = 0
+        active = np.flatnonzero(np.abs(residual) > threshold)
+        while active.size and iteration < max_iter:
+            iteration += 1
+            touched[active] = True
+            if active.size > n // 4:
+                y += residual
+                residual = alpha * (transition_t @ residual)
+            else:
+                pushed = residual[active]
+                y[active] += pushed
+                residual[active] = 0.0
+                rows = row_stochastic[active]
+                targets, inverse = np.unique(rows.indices, return_inverse=True)
+                residual[targets] += alpha * np.bincount(inverse, rows.data * np.repeat(pushed, np.diff(rows.indptr)), len(targets))
+            active = np.flatnonzero(np.abs(residual) > threshold)
+        if active.size:
+            logging.warning(f"Incremental PageRank did not converge within {max_iter} sweeps")
+        self.last_pagerank_iterations = iteration
+        self.last_pagerank_updated_nodes = int(touched.sum())
+        self.last_pagerank_residual = float(np.abs(residual).sum() / y.sum())
+        return y / y.sum()
+
+    def personalized_pagerank(
+            self,
+            seeds: np.ndarray,
+            alpha: float = 0.85,
+            max_iter: int = 100,
+            tol: float = 1e-6,
+            adjacency: Optional[sp.csr_matrix] = None
+        ) -> np.ndarray:
+        """
+        Personalized PageRank for several teleport vectors at once.
+
+        The seed vectors are the columns of one (N, S) matrix and are iterated together,
+        so every power iteration is a single sparse x dense product instead of S
+        sparse x vector products. Dangling mass returns to each column's own seeds.
+
+        Parameters:
+        -----------
+        seeds : numpy.ndarray
+            (N, S) non-negative seed weights, one column per seed set
+        alpha : float
+            Damping factor
+        max_iter : int
+            Maximum number of power iterations
+        tol : float
+            Iteration stops once every column's L1 change is below N * tol
+        adjacency : scipy.sparse.csr_matrix, optional
+            Edge weights to propagate over (e.g. ``decayed_adjacency``), transaction counts when omitted
+
+        Returns:
+        --------
+        numpy.ndarray
+            (N, S) scores, each non-empty column summing to 1 and empty columns all 0
+        """
+        n = self.num_nodes
+        seeds = np.asarray(seeds, dtype=np.float64).reshape(n, -1)
+        if n == 0:
+            return seeds.copy()
+        transition_t, dangling = self._transition(adjacency)
+        mass = seeds.sum(axis=0)
+        if (mass == 0).any():
+            logging.warning(f"{int((mass == 0).sum())} seed sets are empty, their scores stay 0")
+        teleport = np.divide(seeds, mass, out=np.zeros_like(seeds), where=mass > 0)
+
+        x = teleport.copy()
+        for iteration in range(1, max_iter + 1):
+            x_last = x
+            x = alpha * (transition_t @ x_last) + (alpha * x_last[dangling].sum(axis=0) + 1 - alpha) * teleport
+            if (np.abs(x - x_last).sum(axis=0) < n * tol).all():
+                break
+        else:
+            logging.warning(f"Personalized PageRank did not converge within {max_iter} iterations")
+        self.last_pagerank_iterations = iteration
+        return x
+
+    def decayed_adjacency(self, half_life_days: float, reference: Optional[np.datetime64] = None) -> sp.csr_matrix:
+        """
+        Adjacency whose transactions weigh 0.5 ** (age / half_life_days), age measured
+        back from ``reference`` (the newest transaction by default).
+        """
+        if self.edge_timestamps is None:
+            raise ValueError("Time-decayed weights need transaction timestamps on the graph")
+        if reference is None:
+            reference = self.edge_timestamps.max()
+        age_days = (np.datetime64(reference, "us") - self.edge_timestamps) / np.timedelta64(1, "D")
+        weights = np.power(0.5, np.maximum(age_days, 0.0) / half_life_days)
+        n = self.num_nodes
+        adjacency = sp.csr_matrix((weights, (self.edge_src, self.edge_dst)), shape=(n, n))
+        adjacency.sum_duplicates()
+        return adjacency
+
+    def _transition(self, adjacency: Optional[sp.csr_matrix] = None):
+        # Transposed row-stochastic transition matrix and the dangling-node mask
+        n = self.num_nodes
+        adjacency = self.adjacency if adjacency is None else adjacency
+        out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+        dangling = out_weight == 0
+        inv_out = np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)
+        return (sp.diags(inv_out) @ adjacency).T.tocsr(), dangling
+
+    def _teleport(self, personalization: Optional[np.ndarray]) -> np.ndarray:
+        if personalization is None:
+            return np.full(self.num_nodes, 1.0 / self.num_nodes)
+        teleport = np.asarray(personalization, dtype=np.float64)
+        return teleport / teleport.sum()
+
+    def betweenness_centrality(
+            self,
+            normalized: bool = True,
+            k: Optional[int] = None,
+            epsilon: Optional[float] = None,
+            delta: float = 0.1,
+            seed: Optional[int] = None,
+            n_jobs: Optional[int] = None
+        ) -> np.ndarray:
+        """
+        Betweenness centrality with Brandes' algorithm over unweighted shortest paths.
+
+        Exact by default; with ``k`` or ``epsilon`` only k sampled sources are run and
+        the summed dependencies are rescaled by N / k.
+
+        Parameters:
+        -----------
+        normalized : bool
+            Divide by (N - 1)(N - 2) like NetworkX does for directed graphs
+        k : int, optional
+            Number of sampled sources
+        epsilon : float, optional
+            Target additive error on normalized betweenness, used to derive k when k is not given
+        delta : float
+            Failure probability of the epsilon bound
+        seed : int, optional
+            Seed of the source sampling
+        n_jobs : int, optional
+            Worker processes sharing the CSR arrays, -1 uses every core, None runs in-process
+
+        Returns:
+        --------
+        numpy.ndarray
+            Betweenness per node index (settings of the run in ``last_betweenness_settings``)
+        """
+        n = self.num_nodes
+        if k is None and epsilon is not None:
+            k = betweenness_sample_size(n, epsilon, delta)
+        if k is None or k >= n:
+            sources = np.arange(n)
+            self.last_betweenness_settings = {"betweenness_method": "exact", "betweenness_samples": n}
+        else:
+            sources = np.sort(np.random.default_rng(seed).choice(n, size=k, replace=False))
+            self.last_betweenness_settings = {
+                "betweenness_method": "sampled",
+                "betweenness_samples": int(k),
+                "betweenness_seed": seed,
+                "betweenness_epsilon": epsilon
+            }
+
+        betweenness = self._sum_dependencies(sources, n_jobs)
+        if len(sources) < n and len(sources) > 0:
+            betweenness *= n / len(sources)
+        if normalized and n > 2:
+            betweenness *= 1.0 / ((n - 1) * (n - 2))
+        return betweenness
+
+    def _sum_dependencies(self, sources: np.ndarray, n_jobs: Optional[int]) -> np.ndarray:
+        indptr, indices = self.adjacency.indptr, self.adjacency.indices
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if not n_jobs or n_jobs <= 1 or len(sources) < 2:
+            total = np.zeros(self.num_nodes)
+            for source in sources:
+                total += single_source_dependencies(indptr, indices, source)
+            return total
+
+        # Copy the CSR arrays into shared memory once, workers attach read-only views
+        blocks = [_to_shared_memory(indptr), _to_shared_memory(indices)]
+        try:
+            specs = [(block.name, array.shape, array.dtype.str) for block, array in zip(blocks, (indptr, indices))]
+            chunks = np.array_split(sources, min(n_jobs * 4, len(sources)))
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_attach_shared_graph, initargs=(specs,)) as executor:
+                partials = executor.map(_sum_source_dependencies, chunks)
+                total = np.zeros(self.num_nodes)
+                for partial in partials:
+                    total += partial
+            return total
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+
+def save_pagerank_state(path: str, node_ids: np.ndarray, scores: np.ndarray, watermark: np.datetime64):
+    """
+    Persist a PageRank vector with the graph watermark (max transaction timestamp) it was computed at.
+    """
+    with open(path, "wb") as f:
+        np.savez(f, node_ids=node_ids, scores=scores, watermark=np.array(watermark, dtype="datetime64[us]"))
+
+
+def load_pagerank_state(path: str):
+    """
+    Load a state written by ``save_pagerank_state``, or None when there is no usable state.
+
+    Returns:
+    --------
+    tuple or None
+        (node_ids, scores, watermark)
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as state:
+        return state["node_ids"], state["scores"], state["watermark"][()]
+
+
+# Default approximation of the batch feature jobs: k from the Hoeffding bound below, fixed seed
+DEFAULT_BETWEENNESS_EPSILON = 0.05
+DEFAULT_BETWEENNESS_SEED = 42
+
+
+def betweenness_sample_size(num_nodes: int, epsilon: float, delta: float = 0.1) -> int:
+    """
+    Number of sampled sources so every normalized score is within epsilon with probability 1 - delta
+    (Hoeffding bound with a union bound over the nodes).
+    """
+    if num_nodes < 2:
+        return num_nodes
+    return min(num_nodes, math.ceil(math.log(2 * num_nodes / delta) / (2 * epsilon ** 2)))
+
+
+def _to_shared_memory(array: np.ndarray) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block
+
+
+_WORKER_GRAPH = {}
+
+
+def _attach_shared_graph(specs):
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = []
+    for block, (_, shape, dtype) in zip(blocks, specs):
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays.append(array)
+    _WORKER_GRAPH["blocks"] = blocks
+    _WORKER_GRAPH["indptr"], _WORKER_GRAPH["indices"] = arrays
+
+
+def _sum_source_dependencies(sources: np.ndarray) -> np.ndarray:
+    indptr, indices = _WORKER_GRAPH["indptr"], _WORKER_GRAPH["indices"]
+    total = np.zeros(len(indptr) - 1)
+    for source in sources:
+        total += single_source_dependencies(indptr, indices, source)
+    return total
+
+
+def _edge_positions(indptr: np.ndarray, frontier: np.ndarray) -> np.ndarray:
+    # Positions in ``indices`` of every out-edge leaving the frontier nodes
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = counts.sum()
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total)
+
+
+def single_source_dependencies(indptr: np.ndarray, indices: np.ndarray, source: int) -> np.ndarray:
+    """
+    Brandes dependency vector of one source, using level-synchronous vectorized BFS.
+    """
+    n = len(indptr) - 1
+    distance = np.full(n, -1, dtype=np.int64)
+    sigma = np.zeros(n)
+    distance[source] = 0
+    sigma[source] = 1.0
+
+    frontier = np.array([source], dtype=np.int64)
+    level_edges = []
+    level = 0
+    while frontier.size:
+        positions = _edge_positions(indptr, frontier)
+        tails = np.repeat(frontier, indptr[frontier + 1] - indptr[frontier])
+        heads = indices[positions]
+        unseen = distance[heads] == -1
+        distance[heads[unseen]] = level + 1
+        on_path = distance[heads] == level + 1
+        tails, heads = tails[on_path], heads[on_path]
+        np.add.at(sigma, heads, sigma[tails])
+        level_edges.append((tails, heads))
+        frontier = np.unique(heads)
+        level += 1
+
+    delta = np.zeros(n)
+    for tails, heads in reversed(level_edges):
+        np.add.at(delta, tails, sigma[tails] / sigma[heads] * (1.0 + delta[heads]))
+    delta[source] = 0.0
+    return delta
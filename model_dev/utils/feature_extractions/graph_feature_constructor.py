@@ -3,19 +3,84 @@ import os
 from dotenv import load_dotenv #type: ignore
 load_dotenv(override=True)
 sys.path.append(os.getenv("PROJECT_PATH"))
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import logging 
+import queue
+import time
+import numpy as np #type: ignore
 
 from services.memgraph import MemgraphClient
+from utils.feature_extractions.graph_engine import (
+    CSRGraph,
+    save_pagerank_state,
+    load_pagerank_state
+)
+from utils.feature_extractions.feature_cache import record_graph_scores
 mg_client = MemgraphClient()
 
+UPDATE_NODE_PROPERTIES_QUERY = '''
+    UNWIND $rows AS row
+    MATCH (n:Account) WHERE id(n) = row.node_id
+    SET n += row.props
+'''
+
 class GraphFeatureConstructor:
-    def __init__(self):
+    def __init__(self, backend: str = "memgraph", pagerank_state_path: Optional[str] = None):
+        """
+        Parameters:
+        -----------
+        backend : str
+            "memgraph" runs the nxalg procedures inside Memgraph, "local" pulls the
+            edge list once and computes the scores in-process on a CSR graph. The local
+            PageRank runs on the account graph with Transaction nodes collapsed into
+            edges and differs from nxalg.pagerank on the full graph (see
+            ``CSRGraph.pagerank``), so the backend is written next to the scores and
+            into the graph fingerprint
+        pagerank_state_path : str, optional
+            File where the local backend persists the last PageRank vector and its
+            graph watermark, required for incremental refreshes
+        """
+        if backend not in ("memgraph", "local"):
+            raise ValueError(f"Unknown backend: {backend}")
         self.mg_client = MemgraphClient()
+        self.backend = backend
+        self.local_graph = None
+        self.betweenness_settings = {}
+        self.pagerank_state_path = pagerank_state_path
+        self.pagerank_info = {}
+
+    def get_local_graph(self, refresh: bool = False) -> CSRGraph:
+        if self.local_graph is None or refresh:
+            self.local_graph = CSRGraph.from_memgraph(self.mg_client)
+        return self.local_graph
+
+    def run_pagerank(self, incremental: bool = False, max_delta_ratio: float = 0.05) -> Dict[int, float]:
+        """
+        PageRank per account.
+
+        Parameters:
+        -----------
+        incremental : bool
+            Warm-start from the persisted state and push the residual left by transactions
+            newer than its watermark (local backend with a state path only)
+        max_delta_ratio : float
+            Fall back to a full recompute when more than this fraction of the edges is new
 
-    def run_pagerank(self) -> Dict[int, float]:
+        Returns:
+        --------
+        dict
+            ``{node_id: pagerank}``; the path taken and iteration count are kept in ``self.pagerank_info``
+        """
+        if incremental and (self.backend != "local" or not self.pagerank_state_path):
+            raise ValueError("Incremental PageRank needs backend='local' and a pagerank_state_path")
+        if self.backend == "local":
+            graph = self.get_local_graph()
+            scores = self._run_local_pagerank(graph, incremental, max_delta_ratio)
+            logging.info(f"Local PageRank: {self.pagerank_info}")
+            return graph.to_node_dict(scores)
         query = '''
             CALL nxalg.pagerank() 
             YIELD node, rank
@@ -28,40 +93,228 @@ class GraphFeatureConstructor:
         logging.debug("Pagerank Results:", results[0:10]) 
         return {row["node_id"]: row["rank"] for row in results}
 
-    def run_betweenness_centrality(self) -> Dict[int, float]:
-        query = '''
-            CALL nxalg.betweenness_centrality() 
-            YIELD node, betweenness
-            WITH node, betweenness
-            WHERE node:Account
-            RETURN id(node) AS node_id, betweenness
-            ORDER BY betweenness DESC
-        '''
-        results = self.mg_client.execute_query(query)
+    def _run_local_pagerank(self, graph: CSRGraph, incremental: bool, max_delta_ratio: float):
+        watermark = graph.edge_timestamps.max() if graph.num_edges else np.datetime64("NaT")
+        state = load_pagerank_state(self.pagerank_state_path) if incremental else None
+        info = {"mode": "full", "reason": "incremental not requested" if not incremental else "no previous state"}
+
+        if state is not None:
+            previous_ids, previous_scores, previous_watermark = state
+            new_edges = graph.edge_timestamps > previous_watermark
+            delta_ratio = new_edges.mean() if len(new_edges) else 0.0
+            info = {"mode": "full", "reason": "delta too large", "delta_ratio": float(delta_ratio)}
+            if delta_ratio <= max_delta_ratio:
+                # Carry the previous scores over by node id, new nodes start at the teleport share
+                initial = np.full(graph.num_nodes, 1.0 / graph.num_nodes)
+                position = np.searchsorted(previous_ids, graph.node_ids)
+                position = np.clip(position, 0, max(len(previous_ids) - 1, 0))
+                known = (previous_ids[position] == graph.node_ids) if len(previous_ids) else np.zeros(graph.num_nodes, dtype=bool)
+                initial[known] = previous_scores[position[known]]
+
+                scores = graph.pagerank_incremental(initial)
+                info = {
+                    "mode": "incremental",
+                    "delta_ratio": float(delta_ratio),
+                    "new_edges": int(new_edges.sum()),
+                    "updated_nodes": graph.last_pagerank_updated_nodes,
+                    "residual": graph.last_pagerank_residual
+                }
+
+        if info["mode"] == "full":
+            scores = graph.pagerank()
+        info["iterations"] = graph.last_pagerank_iterations
+        info["watermark"] = str(watermark)
+        self.pagerank_info = info
+        if self.pagerank_state_path:
+            save_pagerank_state(self.pagerank_state_path, graph.node_ids, scores, watermark)
+        return scores
+
+    def run_betweenness_centrality(
+            self,
+            k: Optional[int] = None,
+            epsilon: Optional[float] = None,
+            seed: Optional[int] = None,
+            n_jobs: Optional[int] = None
+        ) -> Dict[int, float]:
+        """
+        Betweenness per account, exact by default or approximated from k sampled sources.
+
+        Parameters:
+        -----------
+        k : int, optional
+            Number of sampled Brandes sources
+        epsilon : float, optional
+            Target error bound used to derive k (local backend only)
+        seed : int, optional
+            Seed of the source sampling
+        n_jobs : int, optional
+            Worker processes for the local backend, -1 uses every core
+
+        Returns:
+        --------
+        dict
+            ``{node_id: betweenness}``; the settings used are kept in ``self.betweenness_settings``
+        """
+        if self.backend == "local":
+            graph = self.get_local_graph()
+            scores = graph.betweenness_centrality(k=k, epsilon=epsilon, seed=seed, n_jobs=n_jobs)
+            self.betweenness_settings = graph.last_betweenness_settings
+            return graph.to_node_dict(scores)
+        if epsilon is not None:
+            raise ValueError("epsilon is only supported by the local backend, pass k instead")
+        if k is None:
+            query = '''
+                CALL nxalg.betweenness_centrality() 
+                YIELD node, betweenness
+                WITH node, betweenness
+                WHERE node:Account
+                RETURN id(node) AS node_id, betweenness
+                ORDER BY betweenness DESC
+            '''
+            self.betweenness_settings = {"betweenness_method": "exact"}
+        else:
+            query = '''
+                CALL nxalg.betweenness_centrality($k, true, null, false, $seed) 
+                YIELD node, betweenness
+                WITH node, betweenness
+                WHERE node:Account
+                RETURN id(node) AS node_id, betweenness
+                ORDER BY betweenness DESC
+            '''
+            self.betweenness_settings = {
+                "betweenness_method": "sampled",
+                "betweenness_samples": k,
+                "betweenness_seed": seed
+            }
+        results = self.mg_client.execute_query(query, {"k": k, "seed": seed})
         logging.debug("Betweenness Results:", results[0:10])
         return {row["node_id"]: row["betweenness"] for row in results}
 
-    def update_node_properties(self, node_features: Dict[int, Dict[str, Any]]):
-        for node_id, features in node_features.items():
-            query = f'''
-                MATCH (n:Account) WHERE id(n) = {node_id}
-                SET {", ".join([f"n.{k} = {repr(v)}" for k, v in features.items() if v is not None])}
-            '''
-            self.mg_client.execute_query(query)
+    def update_node_properties(
+            self,
+            node_features: Dict[int, Dict[str, Any]],
+            batch_size: int = 10000,
+            n_writers: int = 1,
+            max_retries: int = 3,
+            retry_backoff: float = 1.0
+        ) -> Dict[str, Any]:
+        """
+        Write node properties back to Memgraph in parameterized UNWIND batches.
+
+        Parameters:
+        -----------
+        node_features : dict
+            Mapping of internal node id to a dict of property values
+        batch_size : int
+            Number of nodes written per UNWIND statement
+        n_writers : int
+            Number of parallel writer sessions (one Memgraph connection each)
+        max_retries : int
+            Number of retries for a failed batch before giving up
+        retry_backoff : float
+            Base seconds to wait between retries (doubled after each attempt)
+
+        Returns:
+        --------
+        dict
+            Write statistics: rows written, batches, failed batches, seconds and rows per second
+        """
+        rows = [
+            {
+                "node_id": node_id,
+                "props": {k: v for k, v in features.items() if v is not None}
+            }
+            for node_id, features in node_features.items()
+        ]
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+        start = time.perf_counter()
+        if n_writers <= 1:
+            results = [
+                self._write_batch(self.mg_client, batch, max_retries, retry_backoff)
+                for batch in batches
+            ]
+        else:
+            writers = queue.Queue()
+            for _ in range(n_writers):
+                writers.put(MemgraphClient())
+
+            def write_with_pooled_session(batch):
+                client = writers.get()
+                try:
+                    return self._write_batch(client, batch, max_retries, retry_backoff)
+                finally:
+                    writers.put(client)
+
+            with ThreadPoolExecutor(max_workers=n_writers) as executor:
+                results = list(executor.map(write_with_pooled_session, batches))
+        elapsed = time.perf_counter() - start
+
+        rows_written = sum(results)
+        stats = {
+            "rows_written": rows_written,
+            "batches": len(batches),
+            "failed_batches": sum(1 for batch, written in zip(batches, results) if written < len(batch)),
+            "seconds": elapsed,
+            "rows_per_second": rows_written / elapsed if elapsed > 0 else 0.0
+        }
+        logging.info(
+            f"Wrote {rows_written} nodes in {len(batches)} batches "
+            f"({stats['rows_per_second']:.0f} rows/s, {stats['failed_batches']} failed batches)"
+        )
+        return stats
+
+    def _write_batch(self, client: MemgraphClient, batch: List[Dict[str, Any]], max_retries: int, retry_backoff: float) -> int:
+        for attempt in range(max_retries + 1):
+            try:
+                client.execute_write(UPDATE_NODE_PROPERTIES_QUERY, {"rows": batch})
+                return len(batch)
+            except Exception as e:
+                if attempt == max_retries:
+                    logging.error(f"Batch of {len(batch)} nodes failed after {attempt + 1} attempts: {e}")
+                    return 0
+                logging.warning(f"Batch write failed (attempt {attempt + 1}), retrying: {e}")
+                time.sleep(retry_backoff * (2 ** attempt))
+        return 0
 
-    def construct_and_update_node_properties(self):
+    def construct_and_update_node_properties(
+            self,
+            batch_size: int = 10000,
+            n_writers: int = 1,
+            betweenness_k: Optional[int] = None,
+            betweenness_epsilon: Optional[float] = None,
+            betweenness_seed: Optional[int] = None,
+            n_jobs: Optional[int] = None,
+            incremental_pagerank: bool = False
+        ):
         try:
-            pagerank_scores = self.run_pagerank()
-            betweenness_centrality = self.run_betweenness_centrality()
+            pagerank_scores = self.run_pagerank(incremental=incremental_pagerank)
+            betweenness_centrality = self.run_betweenness_centrality(
+                k=betweenness_k,
+                epsilon=betweenness_epsilon,
+                seed=betweenness_seed,
+                n_jobs=n_jobs
+            )
             node_features = {}
             for node_id in set(pagerank_scores.keys()).union(betweenness_centrality.keys()):
                 features = {
                     "pagerank": pagerank_scores.get(node_id, None),
                     "betweenness": betweenness_centrality.get(node_id, None)
                 }
+                if features["pagerank"] is not None:
+                    features["pagerank_backend"] = self.backend
+                # Record how the betweenness was computed next to the score itself
+                if features["betweenness"] is not None:
+                    features.update(self.betweenness_settings)
                 node_features[node_id] = features
-            self.update_node_properties(node_features)
-            logging.info("ALL nodes updated the features of pagerank and betweeness")
+            write_stats = self.update_node_properties(node_features, batch_size=batch_size, n_writers=n_writers)
+            # Cached features keyed by the fingerprint stop matching once other scores are written
+            record_graph_scores(
+                self.mg_client,
+                pagerank_backend=self.backend,
+                centrality_settings={**self.betweenness_settings, "pagerank_incremental": incremental_pagerank}
+            )
+            logging.info(f"ALL nodes updated the features of pagerank and betweeness: {write_stats}")
             return True
         except Exception as e:
             logging.error(f"Error to construct the graph {e}")
@@ -3,29 +3,90 @@ import os
 from dotenv import load_dotenv  # type: ignore
 load_dotenv(override=True)
 sys.path.append(os.getenv("PROJECT_PATH"))
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import queue
+import re
 import pandas as pd #type: ignore 
 import numpy as np #type: ignore 
 from sklearn.preprocessing import StandardScaler #type: ignore 
 from sklearn.decomposition import PCA #type: ignore 
 from services.memgraph import MemgraphClient
+from utils.feature_extractions.feature_engineering import (
+    FeatureEngineeringTransformer,
+    traced_peak_memory,
+    frame_megabytes
+)
+
+PROPERTY_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# account_id is not guaranteed unique: pages hold distinct values, so all accounts sharing
+# one land on the same page and aggregate together as in extract_node_features.
+# The first page has no predicate and later pages a plain range on the indexed property
+# (an ``$after IS NULL OR ...`` disjunction keeps the planner off the index).
+FIRST_ACCOUNT_PAGE_QUERY = '''
+    MATCH (a:Account)
+    WITH DISTINCT a.account_id AS account_id
+    RETURN account_id
+    ORDER BY account_id
+    LIMIT $limit
+'''
+
+NEXT_ACCOUNT_PAGE_QUERY = '''
+    MATCH (a:Account)
+    WHERE a.account_id > $after
+    WITH DISTINCT a.account_id AS account_id
+    RETURN account_id
+    ORDER BY account_id
+    LIMIT $limit
+'''
+
+def frame_from_stream(rows: Iterable[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Build a DataFrame from a stream of result rows, appending each value to its column
+    as the rows arrive. ``pd.DataFrame.from_records`` would list the whole generator
+    first, holding one dict per row next to the frame being built.
+    """
+    columns = defaultdict(list)
+    for row in rows:
+        for name, value in row.items():
+            columns[name].append(value)
+    return pd.DataFrame(columns)
+
 
 class GraphFeatureExtractor:
     def __init__(self):
         self.mg_client = MemgraphClient()
+        self.feature_transformer = None
 
-    def extract_node_features(self):
-        try:
-            print("✅ Querying Data from Memgraph")
-            query = '''
+    def build_feature_query(self, extra_properties: Optional[List[str]] = None, account_filter: str = "") -> str:
+        """
+        Build the per-account aggregate query.
+
+        Parameters:
+        -----------
+        extra_properties : list of str, optional
+            Additional Account properties to select as columns
+        account_filter : str
+            Optional ``WHERE`` clause on ``a`` restricting the aggregated accounts
+        """
+        extra_properties = extra_properties or []
+        for prop in extra_properties:
+            if not PROPERTY_NAME_PATTERN.match(prop):
+                raise ValueError(f"Invalid property name: {prop}")
+        extra_with = "".join(f"\n                    a.{prop} AS {prop}," for prop in extra_properties)
+        extra_carry = "".join(f"\n                    {prop}," for prop in extra_properties)
+        extra_return = "".join(f",\n                    {prop}" for prop in extra_properties)
+        return f'''
                 MATCH (a:Account)-[:FROM]->(t:Transaction)-[:TO]->(r:Account)
+                {account_filter}
                 WITH 
                     a.account_id AS account_id,
                     a.bank AS bank,
                     a.betweenness AS betweenness,
-                    a.pagerank AS pagerank,
+                    a.pagerank AS pagerank,{extra_with}
 
                     COUNT(DISTINCT t.transaction_id) AS total_trxns,
                     COUNT(DISTINCT CASE WHEN t.is_laundering = 1 THEN r.account_id END) AS total_fraud_trxns,
@@ -48,7 +109,7 @@ class GraphFeatureExtractor:
                     account_id,
                     bank,
                     betweenness,
-                    pagerank,
+                    pagerank,{extra_carry}
                     total_trxns,
                     total_fraud_trxns,
                     total_receivers,
@@ -112,18 +173,26 @@ class GraphFeatureExtractor:
                     pagerank_betweenness_difference,
                     ratio_pagerank_betweenness,
                     ratio_pagerank_txn,
-                    ratio_pagerank_txn_amount
+                    ratio_pagerank_txn_amount{extra_return}
 
             '''
-            features = self.mg_client.execute_query(query)
-            account_feature_list = []
+
+    def extract_node_features(self, extra_properties: Optional[List[str]] = None):
+        """
+        Aggregate the per-account features from the transaction graph.
+
+        Parameters:
+        -----------
+        extra_properties : list of str, optional
+            Additional Account properties written by other stages to select as columns,
+            e.g. ``CLUSTERING_PROPERTIES`` from graph_node_clustering
+        """
+        try:
+            print("✅ Querying Data from Memgraph")
+            query = self.build_feature_query(extra_properties)
             print("✅ Transform the query results to Dataframe")
-            for f in features:
-                # Dynamically map the keys from the query response
-                account_features = {key: f[key] for key in f}
-                account_feature_list.append(account_features)
             try: 
-                df = pd.DataFrame(account_feature_list)
+                df = frame_from_stream(self.mg_client.stream_query(query))
             except Exception as e:
                 print(f"❌ Cannot convert to dataframe {e}", flush=True)
             return df
@@ -132,14 +201,109 @@ class GraphFeatureExtractor:
             print(f"❌ Error extracting graph features: {e}", flush=True)
             return None
 
-    def apply_feature_engineering(self, df):
+    def extract_node_features_sharded(
+            self,
+            n_shards: int = 4,
+            max_workers: Optional[int] = None,
+            extra_properties: Optional[List[str]] = None
+        ):
+        """
+        Extract the per-account features as N disjoint shards queried concurrently.
+
+        Accounts are split by ``id(a) % n_shards``; every shard runs the same aggregate
+        query on its own Memgraph session so the server works on several shards at once.
+
+        Parameters:
+        -----------
+        n_shards : int
+            Number of disjoint account shards
+        max_workers : int, optional
+            Number of concurrent sessions, defaults to ``n_shards``
+        extra_properties : list of str, optional
+            Additional Account properties to select as columns
+
+        Returns:
+        --------
+        pandas.DataFrame
+            Same rows and columns as ``extract_node_features`` (ordered by account_id)
+        """
+        try:
+            print(f"✅ Querying Data from Memgraph in {n_shards} shards")
+            query = self.build_feature_query(extra_properties, account_filter="WHERE id(a) % $n_shards = $shard")
+            max_workers = max_workers or n_shards
+            sessions = queue.Queue()
+            for _ in range(max_workers):
+                sessions.put(MemgraphClient())
+
+            def extract_shard(shard):
+                client = sessions.get()
+                try:
+                    return frame_from_stream(client.stream_query(query, {"n_shards": n_shards, "shard": shard}))
+                finally:
+                    sessions.put(client)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                shards = [chunk for chunk in executor.map(extract_shard, range(n_shards)) if not chunk.empty]
+            print("✅ Concatenate the shard results")
+            if not shards:
+                return pd.DataFrame()
+            return pd.concat(shards, ignore_index=True).sort_values("account_id", ignore_index=True)
+
+        except Exception as e:
+            print(f"❌ Error extracting graph features: {e}", flush=True)
+            return None
+
+    def iter_node_features(self, chunk_size: int = 50000, extra_properties: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Stream the per-account features as DataFrame chunks.
+
+        Accounts are paged by distinct ``account_id`` values with keyset pagination
+        (``account_id > last seen``, an index range scan), and only one page of accounts is
+        aggregated and held in memory at a time.
+
+        Parameters:
+        -----------
+        chunk_size : int
+            Number of distinct account ids per page (accounts without outgoing transactions produce no row)
+        extra_properties : list of str, optional
+            Additional Account properties to select as columns
+
+        Yields:
+        -------
+        pandas.DataFrame
+            Same columns as ``extract_node_features`` for one page of accounts
+        """
+        query = self.build_feature_query(extra_properties, account_filter="WHERE a.account_id IN $account_ids")
+        last_account_id = None
+        while True:
+            if last_account_id is None:
+                page = self.mg_client.stream_query(FIRST_ACCOUNT_PAGE_QUERY, {"limit": chunk_size})
+            else:
+                page = self.mg_client.stream_query(NEXT_ACCOUNT_PAGE_QUERY, {"after": last_account_id, "limit": chunk_size})
+            account_ids = [row["account_id"] for row in page]
+            if not account_ids:
+                return
+            last_account_id = account_ids[-1]
+            chunk = frame_from_stream(self.mg_client.stream_query(query, {"account_ids": account_ids}))
+            if not chunk.empty:
+                yield chunk
+
+    def apply_feature_engineering(self, df, low_memory=False, report_memory=False):
         """
         Preprocess transaction data and engineer new features for anomaly detection.
+
+        Fits a ``FeatureEngineeringTransformer`` on df; the fitted transformer is kept in
+        ``self.feature_transformer`` and its state in metadata['feature_engineering'],
+        use its ``transform`` to score new batches with the same features.
         
         Parameters:
         -----------
         df : pandas.DataFrame
             DataFrame containing the transaction features
+        low_memory : bool
+            float32 numerics, categorical strings and one block for the derived columns
+        report_memory : bool
+            Print the frame sizes and the peak memory traced during the feature engineering
         
         Returns:
         --------
@@ -149,67 +313,17 @@ class GraphFeatureExtractor:
             Dictionary of preprocessing metadata (feature lists, correlation info)
         """
         print("✅ Applying the Feature Engineering")
-        processed_df = df.copy()
-        
-        # Step 1: Handle non-numeric columns
-        numeric_cols = processed_df.select_dtypes(include=['float64', 'int64']).columns
-        non_numeric_cols = [col for col in processed_df.columns if col not in numeric_cols]
-        
-        # Step 2: Apply log transformation to amount-based features
-        amount_cols = [col for col in numeric_cols if 'amount' in col.lower() or 'usd' in col.lower()]
-        for col in amount_cols:
-            processed_df[f'{col}_log'] = np.log1p(processed_df[col])
-        
-        # Step 3: Add new engineered features
-        
-        # Transaction pattern features
-        processed_df['txn_size_variability'] = processed_df['max_usd_amount'] / (processed_df['min_usd_amount'] + 1)
-        processed_df['amount_count_ratio'] = processed_df['total_usd_amount'] / (processed_df['total_trxns'] + 1)
-        processed_df['small_high_ratio'] = (processed_df['total_small_txns'] + 1) / (processed_df['total_high_txns'] + 1)
-        
-        # Network pattern features
-        processed_df['network_anomaly_score'] = processed_df['pagerank'] * processed_df['ratio_fraud_receiver']
-        processed_df['position_activity_disparity'] = abs(processed_df['pagerank'] - (processed_df['total_trxns'] / processed_df['total_trxns'].max()))
-        
-        # Temporal pattern features
-        processed_df['variance_txns_per_day'] = processed_df['total_trxns'] / (processed_df['total_active_days'] ** 2)
-        processed_df['temporal_density'] = processed_df['total_trxns'] / (processed_df['total_active_days'] + 1)
-        
-        # Fraud-specific ratios
-        processed_df['fraud_to_normal_ratio'] = processed_df['total_fraud_trxns'] / (processed_df['total_trxns'] - processed_df['total_fraud_trxns'] + 1)
-        
-        # Combined metric features
-        processed_df['combined_network_centrality'] = processed_df['pagerank'] * processed_df['betweenness']
-        processed_df['risk_score'] = (
-            processed_df['ratio_fraud_usd_amount'] * 
-            processed_df['ratio_cash_trxns'] * 
-            processed_df['combined_network_centrality']
-        )
-        
-        # Step 4: Identify highly correlated features
-        # Get updated numeric columns after adding new features
-        numeric_cols = processed_df.select_dtypes(include=['float64', 'int64']).columns
-        
-        corr_matrix = processed_df[numeric_cols].corr().abs()
-        upper = corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=1).astype(bool))
-        to_drop = [column for column in upper.columns if any(upper[column] > 0.95)]
-        
-        # Step 5: Create feature lists for model training
-        id_cols = [col for col in non_numeric_cols if 'id' in col.lower() or col == 'account_id' or col == 'bank']
-        features_for_model = [col for col in numeric_cols if col not in id_cols and col not in to_drop]
-        
-        # Create metadata dictionary
-        preprocessing_metadata = {
-            'original_features': df.columns.tolist(),
-            'added_features': [col for col in processed_df.columns if col not in df.columns],
-            'highly_correlated_features': to_drop,
-            'features_for_model': features_for_model,
-            'id_columns': id_cols,
-            'numeric_columns': numeric_cols.tolist(),
-            'non_numeric_columns': non_numeric_cols
-        }
-        
-        return processed_df, preprocessing_metadata
+        transformer = FeatureEngineeringTransformer(low_memory=low_memory)
+        if report_memory:
+            (processed_df, preprocessing_metadata), peak = traced_peak_memory(transformer.fit_transform, df)
+            print(
+                f"✅ Feature engineering memory (low_memory={low_memory}): input {frame_megabytes(df):.1f} MB, "
+                f"output {frame_megabytes(processed_df):.1f} MB, peak traced {peak / 1024 ** 2:.1f} MB"
+            )
+        else:
+            processed_df, preprocessing_metadata = transformer.fit_transform(df)
+        self.feature_transformer = transformer
+        return processed_df, {**preprocessing_metadata, 'feature_engineering': transformer.to_dict()}
 
 # if __name__ == "__main__":
 #     graph_extractor = GraphFeatureExtractor()
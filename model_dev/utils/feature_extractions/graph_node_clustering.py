@@ -0,0 +1,404 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import logging
+import numpy as np #type: ignore
+import scipy.sparse as sp #type: ignore
+
+from utils.feature_extractions.graph_engine import CSRGraph, _to_shared_memory
+from utils.feature_extractions.graph_feature_constructor import GraphFeatureConstructor
+from utils.feature_extractions.feature_cache import record_graph_scores
+
+CLUSTERING_METHODS = {
+    "louvain": "louvain",
+    "label_propagation": "lpa"
+}
+
+CLUSTERING_PROPERTIES = [
+    f"{prefix}_{name}"
+    for prefix in CLUSTERING_METHODS.values()
+    for name in ("community_id", "community_size", "intra_flow_ratio", "inter_flow_ratio")
+]
+
+class GraphNodeClustering:
+    """
+    Node clustering stage over the in-process CSR transaction graph.
+
+    Runs Louvain modularity and/or label propagation on the undirected account graph
+    and writes, per account and method, the community id, the community size and the
+    share of the account's USD flow that stays inside / leaves its community.
+    """
+
+    def __init__(self, constructor: Optional[GraphFeatureConstructor] = None):
+        self.constructor = constructor or GraphFeatureConstructor(backend="local")
+
+    def run_clustering(
+            self,
+            methods: Tuple[str, ...] = ("louvain", "label_propagation"),
+            seed: int = 42,
+            n_jobs: Optional[int] = None
+        ) -> Dict[str, np.ndarray]:
+        """
+        Cluster the account graph with every requested method.
+
+        Parameters:
+        -----------
+        methods : tuple
+            Any of "louvain" and "label_propagation"
+        seed : int
+            Seed for the randomized move / tie-breaking order
+        n_jobs : int, optional
+            Worker processes sharing the graph, every sweep of a method is split over
+            node ranges; -1 uses every core. The communities do not depend on n_jobs
+
+        Returns:
+        --------
+        dict
+            Method name to community label per node index
+        """
+        for method in methods:
+            if method not in CLUSTERING_METHODS:
+                raise ValueError(f"Unknown clustering method: {method}")
+        graph = self.constructor.get_local_graph()
+        undirected = symmetrize(graph.adjacency)
+        return {method: _cluster(method, undirected, seed, n_jobs) for method in methods}
+
+    def community_features(self, graph: CSRGraph, communities: Dict[str, np.ndarray]) -> Dict[int, Dict[str, Any]]:
+        """
+        Build ``{node_id: properties}`` with the community features of every method.
+        """
+        columns = {}
+        for method, labels in communities.items():
+            prefix = CLUSTERING_METHODS[method]
+            sizes = np.bincount(labels)
+            intra, inter = flow_ratios(graph, labels)
+            columns[f"{prefix}_community_id"] = labels.tolist()
+            columns[f"{prefix}_community_size"] = sizes[labels].tolist()
+            columns[f"{prefix}_intra_flow_ratio"] = intra.tolist()
+            columns[f"{prefix}_inter_flow_ratio"] = inter.tolist()
+
+        node_ids = graph.node_ids.tolist()
+        return {
+            node_id: {name: values[i] for name, values in columns.items()}
+            for i, node_id in enumerate(node_ids)
+        }
+
+    def cluster_and_update_node_properties(
+            self,
+            methods: Tuple[str, ...] = ("louvain", "label_propagation"),
+            seed: int = 42,
+            n_jobs: Optional[int] = None,
+            batch_size: int = 10000,
+            n_writers: int = 1
+        ):
+        try:
+            communities = self.run_clustering(methods=methods, seed=seed, n_jobs=n_jobs)
+            graph = self.constructor.get_local_graph()
+            for method, labels in communities.items():
+                logging.info(f"{method}: {labels.max() + 1} communities over {len(labels)} accounts")
+            node_features = self.community_features(graph, communities)
+            write_stats = self.constructor.update_node_properties(node_features, batch_size=batch_size, n_writers=n_writers)
+            # Cached features keyed by the fingerprint stop matching the old communities
+            record_graph_scores(self.constructor.mg_client, clustering_settings={"methods": list(methods), "seed": seed})
+            logging.info(f"ALL nodes updated the community features: {write_stats}")
+            return True
+        except Exception as e:
+            logging.error(f"Error to cluster the graph {e}")
+            return False
+
+
+def symmetrize(adjacency: sp.csr_matrix) -> sp.csr_matrix:
+    """
+    Undirected weighted adjacency (A + A^T) without self loops.
+    """
+    undirected = (adjacency + adjacency.T).tocsr()
+    undirected.setdiag(0)
+    undirected.eliminate_zeros()
+    return undirected
+
+
+def flow_ratios(graph: CSRGraph, labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Share of each account's in + out USD flow exchanged with its own community vs. other communities.
+    """
+    n = graph.num_nodes
+    amounts = graph.edge_amounts if graph.edge_amounts is not None else np.ones(len(graph.edge_src))
+    amounts = np.nan_to_num(amounts)
+    same = labels[graph.edge_src] == labels[graph.edge_dst]
+    total = np.bincount(graph.edge_src, amounts, n) + np.bincount(graph.edge_dst, amounts, n)
+    intra = np.bincount(graph.edge_src, amounts * same, n) + np.bincount(graph.edge_dst, amounts * same, n)
+    intra_ratio = np.divide(intra, total, out=np.zeros(n), where=total > 0)
+    inter_ratio = np.where(total > 0, 1.0 - intra_ratio, 0.0)
+    return intra_ratio, inter_ratio
+
+
+def _cluster(method: str, undirected: sp.csr_matrix, seed: int, n_jobs: Optional[int] = None) -> np.ndarray:
+    if method == "louvain":
+        return louvain_communities(undirected, seed=seed, n_jobs=n_jobs)
+    return label_propagation_communities(undirected, seed=seed, n_jobs=n_jobs)
+
+
+def _best_neighbour_community(
+        rows: np.ndarray,
+        cols: np.ndarray,
+        weights: np.ndarray,
+        labels: np.ndarray,
+        score_adjustment=None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Aggregate edge weight from every node to each neighbouring community, then pick the
+    # best community per node. Returns (nodes, best community, best score).
+    rows, communities = rows.astype(np.int64), labels[cols].astype(np.int64)
+    n_labels = int(labels.max()) + 1
+    keys, inverse = np.unique(rows * n_labels + communities, return_inverse=True)
+    weights = np.bincount(inverse, weights, len(keys))
+    rows, communities = keys // n_labels, keys % n_labels
+    scores = weights if score_adjustment is None else score_adjustment(rows, communities, weights)
+    # keys are sorted by row, so the best candidate of each row is the max within its run
+    order = np.lexsort((-scores, rows))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = rows[order][1:] != rows[order][:-1]
+    best = order[first]
+    return rows[best], communities[best], scores[best]
+
+
+def _sweep_candidates(arrays: Dict[str, np.ndarray], lo: int, hi: int, method: str, **settings) -> Tuple[np.ndarray, ...]:
+    # Best move of every node in [lo, hi) given the labels of the previous sweep:
+    # (nodes, best community, its score, score of staying or None for label propagation)
+    indptr, labels = arrays["indptr"], arrays["labels"]
+    rows = np.repeat(np.arange(lo, hi), np.diff(indptr[lo:hi + 1]))
+    cols, weights = arrays["indices"][indptr[lo]:indptr[hi]], arrays["data"][indptr[lo]:indptr[hi]]
+    if method == "label_propagation":
+        # tiny random jitter breaks ties between equally heavy labels
+        jitter = arrays["jitter"]
+        nodes, best, score = _best_neighbour_community(
+            rows, cols, weights, labels,
+            lambda rows, communities, weights: weights * (1.0 + jitter[communities])
+        )
+        return nodes, best, score, None
+
+    degree, community_degree = arrays["degree"], arrays["community_degree"]
+    resolution, total_weight = settings["resolution"], settings["total_weight"]
+
+    def gain(rows, communities, weights):
+        # Gain of joining ``communities`` for node ``rows`` with the node itself taken out
+        own = communities == labels[rows]
+        others = community_degree[communities] - own * degree[rows]
+        return weights - resolution * degree[rows] * others / total_weight
+
+    nodes, best, best_gain = _best_neighbour_community(rows, cols, weights, labels, gain)
+    # Gain of staying: links into its own community (0 if no neighbour is in it)
+    same = labels[rows] == labels[cols]
+    own_links = np.bincount(rows[same] - lo, weights[same], hi - lo)
+    stay = -resolution * degree[nodes] * (community_degree[labels[nodes]] - degree[nodes]) / total_weight
+    return nodes, best, best_gain, stay + own_links[nodes - lo]
+
+
+class _SweepArrays(dict):
+    """
+    CSR arrays of one level plus the per-sweep state (labels, degrees, jitter), copied
+    into shared memory when the sweeps run in worker processes, which attach to them by
+    name. Node ranges hold about the same number of edges each.
+    """
+
+    def __init__(self, adjacency: sp.csr_matrix, executor: Optional[ProcessPoolExecutor], n_ranges: int, **state):
+        super().__init__()
+        self.executor = executor
+        self.blocks = {}
+        arrays = {"indptr": adjacency.indptr, "indices": adjacency.indices, "data": adjacency.data, **state}
+        for name, array in arrays.items():
+            if executor is not None:
+                self.blocks[name] = _to_shared_memory(array)
+                array = np.ndarray(array.shape, dtype=array.dtype, buffer=self.blocks[name].buf)
+            self[name] = array
+        self.specs = tuple((name, block.name, self[name].shape, self[name].dtype.str) for name, block in self.blocks.items())
+        bounds = np.searchsorted(adjacency.indptr, np.linspace(0, adjacency.nnz, n_ranges + 1), side="left")
+        bounds[0], bounds[-1] = 0, adjacency.shape[0]
+        self.ranges = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+    def sweep(self, method: str, **settings) -> Tuple[np.ndarray, ...]:
+        if self.executor is None or len(self.ranges) < 2:
+            parts = [_sweep_candidates(self, lo, hi, method, **settings) for lo, hi in self.ranges]
+        else:
+            parts = list(self.executor.map(
+                _worker_sweep_candidates,
+                [(self.specs, lo, hi, method, settings) for lo, hi in self.ranges]
+            ))
+        # Ranges are in node order, so the result matches a single in-process sweep
+        return tuple(
+            None if column[0] is None else np.concatenate(column)
+            for column in zip(*parts)
+        )
+
+    def close(self):
+        self.clear()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+
+_WORKER_SWEEP = {}
+
+
+def _attach_sweep_arrays(specs):
+    # Attach the arrays of the current level, dropping those of the previous one
+    if _WORKER_SWEEP.get("specs") == specs:
+        return
+    previous = _WORKER_SWEEP.get("blocks", {})
+    _WORKER_SWEEP.clear()
+    for block in previous.values():
+        block.close()
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, block_name, _, _ in specs}
+    _WORKER_SWEEP.update({"specs": specs, "blocks": blocks})
+    for name, _, shape, dtype in specs:
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+        array.flags.writeable = False
+        _WORKER_SWEEP[name] = array
+
+
+def _worker_sweep_candidates(args) -> Tuple[np.ndarray, ...]:
+    specs, lo, hi, method, settings = args
+    _attach_sweep_arrays(specs)
+    return _sweep_candidates(_WORKER_SWEEP, lo, hi, method, **settings)
+
+
+def _sweep_executor(n_jobs: Optional[int]) -> Tuple[Optional[ProcessPoolExecutor], int]:
+    # Worker pool (None in-process) and the number of node ranges to split every sweep into
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if not n_jobs or n_jobs <= 1:
+        return None, 1
+    return ProcessPoolExecutor(max_workers=n_jobs), 4 * n_jobs
+
+
+def label_propagation_communities(
+        adjacency: sp.csr_matrix,
+        max_iter: int = 50,
+        update_fraction: float = 0.5,
+        seed: int = 42,
+        n_jobs: Optional[int] = None
+    ) -> np.ndarray:
+    """
+    Weighted label propagation with vectorized synchronous sweeps.
+
+    Each sweep every node computes its heaviest neighbouring label; a random
+    ``update_fraction`` of the nodes adopts it, which breaks the oscillation of
+    purely synchronous updates. Stops when no label changes. With ``n_jobs`` each sweep
+    is split over node ranges in worker processes sharing the graph.
+
+    Returns:
+    --------
+    numpy.ndarray
+        Consecutive community label per node index
+    """
+    rng = np.random.default_rng(seed)
+    n = adjacency.shape[0]
+    labels = np.arange(n)
+    adjacency = adjacency.tocsr()
+    if adjacency.nnz == 0:
+        return labels
+    executor, n_ranges = _sweep_executor(n_jobs)
+    arrays = _SweepArrays(adjacency, executor, n_ranges, labels=labels, jitter=np.zeros(n))
+    try:
+        for _ in range(max_iter):
+            arrays["labels"][:] = labels
+            arrays["jitter"][:] = rng.random(n) * 1e-9
+            nodes, best, _, _ = arrays.sweep("label_propagation")
+            changed = best != labels[nodes]
+            move = changed & (rng.random(len(nodes)) < update_fraction)
+            if not changed.any():
+                break
+            labels[nodes[move]] = best[move]
+    finally:
+        arrays.close()
+        if executor is not None:
+            executor.shutdown()
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def louvain_communities(
+        adjacency: sp.csr_matrix,
+        resolution: float = 1.0,
+        max_levels: int = 10,
+        max_sweeps: int = 30,
+        update_fraction: float = 0.5,
+        seed: int = 42,
+        n_jobs: Optional[int] = None
+    ) -> np.ndarray:
+    """
+    Louvain modularity maximisation with vectorized synchronous local moving.
+
+    Every sweep computes, for all nodes at once, the modularity gain of moving into each
+    neighbouring community and moves a random ``update_fraction`` of the nodes with a
+    positive gain. Communities are then collapsed with a sparse P^T A P product and the
+    next level runs on the aggregated graph. With ``n_jobs`` the gains of each sweep are
+    computed over node ranges in worker processes sharing the level's graph.
+
+    Returns:
+    --------
+    numpy.ndarray
+        Consecutive community label per node index
+    """
+    rng = np.random.default_rng(seed)
+    membership = np.arange(adjacency.shape[0])
+    current = adjacency.tocsr().astype(np.float64)
+    total_weight = current.sum()
+    if total_weight == 0:
+        return membership
+
+    executor, n_ranges = _sweep_executor(n_jobs)
+    try:
+        for _ in range(max_levels):
+            labels = _louvain_local_moving(
+                current, total_weight, resolution, max_sweeps, update_fraction, rng, executor, n_ranges
+            )
+            labels = np.unique(labels, return_inverse=True)[1]
+            if labels.max() + 1 == current.shape[0]:
+                break
+            membership = labels[membership]
+            indicator = sp.csr_matrix(
+                (np.ones(len(labels)), (np.arange(len(labels)), labels)),
+                shape=(len(labels), labels.max() + 1)
+            )
+            current = (indicator.T @ current @ indicator).tocsr()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return membership
+
+
+def _louvain_local_moving(
+        adjacency, total_weight, resolution, max_sweeps, update_fraction, rng, executor=None, n_ranges=1
+    ) -> np.ndarray:
+    n = adjacency.shape[0]
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    off_diagonal = adjacency.copy()
+    off_diagonal.setdiag(0)
+    off_diagonal.eliminate_zeros()
+    labels = np.arange(n)
+    if off_diagonal.nnz == 0:
+        return labels
+
+    arrays = _SweepArrays(off_diagonal, executor, n_ranges, labels=labels, degree=degree, community_degree=np.zeros(n))
+    try:
+        for _ in range(max_sweeps):
+            arrays["labels"][:] = labels
+            arrays["community_degree"][:] = np.bincount(labels, degree, n)
+            nodes, best, best_gain, stay = arrays.sweep("louvain", resolution=resolution, total_weight=total_weight)
+            improves = (best != labels[nodes]) & (best_gain > stay + 1e-12)
+            if not improves.any():
+                break
+            move = improves & (rng.random(len(nodes)) < update_fraction)
+            labels[nodes[move]] = best[move]
+    finally:
+        arrays.close()
+    return labels
+
+
+if __name__ == "__main__":
+    clustering = GraphNodeClustering()
+    print(clustering.cluster_and_update_node_properties())
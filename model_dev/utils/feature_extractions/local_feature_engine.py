@@ -0,0 +1,310 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Iterator, Optional
+import logging
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+import pyarrow.parquet as pq #type: ignore
+
+from utils.feature_extractions.graph_engine import (
+    CSRGraph,
+    DEFAULT_BETWEENNESS_EPSILON,
+    DEFAULT_BETWEENNESS_SEED
+)
+
+# Raw transaction file columns (see mimic_data.ipynb / migration_csv.sql) to engine columns
+TRANSACTION_COLUMNS = {
+    "timestamp": "timestamp",
+    "from_bank": "from_bank",
+    "account": "account_id",
+    "to_bank": "to_bank",
+    "account.1": "receiver_account_id",
+    "usd_amount": "usd_amount",
+    "payment_format": "payment_format",
+    "is_laundering": "is_laundering"
+}
+
+# Column order returned by GraphFeatureExtractor.extract_node_features
+FEATURE_COLUMNS = [
+    "account_id",
+    "bank",
+    "betweenness",
+    "pagerank",
+    "is_anomalies_account",
+    "total_trxns",
+    "total_fraud_trxns",
+    "total_receivers",
+    "total_usd_amount",
+    "total_fraud_usd_amount",
+    "avg_usd_amount",
+    "max_usd_amount",
+    "min_usd_amount",
+    "total_small_txns",
+    "total_high_txns",
+    "total_cash_txns",
+    "unique_payment_formats",
+    "total_active_days",
+    "total_trxns_per_day",
+    "total_usd_amount_per_day",
+    "avg_usd_amount_per_receiver",
+    "ratio_max_to_avg",
+    "ratio_fraud_receiver",
+    "ratio_fraud_usd_amount",
+    "ratio_cash_trxns",
+    "ratio_small_trxns",
+    "ratio_high_trxns",
+    "pagerank_betweenness_difference",
+    "ratio_pagerank_betweenness",
+    "ratio_pagerank_txn",
+    "ratio_pagerank_txn_amount"
+]
+
+SMALL_TXN_USD = 1000
+HIGH_TXN_USD = 12000
+
+
+def load_transactions(path: str) -> pd.DataFrame:
+    """
+    Read a transaction CSV or Parquet file into the engine's column layout.
+
+    Parameters:
+    -----------
+    path : str
+        ``.csv`` or ``.parquet`` file with the raw dataset columns
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Transactions with account ids as strings and parsed timestamps
+    """
+    print(f"✅ Loading transactions from {path}")
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path, columns=list(TRANSACTION_COLUMNS))
+    else:
+        df = pd.read_csv(
+            path,
+            usecols=list(TRANSACTION_COLUMNS),
+            dtype={"account": str, "account.1": str, "from_bank": str, "to_bank": str, "payment_format": str}
+        )
+    df = df.rename(columns=TRANSACTION_COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def iter_transactions(path: str, chunk_size: int = 1000000) -> Iterator[pd.DataFrame]:
+    """
+    Stream a transaction CSV or Parquet file in chunks of the ``load_transactions`` layout.
+    """
+    if path.endswith(".parquet"):
+        parquet_file = pq.ParquetFile(path)
+        batches = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(TRANSACTION_COLUMNS)))
+    else:
+        batches = pd.read_csv(
+            path,
+            usecols=list(TRANSACTION_COLUMNS),
+            dtype={"account": str, "account.1": str, "from_bank": str, "to_bank": str, "payment_format": str},
+            chunksize=chunk_size
+        )
+    for chunk in batches:
+        chunk = chunk.rename(columns=TRANSACTION_COLUMNS)
+        chunk["timestamp"] = pd.to_datetime(chunk["timestamp"])
+        yield chunk
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    # CASE WHEN denominator = 0 THEN 0 ELSE toFloat(numerator) / denominator END
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator == 0, 0.0, numerator / denominator)
+
+
+def _distinct_count(codes: np.ndarray, values: np.ndarray, n_accounts: int) -> np.ndarray:
+    # COUNT(DISTINCT value) per account code, values already integer coded
+    n_values = int(values.max()) + 1 if len(values) else 1
+    pairs = np.unique(codes.astype(np.int64) * n_values + values)
+    return np.bincount(pairs // n_values, minlength=n_accounts)
+
+
+def compute_account_aggregates(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-sender base aggregates of the extraction query with vectorized group-bys.
+
+    Parameters:
+    -----------
+    transactions : pandas.DataFrame
+        Output of ``load_transactions``
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per sending account: account_id, bank and the count / sum / min / max /
+        distinct aggregates the derived features are computed from
+    """
+    # The Account node keeps the bank of the row that first created it (MERGE ... ON CREATE)
+    first_seen = pd.DataFrame({
+        "account_id": np.column_stack([transactions["account_id"], transactions["receiver_account_id"]]).ravel(),
+        "bank": np.column_stack([transactions["from_bank"], transactions["to_bank"]]).ravel()
+    }).drop_duplicates("account_id").set_index("account_id")["bank"]
+
+    codes, account_ids = pd.factorize(transactions["account_id"], sort=True)
+    n = len(account_ids)
+    amount = transactions["usd_amount"].to_numpy(dtype=np.float64)
+    has_amount = ~np.isnan(amount)
+    amount_or_zero = np.where(has_amount, amount, 0.0)
+    laundering = transactions["is_laundering"].to_numpy() == 1
+
+    receivers = pd.factorize(transactions["receiver_account_id"])[0]
+    formats = pd.factorize(transactions["payment_format"])[0]
+    days = transactions["timestamp"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    days = days - days.min() if len(days) else days
+
+    # Min / max via one sort by account then reduceat over the account runs
+    order = np.lexsort((amount, codes))
+    sorted_codes, sorted_amount = codes[order], amount[order]
+    run_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if n else np.zeros(0, dtype=int)
+    masked_min = np.where(np.isnan(sorted_amount), np.inf, sorted_amount)
+    masked_max = np.where(np.isnan(sorted_amount), -np.inf, sorted_amount)
+    min_amount = np.minimum.reduceat(masked_min, run_starts) if n else np.zeros(0)
+    max_amount = np.maximum.reduceat(masked_max, run_starts) if n else np.zeros(0)
+
+    aggregates = pd.DataFrame({
+        "account_id": account_ids.to_numpy(),
+        "total_trxns": np.bincount(codes, minlength=n),
+        "total_fraud_trxns": _distinct_count(codes[laundering], receivers[laundering], n),
+        "total_receivers": _distinct_count(codes, receivers, n),
+        "total_usd_amount": np.bincount(codes, amount_or_zero, n),
+        "total_fraud_usd_amount": np.bincount(codes, np.where(laundering, amount_or_zero, 0.0), n),
+        "amount_count": np.bincount(codes, has_amount, n),
+        "max_usd_amount": np.where(np.isinf(max_amount), np.nan, max_amount),
+        "min_usd_amount": np.where(np.isinf(min_amount), np.nan, min_amount),
+        "total_small_txns": np.bincount(codes, has_amount & (amount < SMALL_TXN_USD), n).astype(np.int64),
+        "total_high_txns": np.bincount(codes, has_amount & (amount > HIGH_TXN_USD), n).astype(np.int64),
+        "total_cash_txns": np.bincount(codes, transactions["payment_format"].to_numpy() == "Cash", n).astype(np.int64),
+        "unique_payment_formats": _distinct_count(codes[formats >= 0], formats[formats >= 0], n),
+        "total_active_days": _distinct_count(codes, days, n)
+    })
+    aggregates["bank"] = first_seen.reindex(aggregates["account_id"]).to_numpy()
+    return aggregates
+
+
+def derive_node_features(aggregates: pd.DataFrame, node_scores: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Derive the ``extract_node_features`` columns from per-account base aggregates.
+
+    Parameters:
+    -----------
+    aggregates : pandas.DataFrame
+        Output of ``compute_account_aggregates`` (or any store producing the same columns)
+    node_scores : pandas.DataFrame, optional
+        account_id, pagerank and betweenness per account; missing scores stay NaN
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns in ``FEATURE_COLUMNS`` order
+    """
+    df = aggregates.copy()
+    if node_scores is not None:
+        scores = node_scores.set_index("account_id")[["pagerank", "betweenness"]]
+        df = df.join(scores, on="account_id")
+    else:
+        df["pagerank"] = np.nan
+        df["betweenness"] = np.nan
+
+    total_trxns = df["total_trxns"].to_numpy()
+    total_usd_amount = df["total_usd_amount"].to_numpy()
+    avg_usd_amount = _safe_divide(total_usd_amount, df["amount_count"].to_numpy())
+    avg_usd_amount = np.where(df["amount_count"].to_numpy() == 0, np.nan, avg_usd_amount)
+    pagerank = df["pagerank"].to_numpy(dtype=np.float64)
+    betweenness = df["betweenness"].to_numpy(dtype=np.float64)
+
+    df["avg_usd_amount"] = avg_usd_amount
+    df["total_trxns_per_day"] = _safe_divide(total_trxns, df["total_active_days"])
+    df["total_usd_amount_per_day"] = _safe_divide(total_usd_amount, df["total_active_days"])
+    df["avg_usd_amount_per_receiver"] = _safe_divide(total_usd_amount, df["total_receivers"])
+    df["ratio_fraud_usd_amount"] = _safe_divide(df["total_fraud_usd_amount"], total_usd_amount)
+    df["ratio_max_to_avg"] = _safe_divide(df["max_usd_amount"], avg_usd_amount)
+    df["ratio_fraud_receiver"] = _safe_divide(df["total_fraud_trxns"], df["total_receivers"])
+    df["ratio_cash_trxns"] = _safe_divide(df["total_cash_txns"], total_trxns)
+    df["ratio_small_trxns"] = _safe_divide(df["total_small_txns"], total_trxns)
+    df["ratio_high_trxns"] = _safe_divide(df["total_high_txns"], total_trxns)
+    df["pagerank_betweenness_difference"] = np.abs(pagerank - betweenness)
+    df["ratio_pagerank_betweenness"] = _safe_divide(pagerank, betweenness)
+    df["ratio_pagerank_txn"] = _safe_divide(pagerank, total_trxns)
+    df["ratio_pagerank_txn_amount"] = _safe_divide(pagerank, avg_usd_amount)
+    df["is_anomalies_account"] = (df["total_fraud_trxns"] >= 1).astype(np.int64)
+    return df[FEATURE_COLUMNS]
+
+
+class LocalFeatureEngine:
+    """
+    Computes the ``GraphFeatureExtractor.extract_node_features`` columns from a
+    transaction file, without a running Memgraph.
+    """
+
+    def __init__(self, transactions: pd.DataFrame):
+        self.transactions = transactions
+        self.betweenness_settings = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "LocalFeatureEngine":
+        return cls(load_transactions(path))
+
+    def compute_node_scores(
+            self,
+            betweenness_k: Optional[int] = None,
+            seed: Optional[int] = DEFAULT_BETWEENNESS_SEED,
+            betweenness_epsilon: Optional[float] = DEFAULT_BETWEENNESS_EPSILON,
+            exact_betweenness: bool = False
+        ) -> pd.DataFrame:
+        """
+        PageRank and betweenness per account on the account graph built from the file.
+
+        Betweenness is approximated from sampled Brandes sources by default, k given or
+        derived from ``betweenness_epsilon`` with the Hoeffding bound, with a fixed seed so
+        reruns reproduce the scores; exact Brandes (one BFS per account) is opt-in with
+        ``exact_betweenness``. The settings used are kept in ``self.betweenness_settings``.
+        """
+        graph = CSRGraph.from_transactions(self.transactions)
+        if exact_betweenness:
+            betweenness_k, betweenness_epsilon = None, None
+        betweenness = graph.betweenness_centrality(k=betweenness_k, epsilon=betweenness_epsilon, seed=seed)
+        self.betweenness_settings = graph.last_betweenness_settings
+        return pd.DataFrame({
+            "account_id": graph.node_ids,
+            "pagerank": graph.pagerank(),
+            "betweenness": betweenness
+        })
+
+    def extract_node_features(
+            self,
+            node_scores: Optional[pd.DataFrame] = None,
+            exact_betweenness: bool = False,
+            seed: Optional[int] = DEFAULT_BETWEENNESS_SEED
+        ) -> pd.DataFrame:
+        """
+        Parameters:
+        -----------
+        node_scores : pandas.DataFrame, optional
+            account_id / pagerank / betweenness, e.g. read back from Memgraph; computed
+            locally with ``compute_node_scores`` when omitted
+        exact_betweenness : bool
+            Compute exact instead of sampled betweenness when scoring locally
+        seed : int, optional
+            Seed of the betweenness source sampling when scoring locally
+
+        Returns:
+        --------
+        pandas.DataFrame
+            Same columns as ``GraphFeatureExtractor.extract_node_features``
+        """
+        print("✅ Computing account features from transactions")
+        if node_scores is None:
+            node_scores = self.compute_node_scores(seed=seed, exact_betweenness=exact_betweenness)
+        aggregates = compute_account_aggregates(self.transactions)
+        logging.info(f"Aggregated {len(self.transactions)} transactions into {len(aggregates)} accounts")
+        return derive_node_features(aggregates, node_scores)
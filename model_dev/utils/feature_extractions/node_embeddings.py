@@ -0,0 +1,288 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+import scipy.sparse as sp #type: ignore
+from sklearn.utils.extmath import randomized_svd #type: ignore
+
+from utils.feature_extractions.graph_engine import CSRGraph, _to_shared_memory, _attach_shared_graph, _WORKER_GRAPH
+
+try:
+    import torch #type: ignore
+except ImportError:
+    torch = None
+
+EMBEDDING_METHODS = ("spectral", "random_walk")
+
+
+def embedding_columns(dim: int):
+    return [f"emb_{i}" for i in range(dim)]
+
+
+def normalized_adjacency(graph: CSRGraph) -> sp.csr_matrix:
+    """
+    Symmetric D^-1/2 (A + A^T) D^-1/2 of the account graph, with transaction counts as weights.
+    """
+    symmetric = (graph.adjacency + graph.adjacency.T).tocsr()
+    degree = np.asarray(symmetric.sum(axis=1)).ravel()
+    inv_sqrt = np.divide(1.0, np.sqrt(degree), out=np.zeros_like(degree), where=degree > 0)
+    return (sp.diags(inv_sqrt) @ symmetric @ sp.diags(inv_sqrt)).tocsr()
+
+
+def spectral_embeddings(
+        graph: CSRGraph,
+        dim: int = 32,
+        n_oversamples: int = 10,
+        n_iter: int = 4,
+        seed: Optional[int] = None
+    ) -> np.ndarray:
+    """
+    Top singular vectors of the normalized adjacency, scaled by sqrt(singular value).
+
+    Randomized truncated SVD only multiplies the sparse matrix by N x (dim + n_oversamples)
+    dense blocks, so memory stays linear in the number of accounts.
+    """
+    matrix = normalized_adjacency(graph)
+    k = min(dim, max(min(matrix.shape) - 1, 1))
+    u, s, _ = randomized_svd(matrix, n_components=k, n_oversamples=n_oversamples, n_iter=n_iter, random_state=seed)
+    vectors = u * np.sqrt(s)
+    if k < dim:
+        vectors = np.hstack([vectors, np.zeros((matrix.shape[0], dim - k))])
+    return vectors.astype(np.float32)
+
+
+def random_walks(
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        starts: np.ndarray,
+        walk_length: int,
+        seed: Optional[int] = None
+    ) -> np.ndarray:
+    """
+    Uniform random walks from every start node, all walks advanced one step at a time.
+
+    Returns:
+    --------
+    numpy.ndarray
+        (len(starts), walk_length) int32 node indices, -1 after a walk reaches a node without out-edges
+    """
+    rng = np.random.default_rng(seed)
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    walks[:, 0] = starts
+    current = np.asarray(starts, dtype=np.int64)
+    alive = np.ones(len(starts), dtype=bool)
+    for step in range(1, walk_length):
+        degree = indptr[current + 1] - indptr[current]
+        alive &= degree > 0
+        if not alive.any():
+            break
+        offsets = (rng.random(alive.sum()) * degree[alive]).astype(np.int64)
+        current = current.copy()
+        current[alive] = indices[indptr[current[alive]] + offsets]
+        walks[alive, step] = current[alive]
+    return walks
+
+
+def _walk_chunk(args) -> np.ndarray:
+    starts, walk_length, seed = args
+    return random_walks(_WORKER_GRAPH["indptr"], _WORKER_GRAPH["indices"], starts, walk_length, seed)
+
+
+def _walk_tasks(num_nodes: int, walks_per_node: int, walk_length: int, chunk_nodes: int, seed: Optional[int]):
+    # One round per walk of every node, start nodes shuffled per round so a chunk mixes
+    # the whole graph; every chunk has its own seed, so the walks do not depend on n_jobs
+    for round_seed in np.random.SeedSequence(seed).spawn(max(walks_per_node, 0)):
+        order = np.random.default_rng(round_seed).permutation(num_nodes).astype(np.int32)
+        chunks = range(0, num_nodes, chunk_nodes)
+        for start, child in zip(chunks, round_seed.spawn(len(chunks))):
+            yield order[start:start + chunk_nodes], walk_length, child.generate_state(1)[0]
+
+
+def generate_walks(
+        graph: CSRGraph,
+        walks_per_node: int = 10,
+        walk_length: int = 40,
+        seed: Optional[int] = None,
+        n_jobs: Optional[int] = None,
+        chunk_nodes: int = 65536
+    ) -> Iterator[np.ndarray]:
+    """
+    ``walks_per_node`` walks from every account over the symmetrized graph, yielded as
+    int32 blocks of at most ``chunk_nodes`` walks instead of one corpus array.
+
+    With ``n_jobs`` the blocks are generated in worker processes sharing the CSR arrays,
+    at most two per worker ahead of the consumer. The same seed yields the same blocks
+    in the same order whatever ``n_jobs`` is, so the walks can be generated again
+    instead of being kept.
+    """
+    symmetric = (graph.adjacency + graph.adjacency.T).tocsr()
+    indptr, indices = symmetric.indptr.astype(np.int64), symmetric.indices.astype(np.int32)
+    tasks = _walk_tasks(graph.num_nodes, walks_per_node, walk_length, chunk_nodes, seed)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if not n_jobs or n_jobs <= 1:
+        for task in tasks:
+            yield random_walks(indptr, indices, *task)
+        return
+
+    blocks = [_to_shared_memory(indptr), _to_shared_memory(indices)]
+    try:
+        specs = [(block.name, array.shape, array.dtype.str) for block, array in zip(blocks, (indptr, indices))]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_attach_shared_graph, initargs=(specs,)) as executor:
+            pending = deque()
+            for task in tasks:
+                pending.append(executor.submit(_walk_chunk, task))
+                if len(pending) >= 2 * n_jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def skipgram_embeddings(
+        walks: Callable[[], Iterable[np.ndarray]],
+        num_nodes: int,
+        dim: int = 32,
+        window: int = 5,
+        negative: int = 5,
+        epochs: int = 1,
+        batch_size: int = 1024,
+        learning_rate: float = 0.01,
+        seed: Optional[int] = None
+    ) -> np.ndarray:
+    """
+    Skip-gram with negative sampling over the walks (torch, CPU).
+
+    Parameters:
+    -----------
+    walks : callable
+        Returns an iterable of (walks, walk_length) blocks such as ``generate_walks``;
+        called once to count node frequencies and once per epoch, and every call must
+        yield the same walks
+
+    Blocks are consumed one at a time (shuffled within the block) and context pairs
+    are built per batch of walks, so memory holds the two embedding tables, one block
+    of walks and one batch of pairs, never the whole corpus.
+    """
+    if torch is None:
+        raise ImportError("The random_walk embedding method needs torch")
+    generator = torch.Generator().manual_seed(seed if seed is not None else 0)
+    rng = np.random.default_rng(seed)
+    node_embeddings = torch.nn.Embedding(num_nodes, dim, sparse=True)
+    context_embeddings = torch.nn.Embedding(num_nodes, dim, sparse=True)
+    torch.nn.init.uniform_(node_embeddings.weight, -0.5 / dim, 0.5 / dim, generator=generator)
+    torch.nn.init.zeros_(context_embeddings.weight)
+    optimizer = torch.optim.SparseAdam(
+        list(node_embeddings.parameters()) + list(context_embeddings.parameters()),
+        lr=learning_rate
+    )
+    # Negatives drawn from the unigram^0.75 distribution of the walks
+    # (sampled by inverse CDF, torch.multinomial is limited to 2^24 categories)
+    frequency = np.zeros(num_nodes, dtype=np.int64)
+    for block in walks():
+        frequency += np.bincount(block[block >= 0], minlength=num_nodes)
+    frequency = frequency ** 0.75
+    noise_cdf = np.cumsum(frequency / frequency.sum())
+
+    for epoch in range(epochs):
+        total_loss = 0.0
+        for block in walks():
+            block = block[rng.permutation(len(block))]
+            for start in range(0, len(block), batch_size):
+                batch = block[start:start + batch_size]
+                centers, contexts = [], []
+                for offset in range(1, window + 1):
+                    left, right = batch[:, :-offset].ravel(), batch[:, offset:].ravel()
+                    valid = (left >= 0) & (right >= 0)
+                    centers += [left[valid], right[valid]]
+                    contexts += [right[valid], left[valid]]
+                center = torch.as_tensor(np.concatenate(centers), dtype=torch.int64)
+                context = torch.as_tensor(np.concatenate(contexts), dtype=torch.int64)
+                if not len(center):
+                    continue
+                negatives = np.searchsorted(noise_cdf, rng.random((len(center), negative)) * noise_cdf[-1])
+                negatives = torch.as_tensor(np.minimum(negatives, num_nodes - 1))
+
+                center_vectors = node_embeddings(center)
+                positive = torch.nn.functional.logsigmoid((center_vectors * context_embeddings(context)).sum(dim=1))
+                negative_scores = torch.bmm(context_embeddings(negatives), center_vectors.unsqueeze(2)).squeeze(2)
+                loss = -(positive + torch.nn.functional.logsigmoid(-negative_scores).sum(dim=1)).mean()
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                total_loss += loss.item()
+        logging.info(f"Skip-gram epoch {epoch + 1}/{epochs}, loss {total_loss:.4f}")
+    return node_embeddings.weight.detach().numpy().astype(np.float32)
+
+
+class NodeEmbedder:
+    """
+    d-dimensional structural embedding per account, by randomized spectral
+    decomposition ("spectral") or random walks with skip-gram ("random_walk").
+
+    ``settings`` holds every parameter affecting the result, so it can be merged into
+    the graph fingerprint used as the feature cache key.
+    """
+
+    def __init__(
+            self,
+            method: str = "spectral",
+            dim: int = 32,
+            seed: Optional[int] = 42,
+            n_jobs: Optional[int] = None,
+            walks_per_node: int = 10,
+            walk_length: int = 40,
+            window: int = 5,
+            epochs: int = 1
+        ):
+        if method not in EMBEDDING_METHODS:
+            raise ValueError(f"Unknown embedding method {method}, expected one of {EMBEDDING_METHODS}")
+        self.method = method
+        self.dim = dim
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.walks_per_node = walks_per_node
+        self.walk_length = walk_length
+        self.window = window
+        self.epochs = epochs
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        settings = {"embedding_method": self.method, "embedding_dim": self.dim, "embedding_seed": self.seed}
+        if self.method == "random_walk":
+            settings.update({
+                "walks_per_node": self.walks_per_node,
+                "walk_length": self.walk_length,
+                "window": self.window,
+                "epochs": self.epochs
+            })
+        return settings
+
+    def embed(self, graph: CSRGraph) -> pd.DataFrame:
+        """
+        Returns:
+        --------
+        pandas.DataFrame
+            account_id plus ``emb_0`` .. ``emb_{dim-1}``
+        """
+        print(f"✅ Computing {self.dim}-dimensional {self.method} embeddings")
+        if self.method == "spectral":
+            vectors = spectral_embeddings(graph, dim=self.dim, seed=self.seed)
+        else:
+            # Walks are regenerated for every pass over them instead of being kept in memory
+            walks = lambda: generate_walks(graph, self.walks_per_node, self.walk_length, seed=self.seed, n_jobs=self.n_jobs)
+            vectors = skipgram_embeddings(walks, graph.num_nodes, dim=self.dim, window=self.window, epochs=self.epochs, seed=self.seed)
+        embeddings = pd.DataFrame(vectors, columns=embedding_columns(self.dim))
+        embeddings.insert(0, "account_id", graph.account_ids)
+        logging.info(f"Embedded {len(embeddings)} accounts")
+        return embeddings
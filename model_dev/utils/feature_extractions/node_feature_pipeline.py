@@ -0,0 +1,50 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Optional
+import pandas as pd #type: ignore
+
+from utils.feature_extractions.graph_engine import CSRGraph
+from utils.feature_extractions.graph_feature_extractor import GraphFeatureExtractor
+from utils.feature_extractions.two_hop_flow_features import add_two_hop_features
+from utils.feature_extractions.cycle_detection import detect_cycles, add_cycle_features
+from utils.feature_extractions.temporal_motifs import TemporalMotifCounter
+from utils.feature_extractions.risk_propagation import add_risk_features, default_seed_sets
+
+
+def build_node_features(
+        graph_extractor: GraphFeatureExtractor,
+        graph: CSRGraph,
+        cycle_index_path: Optional[str] = None,
+        risk_half_life_days: float = 30
+    ) -> pd.DataFrame:
+    """
+    Node feature table of the training scripts: ``extract_node_features`` joined with the
+    two-hop flow, propagated risk, cycle and temporal motif features of ``graph``.
+
+    Parameters:
+    -----------
+    graph_extractor : GraphFeatureExtractor
+        Source of the per-account aggregates
+    graph : CSRGraph
+        Account graph of the same snapshot
+    cycle_index_path : str, optional
+        Where to save the cycle index behind the cycle counts, so analysts can look up the
+        cycles (e.g. ``FeatureCache.artifact_path`` of the cached features)
+    risk_half_life_days : float
+        Transactions are weighed down by age with this half-life when propagating risk
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per account
+    """
+    node_df = add_two_hop_features(graph_extractor.extract_node_features(), graph)
+    node_df = add_risk_features(node_df, graph, default_seed_sets(node_df), half_life_days=risk_half_life_days)
+    cycle_index = detect_cycles(graph)
+    if cycle_index_path is not None:
+        cycle_index.save(cycle_index_path)
+    node_df = add_cycle_features(node_df, cycle_index)
+    return TemporalMotifCounter.join(node_df, TemporalMotifCounter().count(graph.edge_frame()))
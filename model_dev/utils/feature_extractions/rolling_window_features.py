@@ -0,0 +1,180 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Dict, Tuple
+import logging
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+
+DEFAULT_WINDOWS_DAYS = (1, 7, 30)
+
+
+def window_column_names(window_days: int) -> Tuple[str, str, str]:
+    return f"max_trxns_{window_days}d", f"max_usd_amount_{window_days}d", f"cash_ratio_{window_days}d"
+
+
+def _sorted_arrays(transactions: pd.DataFrame, account_ids: pd.Index):
+    # Integer-coded, (account, timestamp)-sorted arrays of the sender side
+    codes = account_ids.get_indexer(transactions["account_id"]).astype(np.int64)
+    seconds = transactions["timestamp"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    amount = np.nan_to_num(transactions["usd_amount"].to_numpy(dtype=np.float64))
+    cash = (transactions["payment_format"].to_numpy() == "Cash").astype(np.float64)
+    order = np.lexsort((seconds, codes))
+    return codes[order], seconds[order], amount[order], cash[order]
+
+
+def trailing_window_sums(
+        codes: np.ndarray,
+        seconds: np.ndarray,
+        values: Dict[str, np.ndarray],
+        window_seconds: int
+    ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Count and sums over the trailing window (t - window, t] of every transaction.
+
+    Inputs must be sorted by (account code, timestamp). Accounts are laid out on one
+    composite key axis so a single vectorized searchsorted finds every window start,
+    and the sums come from differences of cumulative sums.
+
+    Returns:
+    --------
+    tuple
+        (count per row, {name: windowed sum per row})
+    """
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), {name: np.zeros(0) for name in values}
+    span = seconds.max() - seconds.min() + window_seconds + 1
+    keys = codes * span + (seconds - seconds.min())
+    starts = np.searchsorted(keys, keys - window_seconds, side="right")
+    counts = np.arange(n) - starts + 1
+    sums = {}
+    for name, array in values.items():
+        cumulative = np.concatenate([[0.0], np.cumsum(array)])
+        sums[name] = cumulative[np.arange(1, n + 1)] - cumulative[starts]
+    return counts, sums
+
+
+class RollingWindowFeatures:
+    """
+    Peak trailing-window activity per account, for several window lengths.
+
+    For every sent transaction the count, USD amount and cash count of the account's
+    transactions in the preceding ``w`` days are computed, and each account keeps the
+    maximum count (``max_trxns_{w}d``), the maximum amount (``max_usd_amount_{w}d``) and
+    the cash share of its busiest window (``cash_ratio_{w}d``).
+
+    ``backfill`` computes the features from full history; ``update`` folds in newer
+    transactions using only the retained tail of the longest window per account.
+    """
+
+    def __init__(self, windows_days: Tuple[int, ...] = DEFAULT_WINDOWS_DAYS):
+        self.windows_days = tuple(sorted(windows_days))
+        self.features = pd.DataFrame(columns=["account_id"] + self.feature_columns)
+        self.tail = None
+        self.watermark = None
+
+    @property
+    def feature_columns(self):
+        return [col for w in self.windows_days for col in window_column_names(w)]
+
+    def _compute(self, transactions: pd.DataFrame, evaluate_after=None) -> pd.DataFrame:
+        # Window peaks of the transactions newer than ``evaluate_after`` (all when None)
+        account_ids = pd.Index(pd.unique(transactions["account_id"]))
+        codes, seconds, amount, cash = _sorted_arrays(transactions, account_ids)
+        evaluate = np.ones(len(codes), dtype=bool)
+        if evaluate_after is not None:
+            evaluate = seconds > np.datetime64(evaluate_after, "s").astype(np.int64)
+        eval_codes = codes[evaluate]
+
+        result = pd.DataFrame({"account_id": account_ids})
+        for w in self.windows_days:
+            counts, sums = trailing_window_sums(codes, seconds, {"amount": amount, "cash": cash}, w * 86400)
+            counts, window_amount, window_cash = counts[evaluate], sums["amount"][evaluate], sums["cash"][evaluate]
+            count_col, amount_col, cash_col = window_column_names(w)
+
+            max_count = np.zeros(len(account_ids), dtype=np.int64)
+            np.maximum.at(max_count, eval_codes, counts)
+            max_amount = np.zeros(len(account_ids))
+            np.maximum.at(max_amount, eval_codes, window_amount)
+            # cash share of the busiest window (first one reaching the peak count)
+            peak_rows = np.flatnonzero(counts == max_count[eval_codes])
+            peak_rows = peak_rows[np.unique(eval_codes[peak_rows], return_index=True)[1]]
+            cash_ratio = np.zeros(len(account_ids))
+            cash_ratio[eval_codes[peak_rows]] = window_cash[peak_rows] / counts[peak_rows]
+
+            result[count_col] = max_count
+            result[amount_col] = max_amount
+            result[cash_col] = cash_ratio
+        active = np.zeros(len(account_ids), dtype=bool)
+        active[eval_codes] = True
+        return result[active]
+
+    def _keep_tail(self, transactions: pd.DataFrame):
+        horizon = self.watermark - pd.Timedelta(days=max(self.windows_days))
+        self.tail = transactions.loc[
+            transactions["timestamp"] > horizon,
+            ["account_id", "timestamp", "usd_amount", "payment_format"]
+        ].reset_index(drop=True)
+
+    def backfill(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Compute the window features from the full transaction history.
+
+        Parameters:
+        -----------
+        transactions : pandas.DataFrame
+            Columns as returned by ``load_transactions``
+
+        Returns:
+        --------
+        pandas.DataFrame
+            account_id plus three columns per window
+        """
+        print(f"✅ Computing rolling window features for windows {self.windows_days} days")
+        self.features = self._compute(transactions).reset_index(drop=True)
+        self.watermark = transactions["timestamp"].max()
+        self._keep_tail(transactions)
+        return self.features
+
+    def update(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fold transactions newer than the watermark into the window features.
+
+        Only the new transactions and the retained tail of the longest window are
+        scanned; peaks only ever grow, so they are merged with an element-wise max.
+        """
+        if self.watermark is None:
+            return self.backfill(transactions)
+        transactions = transactions[transactions["timestamp"] > self.watermark]
+        if transactions.empty:
+            return self.features
+
+        combined = pd.concat([self.tail, transactions[self.tail.columns]], ignore_index=True)
+        fresh = self._compute(combined, evaluate_after=self.watermark)
+
+        merged = self.features.merge(fresh, on="account_id", how="outer", suffixes=("", "_new"))
+        for w in self.windows_days:
+            count_col, amount_col, cash_col = window_column_names(w)
+            old_count = merged[count_col].fillna(0).to_numpy()
+            new_count = merged[f"{count_col}_new"].fillna(0).to_numpy()
+            # the cash share follows whichever window holds the peak count
+            merged[cash_col] = np.where(new_count > old_count, merged[f"{cash_col}_new"], merged[cash_col]).astype(np.float64)
+            merged[count_col] = np.maximum(old_count, new_count).astype(np.int64)
+            merged[amount_col] = np.fmax(merged[amount_col].to_numpy(dtype=np.float64), merged[f"{amount_col}_new"].to_numpy(dtype=np.float64))
+        self.features = merged[["account_id"] + self.feature_columns].reset_index(drop=True)
+
+        self.watermark = transactions["timestamp"].max()
+        self._keep_tail(combined)
+        logging.info(f"Rolling window features updated with {len(transactions)} transactions")
+        return self.features
+
+    def join(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the window columns to an ``extract_node_features`` frame (0 for accounts without activity).
+        """
+        joined = df.merge(self.features, on="account_id", how="left")
+        joined[self.feature_columns] = joined[self.feature_columns].fillna(0)
+        return joined
@@ -0,0 +1,210 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Iterable, Optional, Tuple
+import glob
+import logging
+import tempfile
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+import pyarrow.feather as feather #type: ignore
+
+from utils.feature_extractions.local_feature_engine import SMALL_TXN_USD, HIGH_TXN_USD
+
+MOTIF_COLUMNS = [
+    "gather_motif_count",
+    "gather_motif_usd_amount",
+    "scatter_motif_count",
+    "scatter_motif_usd_amount"
+]
+
+
+def windowed_counts(
+        keys: np.ndarray,
+        query_codes: np.ndarray,
+        query_seconds: np.ndarray,
+        span: int,
+        lower_offset: int,
+        upper_offset: int
+    ) -> np.ndarray:
+    """
+    For every query, the number of sorted ``keys`` of the same account whose time lies
+    in [t + lower_offset, t + upper_offset).
+
+    ``keys`` are ``code * span + seconds`` sorted ascending, so each window is one pair
+    of vectorized searchsorted calls.
+    """
+    base = query_codes * span
+    lower = np.searchsorted(keys, base + np.clip(query_seconds + lower_offset, 0, span - 1), side="left")
+    upper = np.searchsorted(keys, base + np.clip(query_seconds + upper_offset, 0, span), side="left")
+    return upper - lower
+
+
+class TemporalMotifCounter:
+    """
+    Per-account counts of smurfing motifs around large transfers.
+
+    * gather: a large outbound transfer preceded, within ``window_hours``, by at least
+      ``min_fan`` small inbound transfers to the same account (fan-in, then one payout).
+    * scatter: a large inbound transfer followed, within ``window_hours``, by at least
+      ``min_fan`` small outbound transfers (one deposit, then fan-out).
+
+    Small means below ``small_usd``, large means at least ``large_usd``. Each large
+    transfer counts as at most one motif, and the ``_usd_amount`` columns sum the
+    large transfers that anchor a motif.
+    """
+
+    def __init__(
+            self,
+            window_hours: float = 24,
+            small_usd: float = SMALL_TXN_USD,
+            large_usd: float = HIGH_TXN_USD,
+            min_fan: int = 3
+        ):
+        self.window_hours = window_hours
+        self.small_usd = small_usd
+        self.large_usd = large_usd
+        self.min_fan = min_fan
+
+    def _edge_records(self, transactions: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # Only small and large transfers matter; one inbound and one outbound record per row
+        amount = transactions["usd_amount"].to_numpy(dtype=np.float64)
+        relevant = (amount < self.small_usd) | (amount >= self.large_usd)
+        rows = transactions.loc[relevant]
+        inbound = pd.DataFrame({
+            "account_id": rows["receiver_account_id"].to_numpy(),
+            "timestamp": rows["timestamp"].to_numpy(),
+            "usd_amount": amount[relevant]
+        })
+        outbound = pd.DataFrame({
+            "account_id": rows["account_id"].to_numpy(),
+            "timestamp": rows["timestamp"].to_numpy(),
+            "usd_amount": amount[relevant]
+        })
+        return inbound, outbound
+
+    def _count_records(self, inbound: pd.DataFrame, outbound: pd.DataFrame) -> pd.DataFrame:
+        window = int(self.window_hours * 3600)
+        codes, account_ids = pd.factorize(pd.concat([inbound["account_id"], outbound["account_id"]], ignore_index=True))
+        n = len(account_ids)
+        in_codes, out_codes = codes[:len(inbound)].astype(np.int64), codes[len(inbound):].astype(np.int64)
+        in_seconds = inbound["timestamp"].to_numpy().astype("datetime64[s]").astype(np.int64)
+        out_seconds = outbound["timestamp"].to_numpy().astype("datetime64[s]").astype(np.int64)
+        origin = min(in_seconds.min(initial=0), out_seconds.min(initial=0))
+        # Shift by one window so every window start stays inside its account's key range
+        in_seconds = in_seconds - origin + window
+        out_seconds = out_seconds - origin + window
+        span = int(max(in_seconds.max(initial=0), out_seconds.max(initial=0)) + window + 2)
+        in_amount = inbound["usd_amount"].to_numpy(dtype=np.float64)
+        out_amount = outbound["usd_amount"].to_numpy(dtype=np.float64)
+
+        def small_keys(codes, seconds, amount):
+            small = amount < self.small_usd
+            return np.sort(codes[small] * span + seconds[small])
+
+        result = pd.DataFrame({"account_id": account_ids})
+        # gather: small inbound in [t - window, t) before a large outbound at t
+        large = out_amount >= self.large_usd
+        fan_in = windowed_counts(small_keys(in_codes, in_seconds, in_amount), out_codes[large], out_seconds[large], span, -window, 0)
+        motif = fan_in >= self.min_fan
+        result["gather_motif_count"] = np.bincount(out_codes[large][motif], minlength=n).astype(np.int64)
+        result["gather_motif_usd_amount"] = np.bincount(out_codes[large][motif], out_amount[large][motif], minlength=n)
+        # scatter: small outbound in (t, t + window] after a large inbound at t
+        large = in_amount >= self.large_usd
+        fan_out = windowed_counts(small_keys(out_codes, out_seconds, out_amount), in_codes[large], in_seconds[large], span, 1, window + 1)
+        motif = fan_out >= self.min_fan
+        result["scatter_motif_count"] = np.bincount(in_codes[large][motif], minlength=n).astype(np.int64)
+        result["scatter_motif_usd_amount"] = np.bincount(in_codes[large][motif], in_amount[large][motif], minlength=n)
+        return result
+
+    def count(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Motif counts for a transaction frame held in memory.
+
+        Parameters:
+        -----------
+        transactions : pandas.DataFrame
+            Columns as returned by ``load_transactions``
+
+        Returns:
+        --------
+        pandas.DataFrame
+            account_id plus ``MOTIF_COLUMNS``
+        """
+        print(f"✅ Counting gather / scatter motifs within {self.window_hours} hours")
+        return self._count_records(*self._edge_records(transactions))
+
+    def count_stream(
+            self,
+            chunks: Iterable[pd.DataFrame],
+            n_partitions: int = 16,
+            spill_dir: Optional[str] = None
+        ) -> pd.DataFrame:
+        """
+        Motif counts over transaction chunks that do not fit in memory together.
+
+        Each chunk is reduced to its small / large transfers and spilled to disk, split
+        by a hash of the account on either side, then the account partitions are
+        counted one at a time. Peak memory is one chunk plus one partition.
+
+        Parameters:
+        -----------
+        chunks : iterable of pandas.DataFrame
+            e.g. ``iter_transactions(path)``
+        n_partitions : int
+            Number of account partitions
+        spill_dir : str, optional
+            Directory for the spilled partitions, a temporary directory when omitted
+
+        Returns:
+        --------
+        pandas.DataFrame
+            account_id plus ``MOTIF_COLUMNS``
+        """
+        print(f"✅ Counting gather / scatter motifs within {self.window_hours} hours over {n_partitions} partitions")
+        with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+            for chunk_number, chunk in enumerate(chunks):
+                for direction, records in zip(("in", "out"), self._edge_records(chunk)):
+                    partition = pd.util.hash_array(records["account_id"].to_numpy(dtype=object)) % n_partitions
+                    for p, part in records.groupby(partition):
+                        feather.write_feather(
+                            part.reset_index(drop=True),
+                            os.path.join(tmp_dir, f"{direction}-{p}-{chunk_number}.feather")
+                        )
+
+            results = []
+            for p in range(n_partitions):
+                inbound, outbound = (
+                    self._read_partition(tmp_dir, direction, p) for direction in ("in", "out")
+                )
+                if inbound.empty and outbound.empty:
+                    continue
+                results.append(self._count_records(inbound, outbound))
+                logging.info(f"Motif partition {p}: {len(inbound)} inbound, {len(outbound)} outbound transfers")
+        if not results:
+            return pd.DataFrame(columns=["account_id"] + MOTIF_COLUMNS)
+        return pd.concat(results, ignore_index=True)
+
+    @staticmethod
+    def _read_partition(tmp_dir: str, direction: str, partition: int) -> pd.DataFrame:
+        paths = sorted(glob.glob(os.path.join(tmp_dir, f"{direction}-{partition}-*.feather")))
+        if not paths:
+            return pd.DataFrame({
+                "account_id": pd.Series(dtype=object),
+                "timestamp": pd.Series(dtype="datetime64[ns]"),
+                "usd_amount": pd.Series(dtype=np.float64)
+            })
+        return pd.concat([feather.read_feather(path) for path in paths], ignore_index=True)
+
+    @staticmethod
+    def join(df: pd.DataFrame, motifs: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the motif columns to an ``extract_node_features`` frame (0 for accounts without motifs).
+        """
+        joined = df.merge(motifs, on="account_id", how="left")
+        joined[MOTIF_COLUMNS] = joined[MOTIF_COLUMNS].fillna(0)
+        for col in ("gather_motif_count", "scatter_motif_count"):
+            joined[col] = joined[col].astype(np.int64)
+        return joined
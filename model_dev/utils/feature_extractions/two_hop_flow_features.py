@@ -0,0 +1,156 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Optional
+import logging
+import pandas as pd #type: ignore
+import numpy as np #type: ignore
+import scipy.sparse as sp #type: ignore
+
+from utils.feature_extractions.graph_engine import CSRGraph
+
+TWO_HOP_COLUMNS = [
+    "in_flow_usd",
+    "out_flow_usd",
+    "pass_through_ratio",
+    "two_hop_trxns",
+    "two_hop_usd_amount",
+    "two_hop_receivers"
+]
+
+DEFAULT_DEGREE_CAP = 1000
+
+
+def amount_adjacency(graph: CSRGraph) -> sp.csr_matrix:
+    """
+    Account x account matrix of summed USD amounts (missing amounts count as 0).
+    """
+    n = graph.num_nodes
+    if graph.edge_amounts is None:
+        return sp.csr_matrix((n, n), dtype=np.float64)
+    amounts = np.nan_to_num(graph.edge_amounts)
+    matrix = sp.csr_matrix((amounts, (graph.edge_src, graph.edge_dst)), shape=(n, n))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def cap_out_degree(matrix: sp.csr_matrix, cap: Optional[int], seed: Optional[int] = None) -> sp.csr_matrix:
+    """
+    Keep at most ``cap`` randomly sampled out-edges of every row.
+
+    Rows of super-nodes are sub-sampled so the second hop through them stays bounded;
+    the kept values are scaled by ``degree / cap`` so row sums stay unbiased.
+    """
+    degree = np.diff(matrix.indptr)
+    if cap is None or not (degree > cap).any():
+        return matrix
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(matrix.shape[0]), degree)
+    # A random rank inside each row: sort by (row, random key) and keep the first ``cap``
+    order = np.lexsort((rng.random(matrix.nnz), rows))
+    rank = np.arange(matrix.nnz) - matrix.indptr[rows[order]]
+    keep = np.zeros(matrix.nnz, dtype=bool)
+    keep[order[rank < cap]] = True
+    scale = np.where(degree > cap, degree / np.maximum(cap, 1), 1.0)
+    capped = sp.csr_matrix(
+        (matrix.data[keep] * scale[rows[keep]], matrix.indices[keep], np.r_[0, np.cumsum(np.minimum(degree, cap))]),
+        shape=matrix.shape
+    )
+    logging.info(f"Capped {int((degree > cap).sum())} super-nodes to {cap} out-edges")
+    return capped
+
+
+def distinct_two_hop_receivers(
+        binary: sp.csr_matrix,
+        capped_binary: sp.csr_matrix,
+        block_size: int = 50000
+    ) -> np.ndarray:
+    """
+    Number of distinct accounts reachable in exactly two hops, excluding the account itself.
+
+    The product ``binary @ capped_binary`` is formed one row block at a time so only
+    the block's non-zeros are held in memory.
+    """
+    n = binary.shape[0]
+    counts = np.zeros(n, dtype=np.int64)
+    for start in range(0, n, block_size):
+        block = (binary[start:start + block_size] @ capped_binary).tocsr()
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        self_loops = np.bincount(rows[block.indices == rows + start], minlength=block.shape[0])
+        counts[start:start + block.shape[0]] = np.diff(block.indptr) - self_loops
+    return counts
+
+
+def compute_two_hop_features(
+        graph: CSRGraph,
+        degree_cap: Optional[int] = DEFAULT_DEGREE_CAP,
+        seed: Optional[int] = None,
+        block_size: int = 50000
+    ) -> pd.DataFrame:
+    """
+    In/out flow and two-hop layering features for every account of the graph.
+
+    Parameters:
+    -----------
+    graph : CSRGraph
+        Account graph with per-transaction amounts
+    degree_cap : int, optional
+        Maximum out-edges followed through one intermediate account for the distinct
+        receiver count (None follows all)
+    seed : int, optional
+        Seed of the super-node edge sampling
+    block_size : int
+        Rows per block of the sparse product
+
+    Returns:
+    --------
+    pandas.DataFrame
+        account_id plus ``TWO_HOP_COLUMNS``
+    """
+    print("✅ Computing two-hop flow features")
+    counts = graph.adjacency
+    amounts = amount_adjacency(graph)
+    binary = counts.copy()
+    binary.data = np.ones_like(binary.data)
+
+    in_flow = np.asarray(amounts.sum(axis=0)).ravel()
+    out_flow = np.asarray(amounts.sum(axis=1)).ravel()
+    out_trxns = np.asarray(counts.sum(axis=1)).ravel()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pass_through = np.where(
+            np.maximum(in_flow, out_flow) == 0,
+            0.0,
+            np.minimum(in_flow, out_flow) / np.maximum(in_flow, out_flow)
+        )
+
+    features = pd.DataFrame({
+        "account_id": graph.account_ids,
+        "in_flow_usd": in_flow,
+        "out_flow_usd": out_flow,
+        "pass_through_ratio": pass_through,
+        # transaction pairs a->j->k, and the USD leaving a's direct receivers
+        "two_hop_trxns": counts @ out_trxns,
+        "two_hop_usd_amount": binary @ out_flow,
+        "two_hop_receivers": distinct_two_hop_receivers(binary, cap_out_degree(binary, degree_cap, seed), block_size)
+    })
+    logging.info(f"Two-hop features computed for {len(features)} accounts")
+    return features
+
+
+def add_two_hop_features(
+        df: pd.DataFrame,
+        graph: CSRGraph,
+        degree_cap: Optional[int] = DEFAULT_DEGREE_CAP,
+        seed: Optional[int] = None
+    ) -> pd.DataFrame:
+    """
+    Join the two-hop columns onto an ``extract_node_features`` frame (0 for accounts not in the graph),
+    ahead of ``apply_feature_engineering``.
+    """
+    features = compute_two_hop_features(graph, degree_cap=degree_cap, seed=seed)
+    joined = df.merge(features, on="account_id", how="left")
+    joined[TWO_HOP_COLUMNS] = joined[TWO_HOP_COLUMNS].fillna(0)
+    joined["two_hop_receivers"] = joined["two_hop_receivers"].astype(np.int64)
+    return joined
@@ -0,0 +1,220 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np #type: ignore
+
+
+def average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """
+    Average path length of an unsuccessful BST search over n samples, c(n) of the Isolation Forest paper.
+    """
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    large = n_samples > 2
+    lengths[large] = 2.0 * (np.log(n_samples[large] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[large] - 1.0) / n_samples[large]
+    return lengths
+
+
+def round_down_float32(values: np.ndarray) -> np.ndarray:
+    """
+    Largest float32 <= each value: for float32 x, ``x > value`` equals ``x > round_down_float32(value)``.
+    """
+    rounded = np.asarray(values, dtype=np.float32)
+    too_high = rounded.astype(np.float64) > values
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+class FlatIsolationForest:
+    """
+    Array-backed copy of a fitted sklearn ``IsolationForest`` for batch and single-row scoring.
+
+    Every tree is padded to a complete binary tree of the forest's ``max_depth``: a
+    leaf above that depth is copied to all leaf slots below it, so the padded splits
+    under it cannot change the result. Nodes are stored level by level, tree-major
+    within a level, so node ``i`` of a level has its children at ``2 * i`` and
+    ``2 * i + 1`` of the next one and a traversal is ``max_depth`` rounds of
+    vectorized gathers over all (row, tree) pairs, with no child pointers to follow.
+    Per node the arrays hold the split column of the full input (the per-tree feature
+    subsets resolved), the threshold rounded down to float32 (exact for float32
+    inputs, which is what sklearn compares) and the side NaN goes to; per leaf slot
+    the path length sklearn uses (node depth with the root at 1, plus
+    c(n_node_samples) - 1). predict, decision_function and the probability all come
+    from one traversal.
+    """
+
+    MAX_DEPTH = 16
+    ARRAYS = ("feature", "threshold", "nan_right", "leaf_value")
+
+    def __init__(
+            self,
+            feature: np.ndarray,
+            threshold: np.ndarray,
+            nan_right: np.ndarray,
+            leaf_value: np.ndarray,
+            n_estimators: int,
+            max_depth: int,
+            denominator: float,
+            offset: float,
+            score_range: Optional[Tuple[float, float]] = None
+        ):
+        self.feature = feature
+        self.threshold = threshold
+        self.nan_right = nan_right
+        self.leaf_value = leaf_value
+        self.n_estimators = int(n_estimators)
+        self.max_depth = int(max_depth)
+        self.denominator = float(denominator)
+        self.offset = float(offset)
+        # Decision score range of the training data, fixes the probability scale across batches
+        self.score_range = score_range
+
+    @classmethod
+    def from_sklearn(cls, iso_forest, score_range: Optional[Tuple[float, float]] = None) -> "FlatIsolationForest":
+        estimators = iso_forest.estimators_
+        max_depth = max(estimator.tree_.max_depth for estimator in estimators)
+        if max_depth > cls.MAX_DEPTH:
+            raise ValueError(f"Trees of depth {max_depth} are too deep to pad, fit with max_samples <= {2 ** cls.MAX_DEPTH}")
+        n_internal = 2 ** max_depth - 1
+        feature = np.zeros((len(estimators), n_internal), dtype=np.intp)
+        threshold = np.zeros((len(estimators), n_internal), dtype=np.float32)
+        nan_right = np.zeros((len(estimators), n_internal), dtype=bool)
+        leaf_value = np.zeros((len(estimators), n_internal + 1))
+
+        for tree_index, (estimator, estimator_features) in enumerate(zip(estimators, iso_forest.estimators_features_)):
+            tree = estimator.tree_
+            depth = tree.compute_node_depths()
+            path_length = depth + average_path_length(tree.n_node_samples) - 1.0
+            internal = np.flatnonzero(tree.children_left != -1)
+            # Heap position of every node; sklearn numbers children after their parent
+            position = np.zeros(tree.node_count, dtype=np.int64)
+            for node in internal:
+                position[tree.children_left[node]] = 2 * position[node] + 1
+                position[tree.children_right[node]] = 2 * position[node] + 2
+            feature[tree_index, position[internal]] = np.asarray(estimator_features)[tree.feature[internal]]
+            threshold[tree_index, position[internal]] = round_down_float32(tree.threshold[internal])
+            nan_right[tree_index, position[internal]] = ~tree.missing_go_to_left[internal].astype(bool)
+            for leaf in np.flatnonzero(tree.children_left == -1):
+                span = 2 ** (max_depth - depth[leaf] + 1)
+                first = (position[leaf] + 1) * span - 1 - n_internal
+                leaf_value[tree_index, first:first + span] = path_length[leaf]
+
+        def level_major(array):
+            return np.concatenate([array[:, 2 ** level - 1:2 ** (level + 1) - 1].ravel() for level in range(max_depth)])
+
+        return cls(
+            feature=level_major(feature),
+            threshold=level_major(threshold),
+            nan_right=level_major(nan_right),
+            leaf_value=leaf_value.ravel(),
+            n_estimators=len(estimators),
+            max_depth=max_depth,
+            denominator=len(estimators) * average_path_length(np.array([iso_forest.max_samples_]))[0],
+            offset=iso_forest.offset_,
+            score_range=score_range
+        )
+
+    def to_arrays(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """
+        Returns:
+        --------
+        tuple
+            (node arrays, JSON-able scalar parameters), the inverse of ``from_arrays``
+        """
+        params = {
+            "n_estimators": self.n_estimators,
+            "max_depth": self.max_depth,
+            "denominator": self.denominator,
+            "offset": self.offset,
+            "score_range": None if self.score_range is None else list(self.score_range)
+        }
+        return {name: getattr(self, name) for name in self.ARRAYS}, params
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> "FlatIsolationForest":
+        """
+        Scorer over existing arrays, e.g. read-only memory maps shared by several processes.
+        """
+        score_range = params.get("score_range")
+        return cls(
+            **{name: arrays[name] for name in cls.ARRAYS},
+            n_estimators=params["n_estimators"],
+            max_depth=params["max_depth"],
+            denominator=params["denominator"],
+            offset=params["offset"],
+            score_range=None if score_range is None else tuple(score_range)
+        )
+
+    def _path_length_sums(self, X: np.ndarray) -> np.ndarray:
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_offsets = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        has_missing = np.isnan(flat).any()
+        nodes = np.broadcast_to(np.arange(self.n_estimators, dtype=np.intp), (n_rows, self.n_estimators))
+        for level in range(self.max_depth):
+            level_nodes = slice(self.n_estimators * (2 ** level - 1), self.n_estimators * (2 ** (level + 1) - 1))
+            values = flat[self.feature[level_nodes][nodes] + row_offsets]
+            go_right = values > self.threshold[level_nodes][nodes]
+            if has_missing:
+                missing = np.isnan(values)
+                go_right[missing] = self.nan_right[level_nodes][nodes[missing]]
+            nodes = 2 * nodes + go_right
+        return self.leaf_value[nodes].sum(axis=1)
+
+    def score_samples(self, X, chunk_rows: int = 512, n_jobs: Optional[int] = None) -> np.ndarray:
+        """
+        Same as ``IsolationForest.score_samples``: the opposite of the anomaly score, lower is more anomalous.
+
+        X is cast to float32 like sklearn does before applying the trees, and scored in
+        chunks of ``chunk_rows`` rows so the (rows, trees) working arrays stay in cache.
+        With ``n_jobs`` the chunks are spread over threads (numpy's gathers release the GIL).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        chunks = [X[start:start + chunk_rows] for start in range(0, len(X), chunk_rows)]
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if n_jobs and n_jobs > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                sums = list(executor.map(self._path_length_sums, chunks))
+        else:
+            sums = [self._path_length_sums(chunk) for chunk in chunks]
+        depths = np.concatenate(sums) if sums else np.empty(0)
+        if self.denominator == 0:
+            return -np.ones(len(X))
+        return -(2.0 ** (-depths / self.denominator))
+
+    def decision_function(self, X, chunk_rows: int = 512, n_jobs: Optional[int] = None) -> np.ndarray:
+        return self.score_samples(X, chunk_rows, n_jobs) - self.offset
+
+    def predict(self, X, chunk_rows: int = 512, n_jobs: Optional[int] = None) -> np.ndarray:
+        return np.where(self.decision_function(X, chunk_rows, n_jobs) < 0, -1, 1)
+
+    def probability(self, decision_scores: np.ndarray) -> np.ndarray:
+        """
+        0-1 anomaly probability (1 = most anomalous), a min-max rescale over
+        ``score_range`` clipped to [0, 1], or over the given scores without one.
+        """
+        decision_scores = np.asarray(decision_scores, dtype=np.float64)
+        if self.score_range is None:
+            min_score, max_score = decision_scores.min(), decision_scores.max()
+        else:
+            min_score, max_score = self.score_range
+        if max_score <= min_score:
+            return np.zeros(len(decision_scores))
+        return np.clip(1 - (decision_scores - min_score) / (max_score - min_score), 0.0, 1.0)
+
+    def score(self, X, chunk_rows: int = 512, n_jobs: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns:
+        --------
+        tuple
+            (anomaly_flag, anomaly_score, anomaly_probability) from one pass over the trees,
+            anomaly_score being ``decision_function``
+        """
+        decision_scores = self.decision_function(X, chunk_rows, n_jobs)
+        return decision_scores < 0, decision_scores, self.probability(decision_scores)
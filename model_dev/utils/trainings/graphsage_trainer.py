@@ -0,0 +1,243 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+import copy
+import logging
+import numpy as np #type: ignore
+import pandas as pd #type: ignore
+import torch #type: ignore
+import torch.nn.functional as F #type: ignore
+from torch_geometric.data import Data #type: ignore
+from torch_geometric.loader import NeighborLoader #type: ignore
+from torch_geometric.nn import SAGEConv #type: ignore
+from torch_geometric.utils import to_undirected #type: ignore
+from sklearn.metrics import roc_auc_score #type: ignore
+
+from utils.feature_extractions.graph_engine import CSRGraph
+from utils.feature_extractions.feature_engineering import label_free_features
+
+
+class GraphSAGE(torch.nn.Module):
+    """
+    Stack of mean-aggregating SAGEConv layers with a linear scoring head.
+    """
+
+    def __init__(self, in_channels, hidden_channels=64, num_layers=2, dropout=0.2):
+        super().__init__()
+        self.convs = torch.nn.ModuleList()
+        for layer in range(num_layers):
+            self.convs.append(SAGEConv(in_channels if layer == 0 else hidden_channels, hidden_channels))
+        self.head = torch.nn.Linear(hidden_channels, 1)
+        self.dropout = dropout
+
+    def embed(self, x, edge_index):
+        for layer, conv in enumerate(self.convs):
+            x = conv(x, edge_index)
+            if layer < len(self.convs) - 1:
+                x = F.relu(x)
+                x = F.dropout(x, p=self.dropout, training=self.training)
+        return x
+
+    def forward(self, x, edge_index):
+        return self.head(F.relu(self.embed(x, edge_index))).squeeze(-1)
+
+    @torch.no_grad()
+    def inference(self, x_all, loader):
+        """
+        Layer-wise inference: every layer is applied to all nodes in mini-batches of
+        their 1-hop neighbourhood before the next layer, so each node's representation
+        is computed once per layer instead of once per sampled subtree.
+
+        Returns:
+        --------
+        tuple
+            (logits, embeddings) for every node
+        """
+        for layer, conv in enumerate(self.convs):
+            outputs = []
+            for batch in loader:
+                x = conv(x_all[batch.n_id], batch.edge_index)
+                if layer < len(self.convs) - 1:
+                    x = F.relu(x)
+                outputs.append(x[:batch.batch_size])
+            x_all = torch.cat(outputs, dim=0)
+        return self.head(F.relu(x_all)).squeeze(-1), x_all
+
+
+def build_graph_data(df, graph: CSRGraph, features_for_model, label_column='is_anomalies_account'):
+    """
+    PyG ``Data`` over the graph's account indices with standardized node features.
+
+    Accounts of the graph missing from df get all-zero features and label 0.
+    """
+    if label_column in features_for_model:
+        raise ValueError(f"The label {label_column} cannot be a node feature")
+    node_df = pd.DataFrame({'account_id': graph.account_ids}).merge(
+        df[['account_id', label_column] + list(features_for_model)],
+        on='account_id',
+        how='left'
+    )
+    x = node_df[features_for_model].to_numpy(dtype=np.float32)
+    x = np.nan_to_num(x, nan=0.0, posinf=0.0, neginf=0.0)
+    mean, std = x.mean(axis=0), x.std(axis=0)
+    x = (x - mean) / np.where(std > 0, std, 1.0)
+
+    coo = graph.adjacency.tocoo()
+    edge_index = torch.as_tensor(np.vstack([coo.row, coo.col]), dtype=torch.long)
+    data = Data(
+        x=torch.as_tensor(x),
+        edge_index=to_undirected(edge_index, num_nodes=graph.num_nodes),
+        y=torch.as_tensor(node_df[label_column].fillna(0).to_numpy(dtype=np.float32))
+    )
+    data.labelled = torch.as_tensor(node_df[label_column].notna().to_numpy())
+    return data
+
+
+def train_graphsage(
+        df,
+        metadata,
+        graph: CSRGraph,
+        label_column='is_anomalies_account',
+        features_for_model=None,
+        hidden_channels=64,
+        num_layers=2,
+        num_neighbors=(15, 10),
+        batch_size=1024,
+        epochs=5,
+        learning_rate=0.005,
+        validation_fraction=0.2,
+        num_workers=2,
+        seed=42,
+        return_model=False
+    ):
+    """
+    Train a GraphSAGE node classifier on account labels with neighbour-sampled mini-batches.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Feature frame (e.g. the result of train_isolation_forest) with account_id and the label
+    metadata : dict
+        Preprocessing metadata, metadata['features_for_model'] are the candidate node features
+    graph : CSRGraph
+        Account graph the messages are passed over
+    label_column : str
+        Binary training label
+    features_for_model : list, optional
+        Node features; by default metadata['features_for_model'] without the label and
+        the columns derived from it (see label_free_features), which would leak the target
+    hidden_channels : int
+        Width of the hidden layers and of the returned embedding
+    num_layers : int
+        Number of SAGEConv layers
+    num_neighbors : tuple
+        Neighbours sampled per node at each layer during training
+    batch_size : int
+        Seed nodes per mini-batch
+    epochs : int
+        Passes over the training nodes
+    learning_rate : float
+        Adam learning rate
+    validation_fraction : float
+        Share of the labelled accounts held out for the validation AUC
+    num_workers : int
+        Loader worker processes doing the neighbour sampling
+    seed : int
+        Seed of the split, the sampling and the weights
+    return_model : bool
+        Whether to return the trained model along with results
+
+    Returns:
+    --------
+    pandas.DataFrame
+        df with a graphsage_score column (probability of the label, 0-1)
+    dict
+        Summary information about the training
+    dict (optional)
+        Trained model and data if return_model=True
+    """
+    print("**"*50)
+    print("✅ Training GraphSAGE")
+    print("**"*50)
+    torch.manual_seed(seed)
+    if features_for_model is None:
+        features_for_model = label_free_features(metadata['features_for_model'], label_column)
+    leaked = set(features_for_model) - set(label_free_features(features_for_model, label_column))
+    if leaked:
+        raise ValueError(f"Node features derived from the label: {sorted(leaked)}")
+
+    print("✅ Step 1: Build the graph data")
+    data = build_graph_data(df, graph, features_for_model, label_column)
+    labelled = torch.nonzero(data.labelled).squeeze(-1)
+    permutation = labelled[torch.randperm(len(labelled), generator=torch.Generator().manual_seed(seed))]
+    n_validation = int(len(permutation) * validation_fraction)
+    validation_nodes, train_nodes = permutation[:n_validation], permutation[n_validation:]
+
+    loader_options = {
+        'batch_size': batch_size,
+        'num_workers': num_workers,
+        'persistent_workers': num_workers > 0
+    }
+    train_loader = NeighborLoader(data, num_neighbors=list(num_neighbors)[:num_layers], input_nodes=train_nodes, shuffle=True, **loader_options)
+    # All 1-hop neighbours of every node, for layer-wise inference (no features needed per batch)
+    inference_data = copy.copy(data)
+    inference_data.x = None
+    inference_loader = NeighborLoader(inference_data, num_neighbors=[-1], input_nodes=None, shuffle=False, **loader_options)
+
+    print("✅ Step 2: Train on neighbour-sampled mini-batches")
+    model = GraphSAGE(data.num_features, hidden_channels, num_layers)
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    positives = data.y[train_nodes].sum()
+    pos_weight = (len(train_nodes) - positives) / positives.clamp(min=1)
+    losses = []
+    for epoch in range(1, epochs + 1):
+        model.train()
+        total_loss, total_nodes = 0.0, 0
+        for batch in train_loader:
+            optimizer.zero_grad()
+            logits = model(batch.x, batch.edge_index)[:batch.batch_size]
+            loss = F.binary_cross_entropy_with_logits(logits, batch.y[:batch.batch_size], pos_weight=pos_weight)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * batch.batch_size
+            total_nodes += batch.batch_size
+        losses.append(total_loss / max(total_nodes, 1))
+        logging.info(f"GraphSAGE epoch {epoch}/{epochs}, loss {losses[-1]:.4f}")
+
+    print("✅ Step 3: Layer-wise inference over all accounts")
+    model.eval()
+    logits, embeddings = model.inference(data.x, inference_loader)
+    scores = torch.sigmoid(logits).numpy()
+
+    print("✅ Step 4: Add results to DataFrame")
+    node_scores = pd.DataFrame({'account_id': graph.account_ids, 'graphsage_score': scores})
+    result_df = df.drop(columns=['graphsage_score'], errors='ignore').merge(node_scores, on='account_id', how='left')
+
+    y_validation = data.y[validation_nodes].numpy()
+    validation_auc = None
+    if n_validation and 0 < y_validation.sum() < len(y_validation):
+        validation_auc = roc_auc_score(y_validation, scores[validation_nodes.numpy()])
+
+    summary = {
+        'total_accounts': len(result_df),
+        'train_accounts': len(train_nodes),
+        'validation_accounts': n_validation,
+        'validation_roc_auc': validation_auc,
+        'epoch_losses': losses,
+        'features_used': len(features_for_model),
+        'features_list': list(features_for_model),
+        'num_layers': num_layers,
+        'num_neighbors': list(num_neighbors)[:num_layers]
+    }
+
+    if return_model:
+        models = {
+            'graphsage': model,
+            'data': data,
+            'embeddings': embeddings.numpy()
+        }
+        return result_df, summary, models
+
+    return result_df, summary
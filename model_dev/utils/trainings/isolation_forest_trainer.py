@@ -1,8 +1,29 @@
+import itertools
 import numpy as np #type: ignore
+import pandas as pd #type: ignore
+from joblib import Parallel, delayed #type: ignore
+from sklearn.metrics import roc_auc_score, average_precision_score #type: ignore
 from sklearn.preprocessing import StandardScaler #type: ignore
 from sklearn.decomposition import PCA #type: ignore
 from sklearn.ensemble import IsolationForest #type: ignore
 
+from utils.trainings.flat_isolation_forest import FlatIsolationForest
+from utils.trainings.score_calibration import ScoreCalibrator
+
+
+def _model_input(df, metadata, extra_features=None):
+    # Shallow copy: only new columns are added, the feature data is never duplicated
+    result_df = df.copy(deep=False)
+    features_for_model = list(metadata['features_for_model'])
+    extra_columns = []
+    if extra_features is not None:
+        extra_columns = [col for col in extra_features.columns if col != 'account_id']
+        result_df = result_df.merge(extra_features, on='account_id', how='left')
+        result_df[extra_columns] = result_df[extra_columns].fillna(0)
+        features_for_model += extra_columns
+    return result_df, features_for_model, extra_columns
+
+
 def train_isolation_forest(
         df, 
         metadata, 
@@ -10,7 +31,10 @@ def train_isolation_forest(
         n_estimators=200,                   
         apply_pca=True, 
         pca_components=0.95, 
-        return_model=False
+        return_model=False,
+        extra_features=None,
+        low_memory=False,
+        calibration_quantiles=1001
     ):
     """
     Apply standardization, optional PCA, and Isolation Forest for anomaly detection.
@@ -30,7 +54,16 @@ def train_isolation_forest(
     pca_components : float or int
         Number of components to keep (if float, fraction of variance to retain)
     return_model : bool
-        Whether to return the trained models along with results
+        Whether to return the trained models along with results (with extra_features,
+        the table itself is returned as models['extra_feature_table'])
+    extra_features : pandas.DataFrame, optional
+        Additional per-account model inputs keyed by account_id (e.g. node embeddings),
+        joined onto df and used next to metadata['features_for_model']
+    low_memory : bool
+        Build the model input as float32 and standardize it in place
+    calibration_quantiles : int
+        Size of the quantile table of training scores behind anomaly_probability
+        and anomaly_percentile
     
     Returns:
     --------
@@ -45,12 +78,15 @@ def train_isolation_forest(
     print("✅ Training Isolation Forest")
     print("**"*50)
 
-    result_df = df.copy()
-    features_for_model = metadata['features_for_model']
+    result_df, features_for_model, extra_columns = _model_input(df, metadata, extra_features)
     
     print("✅ Step 1: Standardize the features")
-    scaler = StandardScaler()
-    X = scaler.fit_transform(result_df[features_for_model])
+    if low_memory:
+        scaler = StandardScaler(copy=False)
+        X = scaler.fit_transform(result_df[features_for_model].to_numpy(dtype=np.float32))
+    else:
+        scaler = StandardScaler()
+        X = scaler.fit_transform(result_df[features_for_model])
     
     print("✅ Step 2: Apply PCA if requested")
     pca_model = None
@@ -76,21 +112,22 @@ def train_isolation_forest(
     
     iso_forest.fit(X)
     
-    # Get anomaly scores (-1 = anomaly, 1 = normal)
-    raw_predictions = iso_forest.predict(X)
-    # Get decision function scores (lower = more anomalous)
-    decision_scores = iso_forest.decision_function(X)
+    # Array-backed copy of the trees: flags and decision scores (lower = more anomalous)
+    # from a single traversal
+    scorer = FlatIsolationForest.from_sklearn(iso_forest)
+    anomaly_flags, decision_scores, _ = scorer.score(X, n_jobs=-1)
+    # Quantile table of the training scores, so any later batch gets the same probability scale
+    calibrator = ScoreCalibrator.from_scores(decision_scores, n_quantiles=calibration_quantiles)
+    scorer.score_range = calibrator.score_range
     
     print("✅ Step 4: Add results to DataFrame")
-    result_df['anomaly_flag'] = raw_predictions == -1
+    result_df['anomaly_flag'] = anomaly_flags
     result_df['anomaly_score'] = decision_scores
     
-    # Convert to probability (0-1 where 1 = most anomalous)
-    min_score = min(decision_scores)
-    max_score = max(decision_scores)
-    result_df['anomaly_probability'] = 1 - (decision_scores - min_score) / (max_score - min_score)
-    # Add percentile rank
-    result_df['anomaly_percentile'] = result_df['anomaly_probability'].rank(pct=True) * 100
+    # Probability (0-1 where 1 = most anomalous)
+    result_df['anomaly_probability'] = calibrator.probability(decision_scores)
+    # Percentile against the training distribution
+    result_df['anomaly_percentile'] = calibrator.percentile(decision_scores)
     
     print("✅ Step 5: Generate summary information")
     summary = {
@@ -108,10 +145,162 @@ def train_isolation_forest(
     if return_model:
         models = {
             'scaler': scaler,
-            'isolation_forest': iso_forest
+            'isolation_forest': iso_forest,
+            'scorer': scorer,
+            'calibrator': calibrator,
+            'features': features_for_model,
+            'extra_features': extra_columns
         }
+        if extra_features is not None:
+            # Scoring joins the same table, so it travels with the models
+            models['extra_feature_table'] = extra_features
         if apply_pca:
             models['pca'] = pca_model
         return result_df, summary, models
 
-    return result_df, summary
\ No newline at end of file
+    return result_df, summary
+
+
+def _fit_raw_scores(X, n_estimators, max_features, random_state=42):
+    # One forest per structural setting; contamination only moves the threshold on these scores
+    iso_forest = IsolationForest(
+        n_estimators=n_estimators,
+        max_samples='auto',
+        max_features=max_features,
+        bootstrap=True,
+        n_jobs=1,
+        random_state=random_state
+    )
+    iso_forest.fit(X)
+    return FlatIsolationForest.from_sklearn(iso_forest).score_samples(X)
+
+
+def tune_isolation_forest(
+        df,
+        metadata,
+        contamination_grid=(0.01, 0.02, 0.05, 0.1),
+        n_estimators_grid=(200,),
+        max_features_grid=(0.8,),
+        pca_components_grid=(0.95,),
+        apply_pca=True,
+        label_column='is_anomalies_account',
+        extra_features=None,
+        n_jobs=-1,
+        return_scores=False
+    ):
+    """
+    Compare Isolation Forest settings without refitting for every contamination value.
+
+    The scaler is fitted once, PCA once per pca_components value, and the forest once
+    per structural setting (n_estimators, max_features, pca_components), the forests
+    fanned out over a joblib process pool. Contamination only sets the threshold on the
+    raw scores: like IsolationForest, a contamination c flags the accounts whose
+    score_samples fall below its 100 * c percentile, so the whole contamination grid is
+    evaluated on the cached scores.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Preprocessed DataFrame from preprocess_transaction_data function
+    metadata : dict
+        Preprocessing metadata from preprocess_transaction_data function
+    contamination_grid : iterable
+        Contamination values to evaluate, floats or 'auto'
+    n_estimators_grid : iterable
+        Numbers of trees to try
+    max_features_grid : iterable
+        max_features values to try
+    pca_components_grid : iterable
+        PCA settings to try (if float, fraction of variance to retain), ignored without PCA
+    apply_pca : bool
+        Whether to apply PCA for dimensionality reduction
+    label_column : str
+        Ground truth column (1 = anomaly) for the quality metrics, skipped when absent
+    extra_features : pandas.DataFrame, optional
+        Additional per-account model inputs keyed by account_id, as in train_isolation_forest
+    n_jobs : int
+        joblib workers fitting the structural settings in parallel
+    return_scores : bool
+        Whether to also return the raw scores per structural setting
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per (structural setting, contamination) with the threshold, the flagged
+        accounts and, with labels, precision / recall / f1 plus the threshold-free
+        roc_auc and average_precision of the setting
+    dict (optional)
+        {(n_estimators, max_features, pca_components): score_samples} if return_scores=True
+    """
+    print("**"*50)
+    print("✅ Tuning Isolation Forest")
+    print("**"*50)
+
+    result_df, features_for_model, _ = _model_input(df, metadata, extra_features)
+
+    print("✅ Step 1: Standardize the features and apply PCA once per setting")
+    X_scaled = StandardScaler().fit_transform(result_df[features_for_model])
+    if not apply_pca:
+        pca_components_grid = (None,)
+    transformed = {}
+    pca_components_used = {}
+    for pca_components in pca_components_grid:
+        if pca_components is None:
+            transformed[pca_components] = X_scaled
+            pca_components_used[pca_components] = X_scaled.shape[1]
+        else:
+            pca_model = PCA(n_components=pca_components)
+            transformed[pca_components] = pca_model.fit_transform(X_scaled)
+            pca_components_used[pca_components] = pca_model.n_components_
+
+    print("✅ Step 2: Fit one forest per structural setting")
+    settings = list(itertools.product(n_estimators_grid, max_features_grid, pca_components_grid))
+    raw_scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_raw_scores)(transformed[pca_components], n_estimators, max_features)
+        for n_estimators, max_features, pca_components in settings
+    )
+    scores = dict(zip(settings, raw_scores))
+
+    print("✅ Step 3: Evaluate every contamination on the cached scores")
+    y_true = None
+    if label_column in result_df.columns:
+        y_true = result_df[label_column].fillna(0).to_numpy() == 1
+        if y_true.all() or not y_true.any():
+            y_true = None
+
+    rows = []
+    for (n_estimators, max_features, pca_components), score in scores.items():
+        setting = {
+            'n_estimators': n_estimators,
+            'max_features': max_features,
+            'pca_components': pca_components,
+            'pca_components_used': pca_components_used[pca_components]
+        }
+        if y_true is not None:
+            # Lower score = more anomalous
+            setting['roc_auc'] = roc_auc_score(y_true, -score)
+            setting['average_precision'] = average_precision_score(y_true, -score)
+        for contamination in contamination_grid:
+            # Same offset_ as IsolationForest.fit
+            threshold = -0.5 if contamination == 'auto' else np.percentile(score, 100.0 * contamination)
+            flagged = score < threshold
+            row = {
+                **setting,
+                'contamination': contamination,
+                'threshold': threshold,
+                'accounts_flagged_as_anomalies': int(flagged.sum()),
+                'anomaly_rate': flagged.mean()
+            }
+            if y_true is not None:
+                true_positives = (flagged & y_true).sum()
+                precision = true_positives / flagged.sum() if flagged.any() else 0.0
+                recall = true_positives / y_true.sum()
+                row['precision'] = precision
+                row['recall'] = recall
+                row['f1'] = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+            rows.append(row)
+
+    comparison = pd.DataFrame(rows)
+    if return_scores:
+        return comparison, scores
+    return comparison
@@ -0,0 +1,295 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import re
+import shutil
+import tempfile
+import time
+import joblib #type: ignore
+import numpy as np #type: ignore
+import pandas as pd #type: ignore
+import pyarrow.feather as feather #type: ignore
+
+from utils.trainings.flat_isolation_forest import FlatIsolationForest
+from utils.trainings.score_calibration import ScoreCalibrator
+
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+
+
+def frame_fingerprint(df: pd.DataFrame, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Row count plus a content hash of the training frame (or of ``columns`` of it).
+    """
+    frame = df if columns is None else df[columns]
+    row_hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return {
+        "rows": len(frame),
+        "columns": list(frame.columns),
+        "sha256": hashlib.sha256(row_hashes.tobytes()).hexdigest()
+    }
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+class ModelRegistry:
+    """
+    Versioned on-disk bundles of the models returned by ``train_isolation_forest``.
+
+    Every version is a directory ``<registry_dir>/<name>/v0001``, ... holding:
+
+    - ``arrays/*.npy``: the flattened forest of the scorer, loaded as read-only memory
+      maps so scoring processes on one host share the page cache instead of each
+      holding its own copy
+    - ``estimators.joblib``: scaler and PCA (small), plus the sklearn forest itself
+      when ``save_estimator`` is set, loaded only on request
+    - ``calibrator.json``: the quantile table behind the probabilities
+    - ``extra_features.feather``: the per-account table joined onto the features at
+      training time (e.g. node embeddings), when the model uses one
+    - ``metadata.json``: the feature engineering metadata (feature list, to_drop, ...)
+    - ``manifest.json``: version, creation time, features, fingerprints and metrics
+
+    A version is written to a temporary directory and renamed into place, so readers
+    never see a partial bundle. ``load()`` resolves the pinned version if there is
+    one, the latest otherwise.
+    """
+
+    def __init__(self, registry_dir: str = "./model_registry", name: str = "isolation_forest"):
+        self.name = name
+        self.model_dir = os.path.join(registry_dir, name)
+        os.makedirs(self.model_dir, exist_ok=True)
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.model_dir, version)
+
+    @property
+    def _pin_path(self) -> str:
+        return os.path.join(self.model_dir, "PINNED")
+
+    def versions(self) -> List[str]:
+        """
+        Saved versions, oldest first.
+        """
+        versions = [entry for entry in os.listdir(self.model_dir) if VERSION_PATTERN.match(entry)]
+        return sorted(versions, key=lambda version: int(VERSION_PATTERN.match(version).group(1)))
+
+    def latest(self) -> Optional[str]:
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def pinned(self) -> Optional[str]:
+        if not os.path.exists(self._pin_path):
+            return None
+        with open(self._pin_path) as f:
+            return f.read().strip() or None
+
+    def pin(self, version: str):
+        """
+        Serve ``version`` from ``load()`` until ``unpin()``, whatever is saved later.
+        """
+        if not os.path.isdir(self._version_dir(version)):
+            raise ValueError(f"Unknown {self.name} version {version}")
+        with open(self._pin_path, "w") as f:
+            f.write(version)
+        logging.info(f"Pinned {self.name} {version}")
+
+    def unpin(self):
+        if os.path.exists(self._pin_path):
+            os.remove(self._pin_path)
+
+    def resolve(self, version: Optional[str] = None) -> str:
+        """
+        ``version`` itself, "latest", or by default the pinned version falling back to the latest.
+        """
+        if version is None:
+            version = self.pinned() or "latest"
+        if version == "latest":
+            version = self.latest()
+            if version is None:
+                raise FileNotFoundError(f"No {self.name} versions in {self.model_dir}")
+        if not os.path.isdir(self._version_dir(version)):
+            raise FileNotFoundError(f"Unknown {self.name} version {version}")
+        return version
+
+    def save(
+            self,
+            models: Dict[str, Any],
+            metadata: Dict[str, Any],
+            fingerprint: Optional[Dict[str, Any]] = None,
+            metrics: Optional[Dict[str, Any]] = None,
+            training_df: Optional[pd.DataFrame] = None,
+            save_estimator: bool = False
+        ) -> str:
+        """
+        Store a trained bundle as a new version.
+
+        Parameters:
+        -----------
+        models : dict
+            Models from train_isolation_forest(return_model=True); models with
+            extra_features need models['extra_feature_table'] to be scored later
+        metadata : dict
+            Metadata from apply_feature_engineering
+        fingerprint : dict, optional
+            Graph fingerprint of the training snapshot
+        metrics : dict, optional
+            Training summary or evaluation metrics
+        training_df : pandas.DataFrame, optional
+            Training frame, hashed over the model features into the manifest
+        save_estimator : bool
+            Also pickle the sklearn IsolationForest (not needed for scoring)
+
+        Returns:
+        --------
+        str
+            The new version, e.g. "v0003"
+        """
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.model_dir)
+        try:
+            # mkdtemp is owner-only, scoring workers may run as other users
+            os.chmod(staging_dir, 0o755)
+            arrays, scorer_params = models['scorer'].to_arrays()
+            os.makedirs(os.path.join(staging_dir, "arrays"))
+            for array_name, array in arrays.items():
+                np.save(os.path.join(staging_dir, "arrays", f"{array_name}.npy"), np.ascontiguousarray(array))
+
+            estimators = {key: models[key] for key in ('scaler', 'pca') if key in models}
+            if save_estimator:
+                estimators['isolation_forest'] = models['isolation_forest']
+            joblib.dump(estimators, os.path.join(staging_dir, "estimators.joblib"))
+            models['calibrator'].save(os.path.join(staging_dir, "calibrator.json"))
+            extra_feature_table = models.get('extra_feature_table')
+            if models.get('extra_features') and extra_feature_table is None:
+                raise ValueError("The models use extra features but models['extra_feature_table'] is missing")
+            if extra_feature_table is not None:
+                feather.write_feather(extra_feature_table.reset_index(drop=True), os.path.join(staging_dir, "extra_features.feather"))
+            with open(os.path.join(staging_dir, "metadata.json"), "w") as f:
+                json.dump(metadata, f, default=_json_default)
+
+            features = list(models.get('features', metadata['features_for_model']))
+            manifest = {
+                "name": self.name,
+                "created_at": time.time(),
+                "features": features,
+                "extra_features": list(models.get('extra_features', [])),
+                "extra_feature_fingerprint": None if extra_feature_table is None else frame_fingerprint(extra_feature_table),
+                "to_drop": list(metadata.get('highly_correlated_features', [])),
+                "fingerprint": fingerprint,
+                "data_fingerprint": None,
+                "metrics": metrics,
+                "scorer": scorer_params,
+                "estimators": sorted(estimators)
+            }
+            if training_df is not None:
+                manifest["data_fingerprint"] = frame_fingerprint(training_df, [col for col in features if col in training_df.columns])
+
+            # Claim the next free version; a concurrent writer taking it makes the rename fail
+            while True:
+                latest = self.latest()
+                version = f"v{(int(latest[1:]) if latest else 0) + 1:04d}"
+                manifest["version"] = version
+                with open(os.path.join(staging_dir, "manifest.json"), "w") as f:
+                    json.dump(manifest, f, indent=2, default=_json_default)
+                try:
+                    os.rename(staging_dir, self._version_dir(version))
+                    break
+                except OSError:
+                    if not os.path.isdir(self._version_dir(version)):
+                        raise
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        print(f"✅ Saved {self.name} {version} to the model registry")
+        return version
+
+    def manifest(self, version: Optional[str] = None) -> Dict[str, Any]:
+        with open(os.path.join(self._version_dir(self.resolve(version)), "manifest.json")) as f:
+            return json.load(f)
+
+    def load(
+            self,
+            version: Optional[str] = None,
+            mmap: bool = True,
+            load_estimator: bool = False
+        ) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        """
+        Load a version (by default the pinned one, else the latest).
+
+        Parameters:
+        -----------
+        version : str, optional
+            "v0003", "latest" or None
+        mmap : bool
+            Memory-map the scorer arrays (and the extra feature table) read-only instead of
+            reading them into memory
+        load_estimator : bool
+            Also unpickle the sklearn IsolationForest, if it was saved
+
+        Returns:
+        --------
+        tuple
+            (models, metadata, manifest), models in the layout of
+            train_isolation_forest(return_model=True), including
+            models['extra_feature_table'] when the version has one
+        """
+        version = self.resolve(version)
+        version_dir = self._version_dir(version)
+        with open(os.path.join(version_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        with open(os.path.join(version_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+
+        arrays = {
+            array_name: np.load(os.path.join(version_dir, "arrays", f"{array_name}.npy"), mmap_mode="r" if mmap else None)
+            for array_name in FlatIsolationForest.ARRAYS
+        }
+        estimators = joblib.load(os.path.join(version_dir, "estimators.joblib"))
+        models = {
+            'scaler': estimators['scaler'],
+            'scorer': FlatIsolationForest.from_arrays(arrays, manifest['scorer']),
+            'calibrator': ScoreCalibrator.load(os.path.join(version_dir, "calibrator.json")),
+            'features': manifest['features'],
+            'extra_features': manifest['extra_features']
+        }
+        if 'pca' in estimators:
+            models['pca'] = estimators['pca']
+        extra_features_path = os.path.join(version_dir, "extra_features.feather")
+        if os.path.exists(extra_features_path):
+            models['extra_feature_table'] = feather.read_feather(extra_features_path, memory_map=mmap)
+        if load_estimator:
+            if 'isolation_forest' not in estimators:
+                raise ValueError(f"{self.name} {version} was saved without the sklearn estimator")
+            models['isolation_forest'] = estimators['isolation_forest']
+        print(f"✅ Loaded {self.name} {version} from the model registry")
+        return models, metadata, manifest
+
+    def prune(self, keep: int = 5) -> List[str]:
+        """
+        Delete all but the ``keep`` most recent versions (at least one), never the pinned one.
+
+        Returns:
+        --------
+        list
+            The deleted versions
+        """
+        if keep < 1:
+            # The latest version also numbers the next save, so it always stays
+            raise ValueError(f"keep must be at least 1, got {keep}")
+        pinned = self.pinned()
+        versions = self.versions()
+        removed = [version for version in versions[:max(len(versions) - keep, 0)] if version != pinned]
+        for version in removed:
+            shutil.rmtree(self._version_dir(version))
+            logging.info(f"Pruned {self.name} {version} from the model registry")
+        return removed
@@ -0,0 +1,263 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+import logging
+import numpy as np #type: ignore
+import pandas as pd #type: ignore
+import pyarrow as pa #type: ignore
+import pyarrow.parquet as pq #type: ignore
+from sklearn.preprocessing import StandardScaler #type: ignore
+from sklearn.decomposition import IncrementalPCA #type: ignore
+from sklearn.ensemble import IsolationForest #type: ignore
+
+from utils.trainings.flat_isolation_forest import FlatIsolationForest
+from utils.trainings.score_calibration import ScoreCalibrator
+
+ChunkSource = Union[str, Callable[[], Iterable[pd.DataFrame]]]
+
+
+def iter_feature_file(path: str, columns: Optional[List[str]] = None, chunk_rows: int = 100000) -> Iterator[pd.DataFrame]:
+    """
+    Stream a Parquet or Arrow IPC / Feather file (e.g. a feature cache entry) in chunks of at most ``chunk_rows`` rows.
+    """
+    if path.endswith(".parquet"):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    for index in range(reader.num_record_batches):
+        batch = reader.get_batch(index)
+        if columns is not None:
+            batch = batch.select(columns)
+        for start in range(0, batch.num_rows, chunk_rows):
+            yield batch.slice(start, chunk_rows).to_pandas()
+
+
+def _chunks(source: ChunkSource, columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    chunks = iter_feature_file(source, columns, chunk_rows) if isinstance(source, str) else source()
+    return (chunk for chunk in chunks if len(chunk))
+
+
+def _blocks_of_at_least(blocks: Iterable[np.ndarray], min_rows: int) -> Iterator[np.ndarray]:
+    # Regroup row blocks so each has at least min_rows rows (IncrementalPCA needs >= n_components per call);
+    # the last full block is held back so a short tail can be appended to it
+    buffered, buffered_rows, pending = [], 0, None
+    for block in blocks:
+        buffered.append(block)
+        buffered_rows += len(block)
+        if buffered_rows >= min_rows:
+            if pending is not None:
+                yield pending
+            pending = np.concatenate(buffered) if len(buffered) > 1 else buffered[0]
+            buffered, buffered_rows = [], 0
+    if buffered:
+        tail = np.concatenate(buffered)
+        pending = tail if pending is None else np.concatenate([pending, tail])
+    if pending is not None:
+        yield pending
+
+
+class ReservoirSample:
+    """
+    Uniform sample of ``size`` rows from a stream of row blocks (Algorithm R, vectorized per block).
+    """
+
+    def __init__(self, size: int, n_features: int, seed: Optional[int] = None):
+        self.size = size
+        self.rows = np.empty((size, n_features), dtype=np.float32)
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, block: np.ndarray) -> "ReservoirSample":
+        fill = min(max(self.size - self.seen, 0), len(block))
+        self.rows[self.seen:self.seen + fill] = block[:fill]
+        rest = block[fill:]
+        if len(rest):
+            # Row t (0-based) of the stream replaces a uniform slot of [0, t] when that slot is in the sample
+            positions = self.seen + fill + np.arange(len(rest))
+            slots = (self.rng.random(len(rest)) * (positions + 1)).astype(np.int64)
+            accepted = np.flatnonzero(slots < self.size)
+            # Of several rows drawing the same slot, the last one in stream order wins
+            _, last = np.unique(slots[accepted][::-1], return_index=True)
+            accepted = accepted[len(accepted) - 1 - last]
+            self.rows[slots[accepted]] = rest[accepted]
+        self.seen += len(block)
+        return self
+
+    @property
+    def sample(self) -> np.ndarray:
+        return self.rows[:min(self.seen, self.size)]
+
+
+def train_isolation_forest_out_of_core(
+        chunks: ChunkSource,
+        metadata,
+        contamination='auto',
+        n_estimators=200,
+        apply_pca=True,
+        pca_components=0.95,
+        sample_size=500000,
+        chunk_rows=100000,
+        calibration_quantiles=1001,
+        seed=42
+    ):
+    """
+    Fit scaler, PCA and Isolation Forest without holding the feature matrix in memory.
+
+    Two streaming passes over the data: the first fits the StandardScaler with
+    partial_fit, the second fits an IncrementalPCA on the standardized chunks while
+    keeping a reservoir sample of them. The forest only sees ``max_samples`` rows per
+    tree anyway, so it is fitted on the PCA-transformed reservoir sample, whose scores
+    also calibrate the probabilities. Memory is bounded by one chunk plus the sample
+    (``sample_size`` x features float32), whatever the number of accounts; score the
+    full data with ``score_out_of_core``.
+
+    Parameters:
+    -----------
+    chunks : str or callable
+        Path of a Parquet / Arrow IPC (Feather) file of engineered features, or a callable
+        returning a fresh iterable of engineered feature chunks (called twice)
+    metadata : dict
+        Preprocessing metadata, metadata['features_for_model'] are the model inputs
+    contamination : float or 'auto'
+        Expected proportion of outliers in the data or 'auto'
+    n_estimators : int
+        Number of trees in the Isolation Forest
+    apply_pca : bool
+        Whether to apply PCA for dimensionality reduction
+    pca_components : float or int
+        Number of components to keep (if float, fraction of variance to retain; all
+        components are fitted and the smallest prefix reaching it is kept)
+    sample_size : int
+        Rows in the reservoir sample the forest is fitted on
+    chunk_rows : int
+        Rows per chunk when reading from a file
+    calibration_quantiles : int
+        Size of the quantile table behind anomaly_probability and anomaly_percentile
+    seed : int
+        Seed of the reservoir sample and the forest
+
+    Returns:
+    --------
+    dict
+        Trained models, in the layout of train_isolation_forest(return_model=True)
+    dict
+        Summary information about the training
+    """
+    print("**"*50)
+    print("✅ Training Isolation Forest out of core")
+    print("**"*50)
+    features_for_model = list(metadata['features_for_model'])
+
+    print("✅ Step 1: Fit the scaler chunk by chunk")
+    scaler = StandardScaler()
+    total_rows = 0
+    for chunk in _chunks(chunks, features_for_model, chunk_rows):
+        scaler.partial_fit(chunk[features_for_model])
+        total_rows += len(chunk)
+    if not total_rows:
+        raise ValueError("No chunks to train on")
+
+    print("✅ Step 2: Fit PCA chunk by chunk and keep a reservoir sample")
+    reservoir = ReservoirSample(min(sample_size, total_rows), len(features_for_model), seed=seed)
+    pca_model = None
+    if apply_pca:
+        n_components = pca_components if isinstance(pca_components, int) else len(features_for_model)
+        pca_model = IncrementalPCA(n_components=n_components)
+
+    def scaled_blocks():
+        for chunk in _chunks(chunks, features_for_model, chunk_rows):
+            block = scaler.transform(chunk[features_for_model]).astype(np.float32)
+            reservoir.update(block)
+            yield block
+
+    if pca_model is None:
+        for _ in scaled_blocks():
+            pass
+    else:
+        for block in _blocks_of_at_least(scaled_blocks(), pca_model.n_components):
+            pca_model.partial_fit(block)
+        if isinstance(pca_components, float):
+            # Same choice as PCA(n_components=float): smallest k whose explained variance exceeds the fraction
+            cumulative = np.cumsum(pca_model.explained_variance_ratio_)
+            k = min(int(np.searchsorted(cumulative, pca_components, side="right")) + 1, pca_model.n_components_)
+            for attribute in ('components_', 'explained_variance_', 'explained_variance_ratio_', 'singular_values_'):
+                setattr(pca_model, attribute, getattr(pca_model, attribute)[:k])
+            pca_model.n_components = pca_model.n_components_ = k
+    logging.info(f"Reservoir sample of {len(reservoir.sample)} out of {reservoir.seen} rows")
+
+    print("✅ Step 3: Fit the Isolation Forest on the sample")
+    X_sample = reservoir.sample
+    if pca_model is not None:
+        X_sample = pca_model.transform(X_sample)
+    iso_forest = IsolationForest(
+        n_estimators=n_estimators,
+        max_samples='auto',
+        contamination=contamination,
+        max_features=0.8,
+        bootstrap=True,
+        n_jobs=-1,
+        random_state=seed
+    )
+    iso_forest.fit(X_sample)
+    scorer = FlatIsolationForest.from_sklearn(iso_forest)
+    sample_flags, sample_scores, _ = scorer.score(X_sample, n_jobs=-1)
+    calibrator = ScoreCalibrator.from_scores(sample_scores, n_quantiles=calibration_quantiles)
+    scorer.score_range = calibrator.score_range
+
+    print("✅ Step 4: Generate summary information")
+    summary = {
+        'total_accounts': reservoir.seen,
+        'sample_accounts': len(X_sample),
+        'sample_anomaly_rate': float(sample_flags.mean()),
+        'features_used': len(features_for_model),
+        'features_list': features_for_model,
+    }
+    if pca_model is not None:
+        summary['pca_explained_variance'] = float(np.sum(pca_model.explained_variance_ratio_))
+        summary['pca_components_used'] = pca_model.n_components_
+
+    models = {
+        'scaler': scaler,
+        'isolation_forest': iso_forest,
+        'scorer': scorer,
+        'calibrator': calibrator,
+        'features': features_for_model,
+        'extra_features': []
+    }
+    if pca_model is not None:
+        models['pca'] = pca_model
+    return models, summary
+
+
+def score_out_of_core(
+        chunks: ChunkSource,
+        models,
+        id_columns=('account_id',),
+        chunk_rows=100000
+    ) -> Iterator[pd.DataFrame]:
+    """
+    Score every row in one streaming pass.
+
+    Yields:
+    -------
+    pandas.DataFrame
+        Per chunk, the id columns plus anomaly_flag, anomaly_score, anomaly_probability
+        and anomaly_percentile
+    """
+    features = list(models['features'])
+    columns = list(id_columns) + [col for col in features if col not in id_columns]
+    for chunk in _chunks(chunks, columns, chunk_rows):
+        X = models['scaler'].transform(chunk[features])
+        if 'pca' in models:
+            X = models['pca'].transform(X)
+        anomaly_flags, decision_scores, _ = models['scorer'].score(X)
+        scored = chunk[list(id_columns)].reset_index(drop=True)
+        scored['anomaly_flag'] = anomaly_flags
+        scored['anomaly_score'] = decision_scores
+        scored['anomaly_probability'] = models['calibrator'].probability(decision_scores)
+        scored['anomaly_percentile'] = models['calibrator'].percentile(decision_scores)
+        yield scored
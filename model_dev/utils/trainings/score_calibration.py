@@ -0,0 +1,132 @@
+import sys
+import os
+from dotenv import load_dotenv #type: ignore
+load_dotenv(override=True)
+sys.path.append(os.getenv("PROJECT_PATH"))
+from typing import Any, Dict, Tuple
+import json
+import numpy as np #type: ignore
+
+
+class ScoreCalibrator:
+    """
+    Fixed quantile table of the decision score distribution, used to turn raw
+    Isolation Forest scores into a probability and percentile that do not depend
+    on the rest of the batch.
+
+    The table holds the scores at ``n_quantiles`` evenly spaced levels (the first
+    and last being the min and max) plus the number of scores behind it. A score's
+    CDF is a binary search plus linear interpolation between the two surrounding
+    quantiles, so each row costs O(log n_quantiles). Two tables merge by averaging
+    their piecewise-linear CDFs weighted by count and reading the result back at
+    the same levels, which is also how new scored batches are folded in.
+    """
+
+    def __init__(self, n_quantiles: int = 1001):
+        if n_quantiles < 2:
+            raise ValueError("A quantile table needs at least 2 quantiles")
+        self.levels = np.linspace(0.0, 1.0, n_quantiles)
+        self.quantiles = None
+        self.count = 0
+
+    @classmethod
+    def from_scores(cls, scores: np.ndarray, n_quantiles: int = 1001) -> "ScoreCalibrator":
+        calibrator = cls(n_quantiles)
+        scores = np.asarray(scores, dtype=np.float64)
+        scores = scores[np.isfinite(scores)]
+        if len(scores):
+            calibrator.quantiles = np.quantile(scores, calibrator.levels)
+            calibrator.count = len(scores)
+        return calibrator
+
+    @property
+    def score_range(self) -> Tuple[float, float]:
+        return float(self.quantiles[0]), float(self.quantiles[-1])
+
+    def _check_fitted(self):
+        if self.quantiles is None:
+            raise ValueError("ScoreCalibrator has not seen any scores")
+
+    def _knots(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Tied quantiles collapse to one knot at their middle level, like rank(pct=True) for ties
+        values, first, counts = np.unique(self.quantiles, return_index=True, return_counts=True)
+        return values, (self.levels[first] + self.levels[first + counts - 1]) / 2
+
+    def cdf(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Share of the calibration scores below each score, 0 under the min and 1 over the max.
+        """
+        self._check_fitted()
+        values, levels = self._knots()
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(values) == 1:
+            return np.where(scores < values[0], 0.0, np.where(scores > values[0], 1.0, 0.5))
+        return np.interp(scores, values, levels, left=0.0, right=1.0)
+
+    def probability(self, scores: np.ndarray) -> np.ndarray:
+        """
+        0-1 anomaly probability (1 = most anomalous): the min-max rescale of
+        train_isolation_forest over the calibration min and max, clipped to [0, 1].
+        """
+        self._check_fitted()
+        min_score, max_score = self.score_range
+        scores = np.asarray(scores, dtype=np.float64)
+        if max_score <= min_score:
+            return np.zeros(len(scores))
+        return np.clip(1 - (scores - min_score) / (max_score - min_score), 0.0, 1.0)
+
+    def percentile(self, scores: np.ndarray) -> np.ndarray:
+        """
+        0-100 anomaly percentile, the share of calibration scores that are less anomalous (higher).
+        """
+        return (1.0 - self.cdf(scores)) * 100
+
+    def merge(self, other: "ScoreCalibrator") -> "ScoreCalibrator":
+        """
+        Combine with a table over other scores (in place), keeping this table's levels.
+        """
+        if other.quantiles is None:
+            return self
+        if self.quantiles is None:
+            self.quantiles = np.interp(self.levels, other.levels, other.quantiles)
+            self.count = other.count
+            return self
+        knots = np.union1d(self.quantiles, other.quantiles)
+        total = self.count + other.count
+        merged_cdf = (self.count * self.cdf(knots) + other.count * other.cdf(knots)) / total
+        # Invert the merged CDF, each distinct CDF value once
+        merged_cdf, first = np.unique(merged_cdf, return_index=True)
+        self.quantiles = np.interp(self.levels, merged_cdf, knots[first])
+        self.quantiles[0], self.quantiles[-1] = knots[0], knots[-1]
+        self.count = total
+        return self
+
+    def update(self, scores: np.ndarray) -> "ScoreCalibrator":
+        """
+        Fold in a newly scored batch (in place).
+        """
+        return self.merge(ScoreCalibrator.from_scores(scores, len(self.levels)))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'n_quantiles': len(self.levels),
+            'quantiles': None if self.quantiles is None else self.quantiles.tolist(),
+            'count': self.count
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> "ScoreCalibrator":
+        calibrator = cls(state['n_quantiles'])
+        if state.get('quantiles') is not None:
+            calibrator.quantiles = np.asarray(state['quantiles'], dtype=np.float64)
+        calibrator.count = state.get('count', 0)
+        return calibrator
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "ScoreCalibrator":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))